@@ -11,11 +11,12 @@ from mangum import Mangum
 from fastapi.responses import JSONResponse
 from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
 
-from app.common.utils.base_graphql import BaseGraphQLApp
 from app.common.utils.route_helper import find_current_user, path_join
 from app.common.models.icpdao import init_mongo
+from app.controllers.github_http import install_github_session
 from app.routes import Query, Mutations
 from app.common.schema.icpdao import UserSchema, DAOSchema, DAOJobConfigSchema
+from app.routes.graphql_app import GraphQLApp
 from app.routes.webhooks import GithubWebhooksApp
 
 prefix = ''
@@ -28,9 +29,12 @@ graph_schema = graphene.Schema(
     query=Query, mutation=Mutations,
     types=[UserSchema, DAOSchema, DAOJobConfigSchema])
 
+if settings.ICPDAO_GITHUB_HTTP_KEEPALIVE:
+    install_github_session()
+
 app = FastAPI()
 
-app.add_route(graph_route, BaseGraphQLApp(
+app.add_route(graph_route, GraphQLApp(
     schema=graph_schema
 ))
 
@@ -0,0 +1,120 @@
+"""
+按 Cycle 的时间字段找到所有 dao 里到期的 cycle 任务，并行运行
+
+pair   pair_begin_at <= now < pair_end_at，还没有 pair 过
+stat   vote_end_at < now，已经 pair 过，还没有统计和发布
+pair 和 stat 失败后隔一段时间重试，失败次数有上限
+publish 只运行 owner 已经创建、还在 INIT 的发布任务，不会自动发布（发布前 owner 可能还要调整 owner_ei）
+
+同一个 dao 的任务在一个 worker 里按 pair -> stat -> publish 顺序运行，不同 dao 的任务并行
+python -m app.controllers.cycle_scheduler [max_workers]
+"""
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import settings
+from app.common.models.icpdao.cycle import Cycle, CycleVoteResultPublishTask, CycleVoteResultPublishTaskStatus
+from app.controllers.task_runner import run_task_with_lease, TASK_MODELS
+
+TASK_ORDER = ['pair', 'vote_result_stat', 'vote_result_publish']
+
+
+def _get_or_create_task(name, cycle, now_at):
+    """
+    cycle 最新的任务还没有结束时直接使用，否则新建一个
+    最新的任务失败后 ICPDAO_TASK_LEASE_TTL 内不重试，失败的任务达到 ICPDAO_TASK_MAX_ATTEMPTS 个后不再新建，
+    最新的任务已经成功时也不再新建，这两种情况返回 None，需要 owner 处理
+    """
+    model, init_status, running_status, fail_status = TASK_MODELS[name]
+    old_task = model.objects(cycle_id=str(cycle.id)).order_by('-id').first()
+    if old_task and old_task.status in [init_status, running_status]:
+        return old_task
+    if old_task and old_task.status != fail_status:
+        print('cycle {} {} task {} is done, skip'.format(str(cycle.id), name, str(old_task.id)))
+        return None
+    if old_task and (old_task.update_at or 0) > now_at - settings.ICPDAO_TASK_LEASE_TTL:
+        return None
+    if model.objects(cycle_id=str(cycle.id), status=fail_status).count() >= settings.ICPDAO_TASK_MAX_ATTEMPTS:
+        print('cycle {} {} task fail too many times, skip'.format(str(cycle.id), name))
+        return None
+    return model(dao_id=cycle.dao_id, cycle_id=str(cycle.id)).save()
+
+
+def find_due_cycle_tasks(now_at=None):
+    """
+    返回 dao_id -> [(name, task_id), ...]，按 TASK_ORDER 排序
+    已经在运行中的任务也会返回，运行时拿不到租约会跳过
+    """
+    now_at = now_at or time.time()
+    dao_id_2_tasks = defaultdict(list)
+
+    for cycle in Cycle.objects(pair_begin_at__lte=now_at, pair_end_at__gt=now_at, paired_at=None):
+        task = _get_or_create_task('pair', cycle, now_at)
+        if task:
+            dao_id_2_tasks[cycle.dao_id].append(('pair', str(task.id)))
+
+    for cycle in Cycle.objects(
+            vote_end_at__lt=now_at, paired_at__ne=None,
+            vote_result_stat_at=None, vote_result_published_at=None):
+        task = _get_or_create_task('vote_result_stat', cycle, now_at)
+        if task:
+            dao_id_2_tasks[cycle.dao_id].append(('vote_result_stat', str(task.id)))
+
+    for task in CycleVoteResultPublishTask.objects(status=CycleVoteResultPublishTaskStatus.INIT.value):
+        dao_id_2_tasks[task.dao_id].append(('vote_result_publish', str(task.id)))
+
+    for tasks in dao_id_2_tasks.values():
+        tasks.sort(key=lambda item: TASK_ORDER.index(item[0]))
+    return dao_id_2_tasks
+
+
+def run_dao_tasks(tasks):
+    """
+    在一个 worker 里按顺序运行同一个 dao 的任务，返回失败的任务
+    """
+    # spawn 出来的新进程，重新 import app 时会初始化 mongo 连接
+    import app  # noqa: F401
+    fail_list = []
+    for name, task_id in tasks:
+        try:
+            run_task_with_lease(name, task_id)
+        except Exception as ex:
+            msg = traceback.format_exc()
+            print('exception log_exception' + str(ex))
+            print(msg)
+            fail_list.append((name, task_id))
+    return fail_list
+
+
+def run_due_cycle_tasks(max_workers=None, now_at=None):
+    """
+    返回 (运行的 dao 数量, 失败的任务)
+    """
+    dao_id_2_tasks = find_due_cycle_tasks(now_at)
+    if not dao_id_2_tasks:
+        return 0, []
+
+    max_workers = max_workers or settings.ICPDAO_CYCLE_SCHEDULER_WORKERS or os.cpu_count() or 1
+    max_workers = min(max_workers, len(dao_id_2_tasks))
+    fail_list = []
+    if max_workers == 1:
+        for tasks in dao_id_2_tasks.values():
+            fail_list.extend(run_dao_tasks(tasks))
+        return len(dao_id_2_tasks), fail_list
+
+    with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(run_dao_tasks, tasks) for tasks in dao_id_2_tasks.values()]
+        for future in as_completed(futures):
+            fail_list.extend(future.result())
+    return len(dao_id_2_tasks), fail_list
+
+
+if __name__ == '__main__':
+    dao_count, fail_list = run_due_cycle_tasks(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    print('run cycle tasks of {} dao, fail: {}'.format(dao_count, fail_list))
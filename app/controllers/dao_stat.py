@@ -0,0 +1,225 @@
+import decimal
+import sys
+import time
+from collections import defaultdict
+
+from pymongo import ReplaceOne
+
+from app.common.models.extension.decimal128_field import any_to_decimal
+from app.common.models.icpdao.base import TokenIncome
+from app.common.models.icpdao.dao import DAO, DAOFollow
+from app.common.models.icpdao.job import Job, JobStatusEnum
+from app.models.dao_stat import DAOStat
+
+DECIMAL_0 = decimal.Decimal('0')
+
+
+def _job_stat_match(dao_ids):
+    match = {'status': {'$ne': JobStatusEnum.AWAITING_MERGER.value}}
+    if dao_ids is not None:
+        match['dao_id'] = {'$in': dao_ids}
+    return match
+
+
+def _group_dao_incomes(dao_ids):
+    """
+    dao_id -> 所有 token 的 income 列表
+    """
+    dao_id_2_incomes = defaultdict(list)
+    query = Job._get_collection().aggregate([
+        {"$match": _job_stat_match(dao_ids)},
+        {"$unwind": "$incomes"},
+        {"$group": {
+            "_id": {
+                "dao_id": "$dao_id",
+                "token_chain_id": "$incomes.token_chain_id",
+                "token_address": "$incomes.token_address",
+                "token_symbol": "$incomes.token_symbol"
+            },
+            "income": {"$sum": "$incomes.income"}
+        }}
+    ])
+    for d in query:
+        dao_id_2_incomes[d['_id']['dao_id']].append(TokenIncome(
+            token_chain_id=d['_id']['token_chain_id'],
+            token_address=d['_id']['token_address'],
+            token_symbol=d['_id']['token_symbol'],
+            income=any_to_decimal(d['income'])
+        ))
+    return dao_id_2_incomes
+
+
+def job_stat_facets(token_chain_id):
+    """
+    job 的 icpper 数、job 数、size 和某条链上 incomes 的 $facet 子管道
+    """
+    return {
+        "icpper": [
+            {"$group": {"_id": "$user_id"}},
+            {"$count": "count"}
+        ],
+        "size": [
+            {"$group": {"_id": None, "size": {"$sum": "$size"}, "job": {"$sum": 1}}}
+        ],
+        "incomes": [
+            {"$unwind": "$incomes"},
+            {"$match": {"incomes.token_chain_id": token_chain_id}},
+            {"$group": {
+                "_id": {
+                    "token_chain_id": "$incomes.token_chain_id",
+                    "token_address": "$incomes.token_address",
+                    "token_symbol": "$incomes.token_symbol"
+                },
+                "income": {"$sum": "$incomes.income"}
+            }}
+        ]
+    }
+
+
+def parse_job_stat_facets(ret):
+    incomes = [TokenIncome(
+        token_chain_id=d['_id']['token_chain_id'],
+        token_address=d['_id']['token_address'],
+        token_symbol=d['_id']['token_symbol'],
+        income=any_to_decimal(d['income'])
+    ) for d in ret['incomes']]
+    income_sum = DECIMAL_0
+    for income in incomes:
+        income_sum += income.income
+    return {
+        'icpper': ret['icpper'][0]['count'] if ret['icpper'] else 0,
+        'job': ret['size'][0]['job'] if ret['size'] else 0,
+        'size': any_to_decimal(ret['size'][0]['size']) if ret['size'] else DECIMAL_0,
+        'incomes': incomes,
+        'income_sum': income_sum
+    }
+
+
+def stat_dao_jobs(dao_ids, token_chain_id):
+    """
+    一次 $facet 聚合统计 job 的 icpper 数、size 和某条链上的 incomes
+    dao_ids 为 None 时统计所有 job，不带 dao_id 条件
+    """
+    pipeline = []
+    if dao_ids is not None:
+        pipeline.append({"$match": {"dao_id": {"$in": list(dao_ids)}}})
+    pipeline.append({"$facet": job_stat_facets(token_chain_id)})
+    return parse_job_stat_facets(next(Job._get_collection().aggregate(pipeline)))
+
+
+def rebuild_dao_stats(dao_ids=None):
+    """
+    从 Job 和 DAOFollow 重新计算 dao_stat，用于补数据和修复漂移
+    dao_ids 为 None 时重建所有 dao
+    """
+    if dao_ids is None:
+        all_dao_ids = [str(i) for i in DAO.objects().distinct('_id')]
+    else:
+        all_dao_ids = [str(i) for i in dao_ids]
+    if not all_dao_ids:
+        return
+
+    follow_match = {}
+    if dao_ids is not None:
+        follow_match['dao_id'] = {'$in': all_dao_ids}
+    dao_id_2_following = {}
+    for d in DAOFollow._get_collection().aggregate([
+        {"$match": follow_match},
+        {"$group": {"_id": "$dao_id", "following": {"$sum": 1}}}
+    ]):
+        dao_id_2_following[d['_id']] = d['following']
+
+    job_dao_ids = None if dao_ids is None else all_dao_ids
+    dao_id_2_job_stat = {}
+    for d in Job._get_collection().aggregate([
+        {"$match": _job_stat_match(job_dao_ids)},
+        {"$group": {
+            "_id": "$dao_id",
+            "job": {"$sum": 1},
+            "size": {"$sum": "$size"},
+            "token": {"$sum": {"$sum": "$incomes.income"}}
+        }}
+    ]):
+        dao_id_2_job_stat[d['_id']] = d
+    dao_id_2_incomes = _group_dao_incomes(job_dao_ids)
+
+    now_at = int(time.time())
+    requests = []
+    for dao_id in all_dao_ids:
+        job_stat = dao_id_2_job_stat.get(dao_id, {})
+        doc = DAOStat(
+            dao_id=dao_id,
+            following=dao_id_2_following.get(dao_id, 0),
+            job=job_stat.get('job', 0),
+            size=any_to_decimal(job_stat.get('size', DECIMAL_0)),
+            token=any_to_decimal(job_stat.get('token', DECIMAL_0)),
+            incomes=dao_id_2_incomes.get(dao_id, []),
+            update_at=now_at
+        ).to_mongo().to_dict()
+        doc.pop('_id', None)
+        requests.append(ReplaceOne({'dao_id': dao_id}, doc, upsert=True))
+    DAOStat._get_collection().bulk_write(requests, ordered=False)
+
+
+def ensure_dao_stats(dao_ids=None):
+    """
+    给还没有 dao_stat 的 dao 补上统计，dao_ids 为 None 时检查所有 dao
+    """
+    if dao_ids is None:
+        all_dao_ids = [str(i) for i in DAO.objects().distinct('_id')]
+        exist_dao_ids = set(DAOStat.objects().distinct('dao_id'))
+    else:
+        all_dao_ids = [str(i) for i in dao_ids]
+        exist_dao_ids = set(DAOStat.objects(dao_id__in=all_dao_ids).distinct('dao_id'))
+    missing_dao_ids = [dao_id for dao_id in all_dao_ids if dao_id not in exist_dao_ids]
+    if missing_dao_ids:
+        rebuild_dao_stats(missing_dao_ids)
+
+
+def get_dao_stat(dao_id):
+    stat = DAOStat.objects(dao_id=dao_id).first()
+    if not stat:
+        rebuild_dao_stats([dao_id])
+        stat = DAOStat.objects(dao_id=dao_id).first()
+    return stat
+
+
+def inc_dao_stat(dao_id, following=0, job=0, size=DECIMAL_0):
+    """
+    增量更新，没有 dao_stat 的 dao 不处理，读取时会整体重建
+    """
+    inc = {}
+    if following:
+        inc['inc__following'] = following
+    if job:
+        inc['inc__job'] = job
+    if size:
+        inc['inc__size'] = size
+    if not inc:
+        return
+    DAOStat.objects(dao_id=dao_id).update_one(update_at=int(time.time()), **inc)
+
+
+def refresh_dao_stat_following(dao_id):
+    """
+    不经过 UpdateDAOFollow 的关注（比如创建 job 时自动关注）之后重新计数
+    """
+    DAOStat.objects(dao_id=dao_id).update_one(
+        following=DAOFollow.objects(dao_id=dao_id).count(), update_at=int(time.time()))
+
+
+def refresh_dao_stat_incomes(dao_id):
+    """
+    token mint 后 job incomes 是整体重算的，这里也整体重算 dao 的 incomes
+    """
+    incomes = _group_dao_incomes([dao_id]).get(dao_id, [])
+    token = DECIMAL_0
+    for income in incomes:
+        token += income.income
+    DAOStat.objects(dao_id=dao_id).update_one(
+        token=token, incomes=incomes, update_at=int(time.time()))
+
+
+if __name__ == '__main__':
+    # python -m app.controllers.dao_stat [dao_id ...]
+    rebuild_dao_stats(sys.argv[1:] or None)
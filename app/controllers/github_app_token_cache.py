@@ -0,0 +1,146 @@
+"""
+github app installation token 的两级缓存
+
+进程内缓存 -> GithubAppToken（mongo，多个 lambda 容器共用）-> GithubAppToken.get_token（签 JWT 换新 token）
+token 离过期不到 ICPDAO_GITHUB_APP_TOKEN_REFRESH_AHEAD 秒时提前换新，
+进程内每个 owner 一把锁，跨进程用 task_lease 保证同一时间只有一个地方在换；
+换新还是用 GithubAppToken.get_token，换之前把旧 token 记在租约上，
+换新期间没拿到租约的调用方从租约上取旧 token，在旧 token 过期前继续使用；
+换新失败时恢复 mongo 里的旧 token 并继续使用
+"""
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+import settings
+from app.common.models.icpdao.github_app_token import GithubAppToken
+from app.controllers.task_lease import acquire_lease, release_lease, new_lease_owner
+from app.models.task_lease import TaskLease
+
+LEASE_NAME = 'github_app_token'
+LEASE_TTL = 30
+
+# 单元测试里关闭（测试会直接修改 GithubAppToken），测试缓存本身时再打开
+enabled = os.environ.get('IS_UNITEST') != 'yes'
+
+_token_cache = {}
+_owner_locks = defaultdict(threading.Lock)
+_owner_locks_lock = threading.Lock()
+
+
+def _get_owner_lock(github_owner_id):
+    with _owner_locks_lock:
+        return _owner_locks[github_owner_id]
+
+
+def _is_fresh(expires_at):
+    return (expires_at or 0) - time.time() > settings.ICPDAO_GITHUB_APP_TOKEN_REFRESH_AHEAD
+
+
+def _is_valid(expires_at):
+    return (expires_at or 0) > time.time()
+
+
+def _mint_token(github_owner_name, github_owner_id):
+    return GithubAppToken.get_token(
+        app_id=settings.ICPDAO_GITHUB_APP_ID,
+        app_private_key=settings.ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY,
+        github_owner_name=github_owner_name,
+        github_owner_id=github_owner_id,
+    )
+
+
+def _get_lease_stale_token(github_owner_id):
+    """
+    正在换新的进程记在租约上的旧 token，已经过期时返回 None
+    """
+    lease = TaskLease._get_collection().find_one(
+        {'name': LEASE_NAME, 'task_id': str(github_owner_id), 'owner': {'$ne': None}},
+        {'stale_token': 1, 'stale_expires_at': 1}
+    )
+    if lease and lease.get('stale_token') and _is_valid(lease.get('stale_expires_at')):
+        return lease['stale_token']
+    return None
+
+
+def _refresh_token(github_owner_name, github_owner_id, record, lease_owner):
+    """
+    record 是 mongo 里已有的 token，返回 (token, expires_at)
+    换新失败时把 record 恢复原样后抛出异常
+    """
+    lease_query = {'name': LEASE_NAME, 'task_id': str(github_owner_id), 'owner': lease_owner}
+    TaskLease._get_collection().update_one(
+        lease_query, {'$set': {'stale_token': record.token, 'stale_expires_at': record.expires_at}})
+    try:
+        # 让 get_token 认为 mongo 里的 token 已经过期，重新换一个
+        GithubAppToken.objects(github_owner_id=github_owner_id, token=record.token).update_one(expires_at=0)
+        try:
+            token = _mint_token(github_owner_name, github_owner_id)
+        except Exception:
+            GithubAppToken.objects(github_owner_id=github_owner_id, token=record.token, expires_at=0).update_one(
+                expires_at=record.expires_at)
+            raise
+    finally:
+        TaskLease._get_collection().update_one(lease_query, {'$unset': {'stale_token': '', 'stale_expires_at': ''}})
+    new_record = GithubAppToken.objects(github_owner_id=github_owner_id).first()
+    return token, new_record.expires_at if new_record and new_record.token == token else None
+
+
+def get_app_token(github_owner_name, github_owner_id):
+    """
+    返回 installation token，没有安装 app 时返回 None
+    """
+    if not enabled:
+        return _mint_token(github_owner_name, github_owner_id)
+
+    item = _token_cache.get(github_owner_id)
+    if item and _is_fresh(item[1]):
+        return item[0]
+
+    with _get_owner_lock(github_owner_id):
+        item = _token_cache.get(github_owner_id)
+        if item and _is_fresh(item[1]):
+            return item[0]
+
+        record = GithubAppToken.objects(github_owner_id=github_owner_id).first()
+        if record and record.token and _is_fresh(record.expires_at):
+            _token_cache[github_owner_id] = (record.token, record.expires_at)
+            return record.token
+
+        stale_token = None
+        if record and record.token and _is_valid(record.expires_at):
+            stale_token = record.token
+
+        lease_owner = new_lease_owner()
+        if not acquire_lease(LEASE_NAME, str(github_owner_id), lease_owner, LEASE_TTL):
+            # 其他进程正在换新
+            stale_token = stale_token or _get_lease_stale_token(github_owner_id)
+            if stale_token:
+                return stale_token
+            return _mint_token(github_owner_name, github_owner_id)
+        try:
+            if record and record.token:
+                try:
+                    token, expires_at = _refresh_token(github_owner_name, github_owner_id, record, lease_owner)
+                except Exception as ex:
+                    if not stale_token:
+                        raise
+                    print('exception log_exception' + str(ex))
+                    print(traceback.format_exc())
+                    return stale_token
+            else:
+                token = _mint_token(github_owner_name, github_owner_id)
+                record = GithubAppToken.objects(github_owner_id=github_owner_id).first()
+                expires_at = record.expires_at if record and record.token == token else None
+        finally:
+            release_lease(LEASE_NAME, str(github_owner_id), lease_owner)
+
+        if token and expires_at:
+            _token_cache[github_owner_id] = (token, expires_at)
+        return token
+
+
+def invalidate_app_token(github_owner_id):
+    _token_cache.pop(github_owner_id, None)
@@ -0,0 +1,147 @@
+"""
+请求 github 用的共享 http 连接池
+
+app.common 里的 github_rest_api 和 GithubAppClient 直接调用 requests.get/post，每次都会新建连接。
+install_github_session 把这些模块里的 requests 换成 SessionRequests，
+请求走进程内共享的 requests.Session（keep-alive，每个 host 最多 ICPDAO_GITHUB_HTTP_POOL_SIZE 个连接）
+
+本地压测：python -m app.controllers.github_http bench [请求数]
+"""
+import importlib
+import sys
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import settings
+
+GITHUB_HTTP_MODULES = [
+    'app.common.utils.github_rest_api',
+    'app.common.utils.github_app.client',
+]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def new_session(pool_size=None):
+    pool_size = pool_size or settings.ICPDAO_GITHUB_HTTP_POOL_SIZE
+    session = requests.Session()
+    # 不同 installation 的请求共用 session，不保存 cookie
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_github_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = new_session()
+    return _session
+
+
+class SessionRequests:
+    """
+    和 requests 模块的用法一样，get/post 这些请求走共享的 session，其他属性直接取 requests 的
+    """
+
+    def __init__(self, session=None):
+        self._session = session
+
+    @property
+    def session(self):
+        return self._session or get_github_session()
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.request('OPTIONS', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('PATCH', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def install_github_session(session=None):
+    """
+    返回替换了的模块名
+    """
+    installed = []
+    for module_name in GITHUB_HTTP_MODULES:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        if getattr(module, 'requests', None) is requests:
+            module.requests = SessionRequests(session)
+            installed.append(module_name)
+    return installed
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"id": 1}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench(count=200):
+    """
+    本地 stub server 上比较每次新建连接和共享连接池的耗时
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}/orgs/icpdao'.format(server.server_address[1])
+    try:
+        result = {}
+        for name, client in [('requests', requests), ('session', SessionRequests(new_session()))]:
+            begin_at = time.time()
+            for _ in range(count):
+                client.get(url).json()
+            result[name] = time.time() - begin_at
+        return result
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    # python -m app.controllers.github_http bench [count]
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        for name, cost in bench(int(sys.argv[2]) if len(sys.argv) > 2 else 200).items():
+            print('{} {:.3f}s'.format(name, cost))
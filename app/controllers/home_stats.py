@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+
+from pymongo.errors import DuplicateKeyError
+
+from app.common.models.icpdao.dao import DAO
+from app.controllers.dao_stat import stat_dao_jobs
+from app.models.home_stats import HomeStatsSnapshot
+from settings import ICPDAO_HOME_STATS_TTL
+
+
+def _home_stats_ttl():
+    if os.environ.get('IS_UNITEST') == 'yes':
+        return 0
+    return ICPDAO_HOME_STATS_TTL
+
+
+def refresh_home_stats(token_chain_id):
+    """
+    重新统计首页数据并写入快照
+    """
+    # 和原来一样只统计还存在的 dao 的 job
+    all_dao_ids = [str(i) for i in DAO.objects().distinct('_id')]
+    stat = stat_dao_jobs(all_dao_ids, token_chain_id)
+    now_at = int(time.time())
+    snapshot = HomeStatsSnapshot(
+        token_chain_id=token_chain_id,
+        dao=len(all_dao_ids),
+        icpper=stat['icpper'],
+        size=stat['size'],
+        income_sum=stat['income_sum'],
+        incomes=stat['incomes'],
+        stat_at=now_at,
+        refresh_at=now_at
+    )
+    doc = snapshot.to_mongo().to_dict()
+    doc.pop('_id', None)
+    try:
+        HomeStatsSnapshot._get_collection().replace_one(
+            {'token_chain_id': token_chain_id}, doc, upsert=True)
+    except DuplicateKeyError:
+        # 并发的第一次统计，另一个请求已经写入
+        pass
+    return snapshot
+
+
+def get_home_stats(token_chain_id, background=None, ttl=None):
+    """
+    读取首页统计快照
+    没有快照时同步统计；快照过期时先返回旧数据，由 background 重新统计
+    ttl 为 None 时使用 ICPDAO_HOME_STATS_TTL（单元测试里为 0）
+    """
+    if ttl is None:
+        ttl = _home_stats_ttl()
+    if ttl <= 0:
+        return refresh_home_stats(token_chain_id)
+
+    snapshot = HomeStatsSnapshot.objects(token_chain_id=token_chain_id).first()
+    if not snapshot:
+        return refresh_home_stats(token_chain_id)
+
+    now_at = int(time.time())
+    if now_at - snapshot.stat_at < ttl:
+        return snapshot
+
+    # 只让一个请求触发重新统计
+    claimed = HomeStatsSnapshot.objects(
+        id=snapshot.id, refresh_at__lte=now_at - ttl
+    ).update_one(refresh_at=now_at)
+    if claimed:
+        if background is None:
+            return refresh_home_stats(token_chain_id)
+        background.add_task(refresh_home_stats, token_chain_id)
+    return snapshot
+
+
+if __name__ == '__main__':
+    # python -m app.controllers.home_stats token_chain_id
+    refresh_home_stats(sys.argv[1])
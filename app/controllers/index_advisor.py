@@ -0,0 +1,352 @@
+"""
+热点查询的索引
+
+HOT_QUERY_INDEXES 是声明的复合索引，HOT_QUERIES 是对应的典型查询
+python -m app.controllers.index_advisor scan    扫描 app/routes 和 app/controllers 里的查询，按 等值-排序-范围 输出建议的复合索引
+python -m app.controllers.index_advisor ensure  在 mongo 上创建声明的索引
+python -m app.controllers.index_advisor check   用 explain() 检查热点查询，有 COLLSCAN 时退出码为 1
+python -m app.controllers.index_advisor explain 用 explain() 检查扫描到的查询形态，输出 COLLSCAN 和内存排序的
+"""
+import ast
+import os
+import sys
+from collections import Counter, namedtuple
+
+from pymongo.errors import OperationFailure
+
+from app.common.models.icpdao.cycle import Cycle, CycleIcpperStat, CycleVote, CycleVoteConfirm
+from app.common.models.icpdao.dao import DAO, DAOFollow, DAOToken, DAOJobConfig
+from app.common.models.icpdao.job import Job, JobPR
+from app.common.models.icpdao.user import User
+
+MODELS = {model.__name__: model for model in [
+    Cycle, CycleIcpperStat, CycleVote, CycleVoteConfirm,
+    DAO, DAOFollow, DAOToken, DAOJobConfig,
+    Job, JobPR, User
+]}
+
+HOT_QUERY_INDEXES = {
+    'Job': [
+        ('dao_id', 'status'),
+        ('cycle_id', 'status'),
+        ('user_id', 'create_at'),
+        ('github_repo_id', 'github_issue_number'),
+    ],
+    'JobPR': [
+        ('job_id',),
+        ('github_repo_owner_id', 'github_repo_id', 'github_pr_number'),
+        ('github_repo_id', 'github_pr_id'),
+    ],
+    'CycleVote': [
+        ('cycle_id', 'voter_id', 'vote_type', 'vote_job_id'),
+    ],
+    'CycleIcpperStat': [
+        ('dao_id', 'user_id', 'create_at'),
+        ('cycle_id', 'user_id'),
+    ],
+    'CycleVoteConfirm': [
+        ('cycle_id', 'voter_id'),
+    ],
+    'Cycle': [
+        ('dao_id', 'begin_at'),
+    ],
+    'DAOFollow': [
+        ('dao_id', 'user_id'),
+        ('user_id',),
+    ],
+    'DAOToken': [
+        ('dao_id', 'token_chain_id'),
+    ],
+    'DAOJobConfig': [
+        ('dao_id',),
+    ],
+    'DAO': [
+        ('name',),
+        ('github_owner_name',),
+        ('github_owner_id',),
+    ],
+    'User': [
+        ('github_login',),
+        ('github_user_id',),
+    ],
+}
+
+# (model, filter, sort)
+HOT_QUERIES = [
+    ('Job', {'dao_id': '', 'status': {'$nin': [0]}}, None),
+    ('Job', {'cycle_id': '', 'status': {'$nin': [0]}}, None),
+    ('Job', {'user_id': ''}, [('create_at', -1)]),
+    ('Job', {'github_repo_id': 0, 'github_issue_number': 0}, None),
+    ('JobPR', {'job_id': ''}, None),
+    ('JobPR', {'github_repo_owner_id': 0, 'github_repo_id': 0, 'github_pr_number': 0}, None),
+    ('CycleVote', {'cycle_id': '', 'voter_id': '', 'vote_type': 0, 'vote_job_id': {'$exists': False}}, None),
+    ('CycleIcpperStat', {'dao_id': '', 'user_id': ''}, [('create_at', -1)]),
+    ('CycleIcpperStat', {'cycle_id': '', 'user_id': ''}, None),
+    ('CycleVoteConfirm', {'cycle_id': '', 'voter_id': ''}, None),
+    ('Cycle', {'dao_id': ''}, [('begin_at', -1)]),
+    ('DAOFollow', {'dao_id': '', 'user_id': ''}, None),
+    ('DAOFollow', {'user_id': ''}, None),
+    ('DAOToken', {'dao_id': '', 'token_chain_id': ''}, None),
+    ('DAOJobConfig', {'dao_id': ''}, None),
+    ('DAO', {'name': ''}, None),
+    ('User', {'github_login': ''}, None),
+]
+
+QUERY_OPERATORS = {
+    'ne', 'lt', 'lte', 'gt', 'gte', 'not', 'in', 'nin', 'mod', 'all', 'size', 'exists',
+    'exact', 'iexact', 'contains', 'icontains', 'startswith', 'istartswith',
+    'endswith', 'iendswith', 'match', 'elemMatch'
+}
+# 这些操作符按等值条件处理，其他的都按范围条件处理
+EQUALITY_OPERATORS = {None, 'exact', 'in'}
+
+SCAN_DIRS = ['app/routes', 'app/controllers']
+
+# 一种查询形态：等值字段、排序字段 [(field, 1/-1)]、范围字段
+QueryShape = namedtuple('QueryShape', ['model', 'equality', 'sort', 'range'])
+
+
+def _split_kwarg(kwarg):
+    """
+    dao_id -> ('dao_id', None)，create_at__lt -> ('create_at', 'lt')
+    """
+    parts = kwarg.split('__')
+    operator = None
+    if len(parts) > 1 and parts[-1] in QUERY_OPERATORS:
+        operator = parts.pop()
+    name = '.'.join(parts)
+    return '_id' if name in ['id', 'pk'] else name, operator
+
+
+def _field_name(kwarg):
+    return _split_kwarg(kwarg)[0]
+
+
+def _model_name(node):
+    """
+    Job.objects / JobModel.objects -> Job
+    """
+    if isinstance(node, ast.Attribute) and node.attr == 'objects' and isinstance(node.value, ast.Name):
+        name = node.value.id
+        if name not in MODELS and name.endswith('Model'):
+            name = name[:-len('Model')]
+        if name in MODELS:
+            return name
+    return None
+
+
+def _query_model(call):
+    """
+    Model.objects(...) / Model.objects.filter(...) / Model.objects(...).filter(...)
+    """
+    func = call.func
+    model = _model_name(func)
+    if model:
+        return model
+    if isinstance(func, ast.Attribute) and func.attr == 'filter':
+        target = func.value
+        if isinstance(target, ast.Call):
+            target = target.func
+        return _model_name(target)
+    return None
+
+
+def _sort_fields(call):
+    """
+    .order_by('-begin_at', 'id') -> (('begin_at', -1), ('_id', 1))，只处理字符串常量
+    """
+    sort = []
+    for arg in call.args:
+        if not (isinstance(arg, ast.Constant) and isinstance(arg.value, str)):
+            return ()
+        name = arg.value.lstrip('+-')
+        sort.append((_field_name(name), -1 if arg.value.startswith('-') else 1))
+    return tuple(sort)
+
+
+def _query_sorts(tree):
+    """
+    找到 order_by 作用的查询调用，返回 {id(查询调用): sort}
+    """
+    sorts = {}
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'order_by'):
+            continue
+        target = node.func.value
+        while isinstance(target, ast.Call):
+            if _query_model(target):
+                sorts[id(target)] = _sort_fields(node)
+                break
+            if not isinstance(target.func, ast.Attribute):
+                break
+            target = target.func.value
+    return sorts
+
+
+def _call_shape(call, model, sort):
+    equality, range_fields = [], []
+    for kw in call.keywords:
+        if not kw.arg:
+            continue
+        field, operator = _split_kwarg(kw.arg)
+        (equality if operator in EQUALITY_OPERATORS else range_fields).append(field)
+    equality = tuple(dict.fromkeys(equality))
+    range_fields = tuple(field for field in dict.fromkeys(range_fields) if field not in equality)
+    return QueryShape(model, equality, sort, range_fields)
+
+
+def scan_query_shapes(base_dir='.'):
+    """
+    返回 Counter{QueryShape: 次数}，只统计关键字参数形式的查询和字符串常量的 order_by
+    """
+    shapes = Counter()
+    for scan_dir in SCAN_DIRS:
+        for root, _, files in os.walk(os.path.join(base_dir, scan_dir)):
+            for file_name in files:
+                if not file_name.endswith('.py'):
+                    continue
+                with open(os.path.join(root, file_name)) as f:
+                    tree = ast.parse(f.read())
+                sorts = _query_sorts(tree)
+                for node in ast.walk(tree):
+                    if not isinstance(node, ast.Call):
+                        continue
+                    model = _query_model(node)
+                    if not model:
+                        continue
+                    shape = _call_shape(node, model, sorts.get(id(node), ()))
+                    if shape.equality or shape.sort or shape.range:
+                        shapes[shape] += 1
+    return shapes
+
+
+def propose_index(shape):
+    """
+    按 等值字段 -> 排序字段 -> 范围字段 的顺序组成复合索引
+    """
+    index = [(field, 1) for field in shape.equality]
+    index += [item for item in shape.sort if item[0] not in shape.equality]
+    used = {field for field, _ in index}
+    index += [(field, 1) for field in shape.range if field not in used]
+    return tuple(index)
+
+
+def _known_indexes(model_name):
+    """
+    HOT_QUERY_INDEXES 加上 model meta 里声明的索引，只取字段名
+    """
+    indexes = [tuple(index) for index in HOT_QUERY_INDEXES.get(model_name, [])]
+    for spec in MODELS[model_name]._meta.get('index_specs', []):
+        indexes.append(tuple(field for field, _ in spec['fields']))
+    return indexes
+
+
+def _covered(shape, indexes):
+    """
+    索引开头的若干字段都是等值字段，并且排序字段紧跟在这些字段后面时认为已覆盖
+    """
+    sort_fields = tuple(field for field, _ in shape.sort)
+    for index in indexes:
+        prefix_size = 0
+        while prefix_size < len(index) and index[prefix_size] in shape.equality:
+            prefix_size += 1
+        if not sort_fields:
+            if prefix_size > 0 or (not shape.equality and index[0] in shape.range):
+                return True
+            continue
+        if index[prefix_size:prefix_size + len(sort_fields)] == sort_fields:
+            return True
+    return False
+
+
+def suggest_indexes(shapes):
+    """
+    返回 [(QueryShape, 建议的索引, 次数)]，只包含已有索引和 _id 都用不上的查询形态
+    """
+    suggestions = []
+    for shape, count in shapes.most_common():
+        if '_id' in shape.equality:
+            continue
+        if not shape.equality and not shape.range and shape.sort[0][0] == '_id':
+            continue
+        if not _covered(shape, _known_indexes(shape.model)):
+            suggestions.append((shape, propose_index(shape), count))
+    return suggestions
+
+
+def ensure_indexes():
+    for model_name, indexes in HOT_QUERY_INDEXES.items():
+        collection = MODELS[model_name]._get_collection()
+        for index in indexes:
+            try:
+                collection.create_index([(field, 1) for field in index], background=True)
+            except OperationFailure as ex:
+                # model meta 里已经有同样字段的索引（比如 unique），保留原来的
+                if ex.code not in [85, 86]:
+                    raise
+
+
+def _plan_stages(plan):
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ['inputStage', 'queryPlan']:
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+def _explain_stages(model_name, _filter, sort):
+    cursor = MODELS[model_name]._get_collection().find(_filter)
+    if sort:
+        cursor = cursor.sort(list(sort))
+    return set(_plan_stages(cursor.explain()['queryPlanner']['winningPlan']))
+
+
+def check_hot_queries():
+    """
+    返回走 COLLSCAN 的热点查询
+    """
+    collscan_list = []
+    for model_name, _filter, sort in HOT_QUERIES:
+        if 'COLLSCAN' in _explain_stages(model_name, _filter, sort):
+            collscan_list.append((model_name, _filter, sort))
+    return collscan_list
+
+
+def _sample_filter(shape):
+    _filter = {field: None for field in shape.equality}
+    _filter.update({field: {'$exists': True} for field in shape.range})
+    return _filter
+
+
+def explain_query_shapes(shapes):
+    """
+    对扫描到的查询形态执行 explain()，返回走 COLLSCAN 或内存排序的 [(QueryShape, stages)]
+    """
+    result = []
+    for shape in shapes:
+        stages = _explain_stages(shape.model, _sample_filter(shape), shape.sort)
+        if stages & {'COLLSCAN', 'SORT'}:
+            result.append((shape, sorted(stages)))
+    return result
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'scan'
+    if command == 'scan':
+        for shape, index, count in suggest_indexes(scan_query_shapes()):
+            print('{} {} x{}'.format(shape.model, list(index), count))
+    elif command == 'ensure':
+        ensure_indexes()
+    elif command == 'check':
+        collscan_list = check_hot_queries()
+        for model_name, _filter, sort in collscan_list:
+            print('COLLSCAN {} {} sort={}'.format(model_name, _filter, sort))
+        sys.exit(1 if collscan_list else 0)
+    elif command == 'explain':
+        for shape, stages in explain_query_shapes(scan_query_shapes()):
+            print('{} {} {} sort={} range={}'.format(
+                '/'.join(stages), shape.model, shape.equality, shape.sort, shape.range))
@@ -1,7 +1,7 @@
+import decimal
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-import settings
-from app.common.models.icpdao.github_app_token import GithubAppToken
 from app.common.models.icpdao.job import JobPRStatusEnum
 from app.common.models.icpdao.user import User as UserModel, UserStatus
 from app.common.models.icpdao.user_github_token import UserGithubToken
@@ -16,13 +16,16 @@ from app.common.utils.github_app.client import GithubAppClient
 from app.common.utils.github_app.utils import parse_pr, LinkType, parse_issue
 from app.common.utils.github_rest_api import get_github_org_id
 from app.common.utils.route_helper import get_current_user_by_graphql
+from app.controllers.dao_stat import inc_dao_stat, refresh_dao_stat_following
+from app.controllers.github_app_token_cache import get_app_token
 from app.controllers.task import update_issue_comment, sync_job_pr, sync_job_prs
-from app.common.models.icpdao.dao import DAO as DAOModel
+from app.common.models.icpdao.dao import DAO as DAOModel, DAOFollow
 from app.common.models.icpdao.job import Job as JobModel, JobPR as JobPRModel, \
     JobStatusEnum
 from settings import (
     ICPDAO_GITHUB_APP_CLIENT_ID,
-    ICPDAO_GITHUB_APP_CLIENT_SECRET
+    ICPDAO_GITHUB_APP_CLIENT_SECRET,
+    ICPDAO_GITHUB_FANOUT_WORKERS
 )
 
 
@@ -48,8 +51,10 @@ def update_job_by_size(info, app_client: GithubAppClient, current_user, job, siz
             assert size < job.size, JOB_UPDATE_SIZE_REDUCE_ERROR
         if not is_job_owner and is_merged_user:
             assert size > job.size, JOB_UPDATE_SIZE_ONLY_REVIEWER_ERROR
+        size_diff = decimal.Decimal(str(size)) - decimal.Decimal(str(job.size))
         job.size = size
         job.save()
+        inc_dao_stat(job.dao_id, size=size_diff)
         tasks.add_task(
             update_issue_comment, app_client=app_client, job=job)
         return job
@@ -90,6 +95,65 @@ def create_auto_pr(current_user, job_user, app_client, job):
     return pr_record
 
 
+def _fetch_new_pr(app_client: GithubAppClient, ugt, current_user, job_user, job, pid, pr_link):
+    """
+    从 github 获取并校验要关联的 pr，返回 (parse_info, repo, pr)
+    """
+    link_info = parse_pr(pr_link)
+    if link_info['success'] is False:
+        raise ValueError(link_info['msg'])
+
+    github_org_id = get_github_org_id(ugt.access_token, link_info["parse"]["github_repo_owner"])
+    if github_org_id != job.github_repo_owner_id:
+        raise ValueError(JOB_UPDATE_PR_OWNER_INVALID_ERROR)
+
+    parse_info = link_info['parse']
+
+    repo = app_client.get_repo(parse_info['github_repo_name'])
+
+    success, ret = app_client.get_pr(
+        parse_info['github_repo_name'],
+        parse_info['github_pr_number'],
+    )
+    if success is False:
+        raise ValueError(JOB_UPDATE_PR_NOT_FOUND_ERROR)
+    if ret['closed_at'] and not ret['merged_at']:
+        raise ValueError(JOB_UPDATE_PR_CLOSED_ERROR)
+    if ret['state'] == JobPRStatusEnum.MERGED.value and \
+            current_user.github_user_id != ret['merged_user_github_user_id']:
+        raise ValueError(JOB_UPDATE_PR_MERGED_ROLE_ERROR)
+    if ret['state'] == JobPRStatusEnum.AWAITING_MERGER.value:
+        if current_user.github_user_id not in ret[
+            'can_link_github_user_id_list'] or job_user.github_user_id not in ret[
+              'can_link_github_user_id_list']:
+            raise ValueError(JOB_UPDATE_PR_USER_INVALID_ERROR)
+
+    success, pr_issue_info = app_client.get_issue(
+        parse_info['github_repo_name'],
+        parse_info['github_pr_number'],
+    )
+    assert success, JOB_UPDATE_PR_NOT_FOUND_ERROR
+    assert pr_issue_info['id'] == pid, JOB_UPDATE_PR_INVALID_ERROR
+    return parse_info, repo, ret
+
+
+def _fetch_new_prs(app_client: GithubAppClient, ugt, current_user, job_user, job, new_prs):
+    """
+    并发获取所有要关联的 pr，返回 pid -> (error, result)
+    """
+    def fetch(pid, pr_link):
+        try:
+            return None, _fetch_new_pr(app_client, ugt, current_user, job_user, job, pid, pr_link)
+        except Exception as ex:
+            return ex, None
+
+    if len(new_prs) <= 1:
+        return {pid: fetch(pid, pr_link) for pid, pr_link in new_prs}
+    with ThreadPoolExecutor(max_workers=min(len(new_prs), ICPDAO_GITHUB_FANOUT_WORKERS)) as executor:
+        futures = {pid: executor.submit(fetch, pid, pr_link) for pid, pr_link in new_prs}
+        return {pid: future.result() for pid, future in futures.items()}
+
+
 def update_job_pr(info, app_client: GithubAppClient, current_user, job, auto_create_pr: bool, prs: dict):
     job_user = UserModel.objects(id=job.user_id).first()
     ugt = UserGithubToken.objects(github_user_id=current_user.github_user_id).first()
@@ -108,47 +172,19 @@ def update_job_pr(info, app_client: GithubAppClient, current_user, job, auto_cre
         exists_job_github_pr_ids.append(pr.github_pr_id)
         exists_job_prs_dict[pr.github_pr_id] = pr
 
+    new_prs = [(pid, prs[pid]) for pid in prs if pid not in exists_job_github_pr_ids]
+    new_pr_results = _fetch_new_prs(app_client, ugt, current_user, job_user, job, new_prs)
+
     for pid in prs:
         if pid in exists_job_github_pr_ids:
             ret_prs.append(exists_job_prs_dict[pid])
             continue
 
-        pr_link = prs[pid]
-        link_info = parse_pr(pr_link)
-        if link_info['success'] is False:
-            raise ValueError(link_info['msg'])
-
-        github_org_id = get_github_org_id(ugt.access_token, link_info["parse"]["github_repo_owner"])
-        if github_org_id != job.github_repo_owner_id:
-            raise ValueError(JOB_UPDATE_PR_OWNER_INVALID_ERROR)
-
-        parse_info = link_info['parse']
-
-        repo = app_client.get_repo(parse_info['github_repo_name'])
-
-        success, ret = app_client.get_pr(
-            parse_info['github_repo_name'],
-            parse_info['github_pr_number'],
-        )
-        if success is False:
-            raise ValueError(JOB_UPDATE_PR_NOT_FOUND_ERROR)
-        if ret['closed_at'] and not ret['merged_at']:
-            raise ValueError(JOB_UPDATE_PR_CLOSED_ERROR)
-        if ret['state'] == JobPRStatusEnum.MERGED.value and \
-                current_user.github_user_id != ret['merged_user_github_user_id']:
-            raise ValueError(JOB_UPDATE_PR_MERGED_ROLE_ERROR)
-        if ret['state'] == JobPRStatusEnum.AWAITING_MERGER.value:
-            if current_user.github_user_id not in ret[
-                'can_link_github_user_id_list'] or job_user.github_user_id not in ret[
-                  'can_link_github_user_id_list']:
-                raise ValueError(JOB_UPDATE_PR_USER_INVALID_ERROR)
-
-        success, pr_issue_info = app_client.get_issue(
-            parse_info['github_repo_name'],
-            parse_info['github_pr_number'],
-        )
-        assert success, JOB_UPDATE_PR_NOT_FOUND_ERROR
-        assert pr_issue_info['id'] == pid, JOB_UPDATE_PR_INVALID_ERROR
+        # 和逐个处理时一样，按 prs 的顺序遇到第一个错误时抛出
+        error, result = new_pr_results[pid]
+        if error is not None:
+            raise error
+        parse_info, repo, ret = result
 
         pr_record = JobPRModel(
             job_id=str(job.id),
@@ -201,12 +237,7 @@ def create_job(info, issue_link, size, auto_create_pr, prs):
     if not dao:
         raise ValueError(JOB_CREATE_DAO_NOT_FOUND_ERROR)
 
-    app_token = GithubAppToken.get_token(
-        app_id=settings.ICPDAO_GITHUB_APP_ID,
-        app_private_key=settings.ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY,
-        github_owner_name=github_repo_owner,
-        github_owner_id=dao.github_owner_id,
-    )
+    app_token = get_app_token(github_repo_owner, dao.github_owner_id)
     if app_token is None:
         raise ValueError('NOT APP TOKEN')
     app_client = GithubAppClient(app_token, github_repo_owner)
@@ -258,5 +289,8 @@ by @icpdao
     )
     record.save()
     ret_prs = update_job_pr(info, app_client, current_user, record, auto_create_pr, prs)
+    followed = DAOFollow.objects(dao_id=str(dao.id), user_id=str(current_user.id)).first() is not None
     user_auth_follow_dao(str(current_user.id), str(dao.id))
+    if not followed:
+        refresh_dao_stat_following(str(dao.id))
     return record, ret_prs
@@ -14,6 +14,7 @@ from app.common.models.icpdao.icppership import Icppership, IcppershipProgress,
 from app.common.models.icpdao.job import Job, JobPR, JobPRComment, JobStatusEnum, JobPairTypeEnum, JobPRStatusEnum
 from app.common.models.icpdao.token import MentorTokenIncomeStat
 from app.common.models.icpdao.user import User, UserStatus
+from app.models.dao_stat import DAOStat
 
 
 def _get_github_user_id(github_login):
@@ -89,6 +90,9 @@ class DeleteDaoMock:
     def delete_dao_follow(self):
         DAOFollow.objects(dao_id=str(self.dao.id)).delete()
 
+    def delete_dao_stat(self):
+        DAOStat.objects(dao_id=str(self.dao.id)).delete()
+
     def delete_dao(self):
         DAO.objects(id=str(self.dao.id)).delete()
 
@@ -101,6 +105,7 @@ class DeleteDaoMock:
         self.delete_cycle_vote_confirm()
         self.delete_dao_follow()
         self.delete_dao_config()
+        self.delete_dao_stat()
         self.delete_dao()
 
 
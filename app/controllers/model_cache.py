@@ -0,0 +1,128 @@
+"""
+进程内的 User/DAO/DAOJobConfig 缓存
+
+这些数据很少修改，缓存带 ttl 并限制条数，修改的地方需要调用 invalidate_*
+只缓存查到的记录，查不到不缓存；每次返回缓存对象的副本，调用方修改不会影响其他请求
+单元测试会直接改库，默认关闭缓存，需要测缓存时把 model_cache.enabled 设为 True
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.common.models.icpdao.dao import DAO, DAOJobConfig
+from app.common.models.icpdao.user import User
+from settings import ICPDAO_MODEL_CACHE_TTL, ICPDAO_MODEL_CACHE_SIZE
+
+
+class TTLCache:
+    def __init__(self, maxsize, ttl, enabled=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expire_at = item
+            if expire_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+model_cache = TTLCache(
+    ICPDAO_MODEL_CACHE_SIZE, ICPDAO_MODEL_CACHE_TTL, enabled=os.environ.get('IS_UNITEST') != 'yes')
+
+
+def _cache_enabled():
+    return model_cache.enabled and model_cache.ttl > 0
+
+
+def _copy(value):
+    return type(value)._from_son(value.to_mongo())
+
+
+def _get_or_load(key, load):
+    if not _cache_enabled():
+        return load()
+    value = model_cache.get(key)
+    if value is None:
+        value = load()
+        if value is None:
+            return None
+        model_cache.set(key, value)
+    return _copy(value)
+
+
+def _dao_keys(dao):
+    return [('dao', 'id', str(dao.id)), ('dao', 'name', dao.name), ('dao', 'github_owner_name', dao.github_owner_name)]
+
+
+def _cache_dao(dao):
+    if dao is not None and _cache_enabled():
+        for key in _dao_keys(dao):
+            model_cache.set(key, dao)
+    return dao
+
+
+def get_dao(dao_id):
+    return _get_or_load(('dao', 'id', str(dao_id)), lambda: _cache_dao(DAO.objects(id=dao_id).first()))
+
+
+def get_dao_by_name(name):
+    return _get_or_load(('dao', 'name', name), lambda: _cache_dao(DAO.objects(name=name).first()))
+
+
+def get_dao_by_github_owner_name(github_owner_name):
+    return _get_or_load(
+        ('dao', 'github_owner_name', github_owner_name),
+        lambda: _cache_dao(DAO.objects(github_owner_name=github_owner_name).first()))
+
+
+def get_dao_job_config(dao_id):
+    return _get_or_load(('dao_job_config', str(dao_id)), lambda: DAOJobConfig.objects(dao_id=dao_id).first())
+
+
+def get_user(user_id):
+    return _get_or_load(('user', 'id', str(user_id)), lambda: User.objects(id=user_id).first())
+
+
+def get_user_by_github_login(github_login):
+    return _get_or_load(('user', 'github_login', github_login), lambda: User.objects(github_login=github_login).first())
+
+
+def invalidate_dao(dao=None, name=None):
+    if dao is not None:
+        model_cache.delete(*_dao_keys(dao))
+    if name is not None:
+        model_cache.delete(('dao', 'name', name), ('dao', 'github_owner_name', name))
+
+
+def invalidate_dao_job_config(dao_id):
+    model_cache.delete(('dao_job_config', str(dao_id)))
+
+
+def invalidate_user(user):
+    model_cache.delete(('user', 'id', str(user.id)), ('user', 'github_login', user.github_login))
@@ -0,0 +1,19 @@
+def to_mongo_update(model, **values):
+    """
+    把 model 字段的值转成 update 语句，给 bulk_write / update_many 使用
+    值为 None 的字段和 mongoengine save 一样 $unset
+    """
+    set_values = {}
+    unset_values = {}
+    for name, value in values.items():
+        field = model._fields[name]
+        if value is None:
+            unset_values[field.db_field] = ''
+        else:
+            set_values[field.db_field] = field.to_mongo(value)
+    update = {}
+    if set_values:
+        update['$set'] = set_values
+    if unset_values:
+        update['$unset'] = unset_values
+    return update
@@ -1,5 +1,9 @@
+import hashlib
 import time
+
+from bson import ObjectId
 from mongoengine import Q
+from pymongo import UpdateOne, ReplaceOne
 
 from app.common.models.icpdao.cycle import CycleVotePairTask, CycleVotePairTaskStatus, Cycle, CycleVote, CycleVoteType, \
     CycleVoteConfirm, CycleVoteConfirmStatus
@@ -8,6 +12,7 @@ from app.common.models.icpdao.user import User
 from app.ei.logic.ei_processor import EiProcessor
 from app.ei.models.ei_issue import EiIssue
 from app.ei.models.ei_user import EiUser
+from app.models.cycle_vote_pair_plan import CycleVotePairPlan, CycleVotePairPlanStatus, CycleVotePairPlanVote
 
 
 def filter_job_lables(job):
@@ -100,6 +105,164 @@ def get_data_by_cycle(cycle):
     return ei_issue_list, type_all_jobs, type_pair_jobs, user_ids
 
 
+PAIR_WRITE_BATCH_SIZE = 500
+
+
+def get_pair_fingerprint(type_all_jobs, type_pair_jobs, user_ids):
+    items = sorted(
+        '{}:{}:{}:{}'.format(job.id, job.pair_type, job.size, job.user_id)
+        for job in type_all_jobs + type_pair_jobs
+    )
+    items.extend(sorted(user_ids))
+    return hashlib.sha1('|'.join(items).encode('utf-8')).hexdigest()
+
+
+def get_cycle_vote_match(cycle_id):
+    """
+    读 cycle 的 vote 时的条件，只包含当前生效的那一代 vote
+    没有 plan 的 cycle（pair plan 之前的数据、mock 数据）不限制 generation；
+    有 plan 但是还没有切换过时 active_generation 为 None，只匹配没有 generation 的旧 vote
+    """
+    match = {'cycle_id': cycle_id}
+    plan = CycleVotePairPlan.objects(cycle_id=cycle_id).only('active_generation').first()
+    if plan:
+        match['generation'] = plan.active_generation
+    return match
+
+
+def get_cycle_vote_filter(cycle_id):
+    """
+    get_cycle_vote_match 对应的 CycleVote.objects() 参数
+    """
+    return {'__raw__': get_cycle_vote_match(cycle_id)}
+
+
+def create_pair_plan(task, cycle, old_plan, fingerprint, ei_issue_list, type_all_jobs, type_pair_jobs, user_ids):
+    """
+    运行 EiProcessor，把生成的 vote 存到 cycle_vote_pair_plan_vote，再更新 cycle_vote_pair_plan
+    """
+    dao_id = cycle.dao_id
+    cycle_id = str(cycle.id)
+    ep = EiProcessor('first', ei_issue_list)
+    ep.process()
+    success = ep.pair_success()
+    if not success:
+        raise ValueError("FAIL")
+
+    # 生成 vote
+    vote_list = []
+    ei_issue_pair_list = ep.assignees_info["pair_voter_info"]["ei_issue_pair_list"]
+    for ei_issue_pair in ei_issue_pair_list:
+        left_job_id = ei_issue_pair["left"]["id"]
+        right_job_id = ei_issue_pair["right"]["id"]
+        voter_id = ei_issue_pair["user"]["id"]
+
+        vote_list.append(CycleVote(
+            dao_id=dao_id,
+            cycle_id=cycle_id,
+            left_job_id=left_job_id,
+            right_job_id=right_job_id,
+            vote_type=CycleVoteType.PAIR.value,
+            voter_id=voter_id,
+            is_result_public=False
+        ))
+
+    # 找到所有 all job 生成 vote
+    for job in type_all_jobs:
+        vote_list.append(CycleVote(
+            dao_id=dao_id,
+            cycle_id=cycle_id,
+            left_job_id=str(job.id),
+            right_job_id=str(job.id),
+            vote_type=CycleVoteType.ALL.value,
+            is_result_public=True
+        ))
+
+    for vote in vote_list:
+        # 先生成 _id，中断后重复写入同一条
+        vote.id = ObjectId()
+        vote.validate()
+
+    generation = old_plan.generation + 1 if old_plan else 1
+    plan_vote_collection = CycleVotePairPlanVote._get_collection()
+    # 上次生成到一半中断留下的
+    plan_vote_collection.delete_many({'cycle_id': cycle_id, 'generation': {'$gte': generation}})
+    for begin in range(0, len(vote_list), PAIR_WRITE_BATCH_SIZE):
+        plan_vote_collection.insert_many([{
+            'cycle_id': cycle_id,
+            'generation': generation,
+            'index': index,
+            'vote': dict(vote.to_mongo().to_dict(), generation=generation)
+        } for index, vote in enumerate(vote_list[begin:begin + PAIR_WRITE_BATCH_SIZE], begin)], ordered=False)
+
+    now_at = int(time.time())
+    plan_fields = {
+        'dao_id': dao_id,
+        'task_id': str(task.id),
+        'generation': generation,
+        'fingerprint': fingerprint,
+        'status': CycleVotePairPlanStatus.PLANNED,
+        'vote_count': len(vote_list),
+        'voter_ids': sorted(user_ids),
+        'job_ids': [str(job.id) for job in type_all_jobs + type_pair_jobs],
+        'written': 0,
+        'update_at': now_at
+    }
+    CycleVotePairPlan._get_collection().update_one(
+        {'cycle_id': cycle_id}, {'$set': plan_fields, '$setOnInsert': {'create_at': now_at}}, upsert=True)
+    plan_vote_collection.delete_many({'cycle_id': cycle_id, 'generation': {'$lt': generation}})
+    return CycleVotePairPlan.objects(cycle_id=cycle_id).first()
+
+
+def commit_pair_plan(plan):
+    """
+    从 plan.written 开始分批写入 vote，写入是幂等的，中断后重复执行没有影响
+    新写入的 vote 的 generation 不是 active_generation，读不到；全部写完后更新 plan 的 active_generation 切换到新的一代，
+    然后删除旧的 vote，更新 confirm 和 job
+    """
+    vote_collection = CycleVote._get_collection()
+    plan_vote_collection = CycleVotePairPlanVote._get_collection()
+    written = plan.written
+    while written < plan.vote_count:
+        batch = list(plan_vote_collection.find(
+            {'cycle_id': plan.cycle_id, 'generation': plan.generation, 'index': {'$gte': written}}
+        ).sort('index', 1).limit(PAIR_WRITE_BATCH_SIZE))
+        if not batch:
+            raise ValueError("pair plan generation {} votes missing from {}".format(plan.generation, written))
+        vote_collection.bulk_write(
+            [ReplaceOne({'_id': item['vote']['_id']}, item['vote'], upsert=True) for item in batch], ordered=False)
+        written += len(batch)
+        plan.update(written=written, update_at=int(time.time()))
+
+    # 切换到新的 vote
+    plan.update(active_generation=plan.generation, update_at=int(time.time()))
+
+    # 包括没有 generation 的旧 vote
+    vote_collection.delete_many({
+        'cycle_id': plan.cycle_id,
+        'dao_id': plan.dao_id,
+        'generation': {'$ne': plan.generation}
+    })
+
+    # generate voter confirm data
+    now_at = int(time.time())
+    confirm_requests = [UpdateOne(
+        {'dao_id': plan.dao_id, 'cycle_id': plan.cycle_id, 'voter_id': uid},
+        {'$set': {'create_at': now_at, 'status': CycleVoteConfirmStatus.WAITING.value}},
+        upsert=True
+    ) for uid in plan.voter_ids]
+    if confirm_requests:
+        CycleVoteConfirm._get_collection().bulk_write(confirm_requests, ordered=False)
+
+    # 所有 job 更改状态
+    if plan.job_ids:
+        Job.objects(id__in=plan.job_ids).update(
+            status=JobStatusEnum.AWAITING_VOTING.value, update_at=int(time.time()))
+
+    plan.update(status=CycleVotePairPlanStatus.COMMITTED, update_at=int(time.time()))
+    plan_vote_collection.delete_many({'cycle_id': plan.cycle_id, 'generation': plan.generation})
+
+
 def run_pair_task(task_id):
     # TODO PAIR
     print("run_pair_task begin")
@@ -122,69 +285,23 @@ def run_pair_task(task_id):
         print("current time not in range cycle pair_begin_at pair_end_at")
         return
 
-    dao_id = cycle.dao_id
-
     task.status = CycleVotePairTaskStatus.PAIRING.value
     task.update_at = int(time.time())
     task.save()
 
     try:
         ei_issue_list, type_all_jobs, type_pair_jobs, user_ids = get_data_by_cycle(cycle)
-        ep = EiProcessor('first', ei_issue_list)
-        ep.process()
-        success = ep.pair_success()
-        if not success:
-            raise ValueError("FAIL")
-
-        # 生成 vote
-        vote_list = []
-        ei_issue_pair_list = ep.assignees_info["pair_voter_info"]["ei_issue_pair_list"]
-        for ei_issue_pair in ei_issue_pair_list:
-            left_job_id = ei_issue_pair["left"]["id"]
-            right_job_id = ei_issue_pair["right"]["id"]
-            voter_id = ei_issue_pair["user"]["id"]
-
-            vote_list.append(CycleVote(
-                dao_id=dao_id,
-                cycle_id=str(cycle.id),
-                left_job_id=left_job_id,
-                right_job_id=right_job_id,
-                vote_type=CycleVoteType.PAIR.value,
-                voter_id=voter_id,
-                is_result_public=False
-            ))
-
-        # 找到所有 all job 生成 vote
-        for job in type_all_jobs:
-            vote_list.append(CycleVote(
-                dao_id=dao_id,
-                cycle_id=str(cycle.id),
-                left_job_id=str(job.id),
-                right_job_id=str(job.id),
-                vote_type=CycleVoteType.ALL.value,
-                is_result_public=True
-            ))
-
-        # 没有问题，清空现在 vote, 生成所有 vote
-        CycleVote.objects(cycle_id=str(cycle.id), dao_id=dao_id).delete()
-        for vote in vote_list:
-            vote.save()
-        # generate voter confirm data
-        for uid in user_ids:
-            CycleVoteConfirm.objects(
-                dao_id=dao_id, cycle_id=str(cycle.id), voter_id=uid
-            ).update(
-                upsert=True, create_at=int(time.time()), status=CycleVoteConfirmStatus.WAITING.value)
-
-        # 所有 job 更改状态
-        for job in type_all_jobs:
-            job.status = JobStatusEnum.AWAITING_VOTING.value
-            job.update_at = int(time.time())
-            job.save()
-        for job in type_pair_jobs:
-            job.status = JobStatusEnum.AWAITING_VOTING.value
-            job.update_at = int(time.time())
-            job.save()
+        fingerprint = get_pair_fingerprint(type_all_jobs, type_pair_jobs, user_ids)
+
+        plan = CycleVotePairPlan.objects(cycle_id=str(cycle.id)).first()
+        if plan and plan.status == CycleVotePairPlanStatus.PLANNED and plan.fingerprint == fingerprint:
+            print("resume pair plan generation {} from {}".format(plan.generation, plan.written))
+            plan.update(task_id=str(task.id), update_at=int(time.time()))
+        else:
+            plan = create_pair_plan(
+                task, cycle, plan, fingerprint, ei_issue_list, type_all_jobs, type_pair_jobs, user_ids)
+
+        commit_pair_plan(plan)
 
         cycle.paired_at = int(time.time())
         cycle.update_at = int(time.time())
@@ -1,67 +1,103 @@
 import decimal
 
+from pymongo import UpdateOne
+
+from app.common.models.extension.decimal128_field import any_to_decimal
 from app.common.models.icpdao.cycle import CycleIcpperStat
 from app.common.models.icpdao.job import Job, JobStatusEnum
+from app.controllers.mongo_helper import to_mongo_update
 
 
-def create_or_update_cycle_icpper_stat(dao_id, cycle_id, user_id, job_count, job_size):
-    update_result = CycleIcpperStat.objects(
-        dao_id=dao_id, user_id=user_id, cycle_id=cycle_id
-    ).update_one(full_result=True, upsert=True, job_size=job_size, size__=job_size, job_count=job_count)
+def _group_cycle_user_jobs(dao_id, cycle_id, user_ids):
+    """
+    user_id -> (job_count, job_size)
+    """
+    match = {
+        'dao_id': dao_id,
+        'cycle_id': cycle_id,
+        'status': {'$in': [
+            JobStatusEnum.MERGED.value, JobStatusEnum.AWAITING_VOTING.value,
+            JobStatusEnum.WAITING_FOR_TOKEN.value
+        ]}
+    }
+    if user_ids is not None:
+        match['user_id'] = {'$in': list(user_ids)}
+    user_id_2_job_stat = {}
+    for d in Job._get_collection().aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$user_id", "job_count": {"$sum": 1}, "job_size": {"$sum": "$size"}}}
+    ]):
+        user_id_2_job_stat[d['_id']] = (d['job_count'], any_to_decimal(d['job_size']))
+    return user_id_2_job_stat
 
-    is_new = False
-    is_dict = isinstance(update_result, dict)
-    if is_dict and update_result.get('upserted_id'):
-        is_new = True
-    elif not is_dict and update_result.upserted_id:
-        is_new = True
 
-    if is_new:
-        cis = CycleIcpperStat.objects(
-            dao_id=dao_id, user_id=user_id, cycle_id=cycle_id
-        ).first()
+def _init_new_cycle_icpper_stats(dao_id, upserted_ids):
+    """
+    新建的 cycle_icpper_stat 补上初始值和 last_id（同一个 dao 里这个 user 上一条记录）
+    upserted_ids: user_id -> _id
+    """
+    user_id_2_create_at = {
+        user_id: int(_id.generation_time.timestamp()) for user_id, _id in upserted_ids.items()}
 
-        last_item = CycleIcpperStat.objects(
-            dao_id=cis.dao_id,
-            user_id=cis.user_id,
-            create_at__lt=cis.create_at
-        ).order_by('-create_at').first()
+    user_id_2_last_id = {}
+    for d in CycleIcpperStat._get_collection().aggregate([
+        {"$match": {
+            "dao_id": dao_id,
+            "_id": {"$nin": list(upserted_ids.values())},
+            "$or": [
+                {"user_id": user_id, "create_at": {"$lt": create_at}}
+                for user_id, create_at in user_id_2_create_at.items()
+            ]
+        }},
+        {"$sort": {"create_at": -1}},
+        {"$group": {"_id": "$user_id", "last_id": {"$first": "$_id"}}}
+    ]):
+        user_id_2_last_id[d['_id']] = str(d['last_id'])
 
-        # cis.income = decimal.Decimal('0')
-        cis.vote_ei = decimal.Decimal('0')
-        cis.owner_ei = decimal.Decimal('0')
-        cis.ei = decimal.Decimal('0')
-        cis.be_reviewer_has_warning_user_ids = []
-        cis.create_at = int(cis.id.generation_time.timestamp())
-        cis.update_at = int(cis.id.generation_time.timestamp())
-        if last_item:
-            cis.last_id = str(last_item.id)
-        cis.save()
+    requests = []
+    for user_id, _id in upserted_ids.items():
+        create_at = user_id_2_create_at[user_id]
+        values = dict(
+            vote_ei=decimal.Decimal('0'),
+            owner_ei=decimal.Decimal('0'),
+            ei=decimal.Decimal('0'),
+            be_reviewer_has_warning_user_ids=[],
+            create_at=create_at,
+            update_at=create_at
+        )
+        if user_id in user_id_2_last_id:
+            values['last_id'] = user_id_2_last_id[user_id]
+        requests.append(UpdateOne({'_id': _id}, to_mongo_update(CycleIcpperStat, **values)))
+    CycleIcpperStat._get_collection().bulk_write(requests, ordered=False)
 
 
-def sync_one_cycle_icppper_stat(dao_id, cycle_id, user_id):
-    # TODO 补充 cycle_icpper_stat 变化的单元测试
-    job_list = Job.objects(
-        dao_id=dao_id,
-        cycle_id=cycle_id,
-        user_id=user_id,
-        status__in=[
-            JobStatusEnum.MERGED.value, JobStatusEnum.AWAITING_VOTING.value,
-            JobStatusEnum.WAITING_FOR_TOKEN.value
-        ]
-    )
-    job_list = [job for job in job_list]
+def sync_cycle_icpper_stats(dao_id, cycle_id, user_ids=None):
+    """
+    按 job 重新统计 cycle 里 icpper 的 job_count 和 job_size，没有的 cycle_icpper_stat 会新建
+    user_ids 为 None 时同步这个 cycle 里有 job 或已经有 cycle_icpper_stat 的所有 user
+    """
+    user_id_2_job_stat = _group_cycle_user_jobs(dao_id, cycle_id, user_ids)
+    if user_ids is None:
+        user_ids = set(user_id_2_job_stat.keys())
+        user_ids |= set(CycleIcpperStat.objects(dao_id=dao_id, cycle_id=cycle_id).distinct('user_id'))
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return
 
-    job_count = len(job_list)
+    requests = []
+    for user_id in user_ids:
+        job_count, job_size = user_id_2_job_stat.get(user_id, (0, decimal.Decimal('0')))
+        requests.append(UpdateOne(
+            {'dao_id': dao_id, 'user_id': user_id, 'cycle_id': cycle_id},
+            to_mongo_update(CycleIcpperStat, job_size=job_size, size=job_size, job_count=job_count),
+            upsert=True
+        ))
+    result = CycleIcpperStat._get_collection().bulk_write(requests, ordered=True)
 
-    job_size = decimal.Decimal('0')
-    for job in job_list:
-        job_size += job.size
+    upserted_ids = {user_ids[index]: _id for index, _id in result.upserted_ids.items()}
+    if upserted_ids:
+        _init_new_cycle_icpper_stats(dao_id, upserted_ids)
 
-    create_or_update_cycle_icpper_stat(
-        dao_id=dao_id,
-        cycle_id=cycle_id,
-        user_id=user_id,
-        job_count=job_count,
-        job_size=job_size
-    )
+
+def sync_one_cycle_icppper_stat(dao_id, cycle_id, user_id):
+    sync_cycle_icpper_stats(dao_id, cycle_id, [user_id])
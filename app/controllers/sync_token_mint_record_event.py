@@ -14,6 +14,7 @@ from app.common.models.icpdao.job import Job, JobStatusEnum
 from app.common.models.icpdao.token import TokenMintRecord, MintRecordStatusEnum, TokenTransferEventLog, \
     MentorTokenIncomeStat
 from app.common.utils.errors import COMMON_NOT_FOUND_DAO_ERROR, DAO_NOT_TOKEN_ADDRESS_ERROR
+from app.controllers.dao_stat import refresh_dao_stat_incomes
 from settings import ICPDAO_MINT_TOKEN_ETH_CHAIN_ID, ICPDAO_ALCHEMYAPI_KEY
 
 TOKEN_ABI = """
@@ -1163,6 +1164,8 @@ def _update_income(token_mint_record):
 
         ss.save()
 
+    refresh_dao_stat_incomes(dao_id)
+
 def test_run():
     pass
     # token_contract_address = "0x3164d487640e0f208D5Fd2Db3E0eb8E371442143"
@@ -2,17 +2,17 @@ import time
 import traceback
 from collections import defaultdict
 
-import settings
 from app.common.models.icpdao.cycle import Cycle, CycleIcpperStat
 from app.common.models.icpdao.dao import DAOJobConfig, DAO
-from app.common.models.icpdao.github_app_token import GithubAppToken
 from app.common.models.icpdao.user import User as UserModel
 from app.common.models.icpdao.job import Job as JobModel, JobPR as JobPRModel, \
     JobStatusEnum, JobPRComment, JobPRStatusEnum
 from app.common.models.logic.user_helper import pre_icpper_to_icpper
 from app.common.utils import get_next_time
 from app.common.utils.github_app import GithubAppClient
-from app.controllers.sync_cycle_icppper_stat import sync_one_cycle_icppper_stat
+from app.controllers.dao_stat import inc_dao_stat, refresh_dao_stat_incomes
+from app.controllers.github_app_token_cache import get_app_token
+from app.controllers.sync_cycle_icppper_stat import sync_cycle_icpper_stats
 
 
 def update_issue_comment(app_client, job):
@@ -65,20 +65,17 @@ def create_cycle_by_params(dao_id, begin_at):
 
 
 def sync_cycle_icppper_stat_by_job_ids(job_ids):
-    jobs = JobModel.objects(id__in=list(job_ids)).all()
-    tmp = []
+    jobs = JobModel.objects(id__in=list(job_ids)).only('dao_id', 'cycle_id', 'user_id')
+    cycle_2_user_ids = defaultdict(set)
     for job in jobs:
         if job.cycle_id:
-            value = [job.dao_id, job.cycle_id, job.user_id]
-            if value not in tmp:
-                tmp.append(value)
+            cycle_2_user_ids[(job.dao_id, job.cycle_id)].add(job.user_id)
 
-    for value in tmp:
-        dao_id, cycle_id, user_id = value
-        sync_one_cycle_icppper_stat(
+    for (dao_id, cycle_id), user_ids in cycle_2_user_ids.items():
+        sync_cycle_icpper_stats(
             dao_id=dao_id,
             cycle_id=cycle_id,
-            user_id=user_id
+            user_ids=user_ids
         )
 
 
@@ -121,6 +118,7 @@ def sync_job_issue_status_comment(app_client, job_ids):
 
                     job.cycle_id = str(link_cycle.id)
                 job.save()
+                inc_dao_stat(job.dao_id, job=1, size=job.size)
                 need_update_comment_jobs.append(job)
                 _process_user_role_change(job.user_id)
         else:
@@ -134,6 +132,9 @@ def sync_job_issue_status_comment(app_client, job_ids):
                 job.update_at = int(time.time())
                 job.cycle_id = None
                 job.save()
+                inc_dao_stat(job.dao_id, job=-1, size=-job.size)
+                if job.incomes:
+                    refresh_dao_stat_incomes(job.dao_id)
                 need_update_comment_jobs.append(job)
     for update_job in need_update_comment_jobs:
         update_issue_comment(app_client, update_job)
@@ -204,12 +205,7 @@ def delete_issue_comment(dao_id, github_repo_owner, need_delete_bot_comment_info
         if not dao:
             raise ValueError('NOT DAO')
 
-        app_token = GithubAppToken.get_token(
-            app_id=settings.ICPDAO_GITHUB_APP_ID,
-            app_private_key=settings.ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY,
-            github_owner_name=github_repo_owner,
-            github_owner_id=dao.github_owner_id
-        )
+        app_token = get_app_token(github_repo_owner, dao.github_owner_id)
         if app_token is None:
             raise ValueError('NOT APP TOKEN')
         app_client = GithubAppClient(app_token, github_repo_owner)
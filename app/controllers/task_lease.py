@@ -0,0 +1,100 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import settings
+from app.models.task_lease import TaskLease
+
+
+def new_lease_owner():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def acquire_lease(name, task_id, owner, ttl=None):
+    """
+    没有租约或者租约已经过期时获得租约，返回 TaskLease，否则返回 None
+    """
+    ttl = ttl or settings.ICPDAO_TASK_LEASE_TTL
+    now_at = int(time.time())
+    try:
+        doc = TaskLease._get_collection().find_one_and_update(
+            {
+                'name': name,
+                'task_id': task_id,
+                '$or': [{'owner': None}, {'expire_at': {'$lt': now_at}}]
+            },
+            {
+                '$set': {'owner': owner, 'expire_at': now_at + ttl, 'heartbeat_at': now_at},
+                '$inc': {'attempts': 1},
+                '$setOnInsert': {'create_at': now_at}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # 其他进程持有租约
+        return None
+    return TaskLease._from_son(doc)
+
+
+def renew_lease(name, task_id, owner, ttl=None):
+    ttl = ttl or settings.ICPDAO_TASK_LEASE_TTL
+    now_at = int(time.time())
+    result = TaskLease._get_collection().update_one(
+        {'name': name, 'task_id': task_id, 'owner': owner},
+        {'$set': {'expire_at': now_at + ttl, 'heartbeat_at': now_at}}
+    )
+    return result.modified_count == 1
+
+
+def release_lease(name, task_id, owner):
+    TaskLease._get_collection().update_one(
+        {'name': name, 'task_id': task_id, 'owner': owner},
+        {'$set': {'owner': None, 'expire_at': None}}
+    )
+
+
+def get_live_lease(name, task_id):
+    return TaskLease.objects(
+        name=name, task_id=task_id, owner__ne=None, expire_at__gte=int(time.time())).first()
+
+
+def get_lease_attempts(name, task_id):
+    lease = TaskLease.objects(name=name, task_id=task_id).only('attempts').first()
+    return lease.attempts if lease else 0
+
+
+@contextmanager
+def task_lease(name, task_id, ttl=None):
+    """
+    持有租约运行任务，后台线程每 ttl/3 秒续期一次
+    拿不到租约时 yield False，调用方不应该运行任务
+    """
+    ttl = ttl or settings.ICPDAO_TASK_LEASE_TTL
+    owner = new_lease_owner()
+    if not acquire_lease(name, task_id, owner, ttl):
+        yield False
+        return
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(max(ttl / 3, 1)):
+            if not renew_lease(name, task_id, owner, ttl):
+                print('task lease lost {} {}'.format(name, task_id))
+                return
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield True
+    finally:
+        stop.set()
+        thread.join()
+        release_lease(name, task_id, owner)
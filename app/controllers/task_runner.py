@@ -0,0 +1,247 @@
+"""
+pair/stat/publish 这些 cycle 任务的运行方式，由 settings.ICPDAO_TASK_RUNNER 决定
+
+background  在请求结束后用 starlette BackgroundTasks 运行（默认，和原来一样），必须传入 background
+inline      在当前调用里直接运行，给单元测试和命令行用
+process     启动一个本地 worker 进程运行，不占用请求的时间；lambda 返回响应后容器会被冻结，不能使用
+queue       写入 task_queue_item，由 worker 轮询 mongo 运行
+            python -m app.controllers.task_runner worker
+
+任务运行时持有 task_lease 并定时续期，进程挂掉后租约过期，
+sweep_expired_tasks 把卡在 PAIRING/STATING/RUNNING（或一直没开始的 INIT）的任务重置为 INIT 后重新运行
+            python -m app.controllers.task_runner sweep
+"""
+import atexit
+import multiprocessing
+import os
+import socket
+import sys
+import time
+import traceback
+
+from pymongo import ReturnDocument
+
+import settings
+from app.common.models.icpdao.cycle import CycleVotePairTask, CycleVotePairTaskStatus, CycleVoteResultStatTask, \
+    CycleVoteResultStatTaskStatus, CycleVoteResultPublishTask, CycleVoteResultPublishTaskStatus
+from app.controllers.pair import run_pair_task
+from app.controllers.task_lease import task_lease, get_live_lease, get_lease_attempts
+from app.controllers.vote_result_publish import run_vote_result_publish_task
+from app.controllers.vote_result_stat import run_vote_result_stat_task
+from app.models.task_queue import TaskQueueItem, TaskQueueItemStatus
+
+TASK_FUNCS = {
+    'pair': run_pair_task,
+    'vote_result_stat': run_vote_result_stat_task,
+    'vote_result_publish': run_vote_result_publish_task,
+}
+
+# name -> (task model, INIT, 运行中的状态, FAIL)
+TASK_MODELS = {
+    'pair': (
+        CycleVotePairTask, CycleVotePairTaskStatus.INIT.value,
+        CycleVotePairTaskStatus.PAIRING.value, CycleVotePairTaskStatus.FAIL.value),
+    'vote_result_stat': (
+        CycleVoteResultStatTask, CycleVoteResultStatTaskStatus.INIT.value,
+        CycleVoteResultStatTaskStatus.STATING.value, CycleVoteResultStatTaskStatus.FAIL.value),
+    'vote_result_publish': (
+        CycleVoteResultPublishTask, CycleVoteResultPublishTaskStatus.INIT.value,
+        CycleVoteResultPublishTaskStatus.RUNNING.value, CycleVoteResultPublishTaskStatus.FAIL.value),
+}
+
+TASK_RUNNERS = ['background', 'inline', 'process', 'queue']
+
+
+def _fail_unstarted_task(name, task_id):
+    """
+    任务函数检查条件不满足（比如不在 pair 时间内）时直接返回，任务还是 INIT
+    这种任务重新运行也不会成功，标记为 FAIL，不再被 sweep 反复重新运行
+    """
+    model, init_status, _, fail_status = TASK_MODELS[name]
+    if model.objects(id=task_id, status=init_status).update_one(status=fail_status, update_at=int(time.time())):
+        print('task not started, mark fail {} {}'.format(name, task_id))
+
+
+def run_task_with_lease(name, task_id):
+    with task_lease(name, task_id) as acquired:
+        if not acquired:
+            print('task lease is held by other worker {} {}'.format(name, task_id))
+            return
+        TASK_FUNCS[name](task_id)
+        _fail_unstarted_task(name, task_id)
+
+
+def _run_in_process(name, task_id):
+    # spawn 出来的新进程，重新 import app 时会初始化 mongo 连接
+    import app  # noqa: F401
+    run_task_with_lease(name, task_id)
+
+
+# process 方式启动的子进程，结束后 join 回收，主进程退出前等待还在运行的
+_processes = []
+
+
+def _join_finished_processes():
+    for process in list(_processes):
+        if not process.is_alive():
+            process.join()
+            _processes.remove(process)
+
+
+@atexit.register
+def _join_processes():
+    for process in _processes:
+        process.join()
+    _processes.clear()
+
+
+def _start_process(name, task_id):
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        raise ValueError('process task runner is not supported on lambda')
+    _join_finished_processes()
+    process = multiprocessing.get_context('spawn').Process(target=_run_in_process, args=(name, task_id))
+    process.start()
+    _processes.append(process)
+
+
+def enqueue_task(name, task_id):
+    # 同一个 task 只有一条，重新运行时改回 INIT
+    TaskQueueItem.objects(name=name, task_id=task_id).update_one(
+        upsert=True,
+        set__status=TaskQueueItemStatus.INIT,
+        set__update_at=int(time.time()),
+        set_on_insert__create_at=int(time.time())
+    )
+
+
+def run_task(name, task_id, background=None, runner=None):
+    """
+    按配置的方式运行 TASK_FUNCS[name](task_id)
+    background 是 info.context['background']，runner 为 None 时使用 settings.ICPDAO_TASK_RUNNER
+    """
+    if name not in TASK_FUNCS:
+        raise ValueError('unknown task: {}'.format(name))
+    runner = runner or settings.ICPDAO_TASK_RUNNER
+    if runner not in TASK_RUNNERS:
+        raise ValueError('unknown task runner: {}'.format(runner))
+
+    if runner == 'background':
+        if background is None:
+            raise ValueError('background task runner needs background tasks: {} {}'.format(name, task_id))
+        background.add_task(run_task_with_lease, name, task_id)
+    elif runner == 'process':
+        _start_process(name, task_id)
+    elif runner == 'queue':
+        enqueue_task(name, task_id)
+    else:
+        run_task_with_lease(name, task_id)
+
+
+def claim_queue_task(worker):
+    item = TaskQueueItem._get_collection().find_one_and_update(
+        {'status': TaskQueueItemStatus.INIT},
+        {'$set': {
+            'status': TaskQueueItemStatus.RUNNING,
+            'worker': worker,
+            'start_at': int(time.time()),
+            'update_at': int(time.time())
+        }},
+        sort=[('create_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    if not item:
+        return None
+    return TaskQueueItem._from_son(item)
+
+
+def run_queue_task(item):
+    status = TaskQueueItemStatus.DONE
+    error = None
+    try:
+        run_task_with_lease(item.name, item.task_id)
+    except Exception as ex:
+        msg = traceback.format_exc()
+        print('exception log_exception' + str(ex))
+        print(msg)
+        status = TaskQueueItemStatus.FAIL
+        error = msg
+    TaskQueueItem.objects(id=item.id).update_one(
+        status=status, error=error, update_at=int(time.time()))
+
+
+def drain_task_queue(limit=None, worker=None):
+    """
+    运行队列里所有等待的任务，返回运行的数量
+    """
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    count = 0
+    while limit is None or count < limit:
+        item = claim_queue_task(worker)
+        if not item:
+            break
+        run_queue_task(item)
+        count += 1
+    return count
+
+
+def reclaim_expired_task(name, task, background=None, runner=None, rerun=True):
+    """
+    任务在 INIT 或运行中，但是没有有效的租约，并且超过一个租约时间没有更新，说明运行它的进程已经不在了
+    重置为 INIT 后重新运行（rerun 为 False 时只重置），超过 ICPDAO_TASK_MAX_ATTEMPTS 次的标记为 FAIL
+    返回任务当前的状态
+    """
+    model, init_status, running_status, fail_status = TASK_MODELS[name]
+    task_id = str(task.id)
+    if task.status not in [init_status, running_status]:
+        return task.status
+    if (task.update_at or 0) > time.time() - settings.ICPDAO_TASK_LEASE_TTL:
+        return task.status
+    if get_live_lease(name, task_id):
+        return task.status
+
+    status = init_status
+    if get_lease_attempts(name, task_id) >= settings.ICPDAO_TASK_MAX_ATTEMPTS:
+        status = fail_status
+    updated = model.objects(id=task_id, status=task.status, update_at=task.update_at).update_one(
+        status=status, update_at=int(time.time()))
+    if not updated:
+        # 其他进程已经处理了
+        return model.objects(id=task_id).first().status
+
+    print('reclaim expired task {} {} -> {}'.format(name, task_id, status))
+    if status == init_status and rerun:
+        run_task(name, task_id, background=background, runner=runner)
+    return status
+
+
+def sweep_expired_tasks(runner=None):
+    """
+    检查所有 INIT 和运行中的任务，返回重置的数量
+    """
+    count = 0
+    for name, (model, init_status, running_status, _) in TASK_MODELS.items():
+        for task in model.objects(
+                status__in=[init_status, running_status],
+                update_at__lte=time.time() - settings.ICPDAO_TASK_LEASE_TTL):
+            if reclaim_expired_task(name, task, runner=runner) != task.status:
+                count += 1
+    return count
+
+
+def run_worker(interval=5):
+    while True:
+        sweep_expired_tasks(runner='queue')
+        if not drain_task_queue():
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    # python -m app.controllers.task_runner worker|drain|sweep
+    command = sys.argv[1] if len(sys.argv) > 1 else 'worker'
+    if command == 'worker':
+        run_worker()
+    elif command == 'drain':
+        print(drain_task_queue())
+    elif command == 'sweep':
+        # 命令行没有 BackgroundTasks，background 方式改为在当前进程运行
+        print(sweep_expired_tasks(runner='queue' if settings.ICPDAO_TASK_RUNNER == 'queue' else 'inline'))
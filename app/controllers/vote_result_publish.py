@@ -3,6 +3,7 @@ import time
 from app.common.models.icpdao.cycle import Cycle, CycleIcpperStat, CycleVoteResultPublishTask, \
     CycleVoteResultPublishTaskStatus
 from app.common.models.icpdao.job import Job, JobStatusEnum
+from app.controllers.dao_stat import rebuild_dao_stats
 from app.controllers.vote_result_stat import stat_cycle_icpper_stat_size
 
 
@@ -39,23 +40,30 @@ def run_vote_result_publish_task(task_id):
     task.save()
 
     try:
-        for item in CycleIcpperStat.objects(cycle_id=str(cycle.id)):
-            item.ei = item.vote_ei + item.owner_ei
-            item.update_at = int(time.time())
-            item.save()
+        # ei = vote_ei + owner_ei，有一个为空时 $add 会写入 null，这种情况直接失败
+        missing_ei_stat = CycleIcpperStat._get_collection().find_one(
+            {"cycle_id": str(cycle.id), "$or": [{"vote_ei": None}, {"owner_ei": None}]}, {"_id": 1})
+        if missing_ei_stat:
+            raise ValueError("cycle_icpper_stat {} vote_ei or owner_ei is null".format(missing_ei_stat['_id']))
+        CycleIcpperStat._get_collection().update_many(
+            {"cycle_id": str(cycle.id)},
+            [{"$set": {"ei": {"$add": ["$vote_ei", "$owner_ei"]}, "update_at": int(time.time())}}]
+        )
 
         stat_cycle_icpper_stat_size(
             dao_id=dao_id,
             cycle_id=str(cycle.id)
         )
 
-        for item in Job.objects(
-                dao_id=dao_id, cycle_id=str(cycle.id),
-                status__in=[
-                    JobStatusEnum.AWAITING_VOTING.value,
-                    JobStatusEnum.WAITING_FOR_TOKEN.value]):
-            item.status = JobStatusEnum.WAITING_FOR_TOKEN.value
-            item.save()
+        Job.objects(
+            dao_id=dao_id, cycle_id=str(cycle.id),
+            status__in=[
+                JobStatusEnum.AWAITING_VOTING.value,
+                JobStatusEnum.WAITING_FOR_TOKEN.value]
+        ).update(status=JobStatusEnum.WAITING_FOR_TOKEN.value)
+
+        # 每个周期发布时整体校正一次 dao_stat
+        rebuild_dao_stats([dao_id])
 
         cycle.vote_result_published_at = time.time()
         cycle.update_at = time.time()
@@ -1,11 +1,17 @@
 import decimal
 import time
+from collections import defaultdict
 
+from pymongo import UpdateOne
+
+from app.common.models.extension.decimal128_field import any_to_decimal
 from app.common.models.icpdao.cycle import CycleVoteResultStatTask, CycleVoteResultStatTaskStatus, Cycle, CycleVote, \
     CycleVoteType, CycleIcpperStat
 from app.common.models.icpdao.job import Job, JobStatusEnum, JobPR, JobPRStatusEnum
 from app.common.models.icpdao.user import User
-from app.controllers.sync_cycle_icppper_stat import sync_one_cycle_icppper_stat
+from app.controllers.mongo_helper import to_mongo_update
+from app.controllers.pair import get_cycle_vote_match, get_cycle_vote_filter
+from app.controllers.sync_cycle_icppper_stat import sync_cycle_icpper_stats
 
 
 DECIMAL_0 = decimal.Decimal('0')
@@ -14,143 +20,133 @@ EI_04 = decimal.Decimal('0.40')
 SIZE_0 = DECIMAL_0
 
 
-def _process_warning_review_stat(cycle_icpper_stat):
+def _build_cycle_reviewer_index(dao_id, cycle_id):
     """
-    cycle_icpper_stat 上次没有或者正常，本次低于 0.4，要警告相关 reviewer
+    一次性读取 cycle 里 job 的 merge 记录
+    返回 user_id -> [(reviewer user_id, job size), ...]，每个 merged 的 job pr 一条
     """
-    dao_id = cycle_icpper_stat.dao_id
-    cycle_id = cycle_icpper_stat.cycle_id
-    user_id = cycle_icpper_stat.user_id
-
-    job_list = Job.objects(
-        dao_id=dao_id,
-        cycle_id=cycle_id,
-        user_id=user_id,
-        status__nin=[JobStatusEnum.AWAITING_MERGER.value]
-    )
-    job_list = [item for item in job_list]
-    job_id_list = [str(item.id) for item in job_list]
-    job_pr_list = JobPR.objects(job_id__in=job_id_list, status=JobPRStatusEnum.MERGED.value)
-    job_pr_list = [item for item in job_pr_list]
-    reviewer_id_list = []
-    merged_user_github_user_id_set = set()
-    for job_pr in job_pr_list:
-        merged_user_github_user_id_set.add(job_pr.merged_user_github_user_id)
-    reviewer_list = User.objects(github_user_id__in=list(merged_user_github_user_id_set))
-    for item in reviewer_list:
-        reviewer_id_list.append(str(item.id))
-
-    CycleIcpperStat.objects(
-        dao_id=dao_id, cycle_id=cycle_id,
-        user_id__in=reviewer_id_list
-    ).update(
-        update_at=int(time.time()),
-        push__be_reviewer_has_warning_user_ids=user_id)
+    job_id_2_job = {}
+    for job in Job.objects(
+            dao_id=dao_id,
+            cycle_id=cycle_id,
+            status__nin=[JobStatusEnum.AWAITING_MERGER.value]).only('id', 'user_id', 'size'):
+        job_id_2_job[str(job.id)] = job
 
+    job_pr_list = [item for item in JobPR.objects(
+        job_id__in=list(job_id_2_job.keys()),
+        status=JobPRStatusEnum.MERGED.value
+    ).only('job_id', 'merged_user_github_user_id')]
 
-def _process_04_reviewer_size(cycle_icpper_stat):
-    """
-    cycle_icpper_stat 连续两次低于0.4 需要处理相关 reviewer
-    """
-    dao_id = cycle_icpper_stat.dao_id
-    cycle_id = cycle_icpper_stat.cycle_id
-    user_id = cycle_icpper_stat.user_id
-
-    job_list = Job.objects(
-        dao_id=dao_id,
-        cycle_id=cycle_id,
-        user_id=user_id,
-        status__nin=[JobStatusEnum.AWAITING_MERGER.value]
-    )
-    job_list = [item for item in job_list]
-    job_id_list = [str(item.id) for item in job_list]
-    job_id_2_size = {}
-    for job in job_list:
-        job_id_2_size[str(job.id)] = job.size
-    current_user_github_user_id = User.objects(id=user_id).first().github_user_id
-    job_pr_list = JobPR.objects(
-        job_id__in=job_id_list,
-        status=JobPRStatusEnum.MERGED.value,
-        merged_user_github_user_id__ne=current_user_github_user_id
-    )
-    job_pr_list = [item for item in job_pr_list]
+    merged_user_github_user_id_set = set(job_pr.merged_user_github_user_id for job_pr in job_pr_list)
     github_user_id_2_user_id = {}
-    merged_user_github_user_id_set = set()
-    for job_pr in job_pr_list:
-        merged_user_github_user_id_set.add(job_pr.merged_user_github_user_id)
-    reviewer_list = User.objects(github_user_id__in=list(merged_user_github_user_id_set))
-    for user in reviewer_list:
+    for user in User.objects(github_user_id__in=list(merged_user_github_user_id_set)).only('id', 'github_user_id'):
         github_user_id_2_user_id[user.github_user_id] = str(user.id)
 
-    reviewer_id_2_merge_size = {}
+    user_id_2_reviews = defaultdict(list)
     for job_pr in job_pr_list:
         reviewer_id = github_user_id_2_user_id.get(job_pr.merged_user_github_user_id, None)
         if not reviewer_id:
             continue
+        job = job_id_2_job[str(job_pr.job_id)]
+        user_id_2_reviews[job.user_id].append((reviewer_id, job.size))
+    return user_id_2_reviews
 
-        size = job_id_2_size[str(job_pr.job_id)]
+
+def _get_reviewer_merge_size(reviewer_index, user_id, exclude_self):
+    """
+    user 在 cycle 里的 job 是哪些 reviewer merge 的
+    返回 reviewer user_id -> merge 的 job size 之和，exclude_self 为 True 时不算自己 merge 的
+    """
+    reviewer_id_2_merge_size = {}
+    for reviewer_id, size in reviewer_index.get(user_id, []):
+        if exclude_self and reviewer_id == user_id:
+            continue
         reviewer_id_2_merge_size.setdefault(reviewer_id, SIZE_0)
         reviewer_id_2_merge_size[reviewer_id] += size
+    return reviewer_id_2_merge_size
+
+
+def _process_warning_review_stat(user_id_2_result, user_id, reviewer_id_2_merge_size):
+    """
+    cycle_icpper_stat 上次没有或者正常，本次低于 0.4，要警告相关 reviewer
+    """
+    for reviewer_id in reviewer_id_2_merge_size:
+        result = user_id_2_result.get(reviewer_id)
+        if result is None:
+            continue
+        if result['be_reviewer_has_warning_user_ids'] is None:
+            result['be_reviewer_has_warning_user_ids'] = []
+        result['be_reviewer_has_warning_user_ids'].append(user_id)
+
 
-    cycle_icpper_stat_list_query = CycleIcpperStat.objects(
-        dao_id=dao_id, cycle_id=cycle_id,
-        user_id__in=list(reviewer_id_2_merge_size.keys())
-    )
-    for item in cycle_icpper_stat_list_query:
-        if not item.be_deducted_size_by_review:
-            item.be_deducted_size_by_review = SIZE_0
-        deducted_review_size = round(reviewer_id_2_merge_size[str(item.user_id)]/2, 2)
-        item.be_deducted_size_by_review += deducted_review_size
+def _process_04_reviewer_size(user_id_2_stat, user_id_2_result, reviewer_id_2_merge_size):
+    """
+    cycle_icpper_stat 连续两次低于0.4 需要处理相关 reviewer
+    reviewer 的 size 按当前已经处理过的标记重新计算，所以和处理顺序有关
+    """
+    for reviewer_id, merge_size in reviewer_id_2_merge_size.items():
+        item = user_id_2_stat.get(reviewer_id)
+        if item is None:
+            continue
+        result = user_id_2_result[reviewer_id]
+        result['be_deducted_size_by_review'] = \
+            (result['be_deducted_size_by_review'] or SIZE_0) + round(merge_size/2, 2)
 
         size = item.job_size
-        if item.have_two_times_lt_08 or item.have_two_times_lt_04:
+        if result['have_two_times_lt_08'] or result['have_two_times_lt_04']:
             size = round(size/2, 2)
         if item.un_voted_all_vote:
             size = decimal.Decimal("0")
-        item.size = size - item.be_deducted_size_by_review
-        if item.size < SIZE_0:
-            item.size = SIZE_0
-        item.update_at = time.time()
-        item.save()
+        size = size - result['be_deducted_size_by_review']
+        if size < SIZE_0:
+            size = SIZE_0
+        result['size'] = size
 
 
 def stat_cycle_icpper_stat_size(dao_id, cycle_id):
     """
     根据 ei 情况，统计 size 数据
+    cycle_icpper_stat 只读取一次，在内存里计算完后一次 bulk_write 写回
     """
-    cycle_icpper_stat_list_query = CycleIcpperStat.objects(dao_id=dao_id, cycle_id=cycle_id)
+    cycle_icpper_stat_list = [item for item in CycleIcpperStat.objects(dao_id=dao_id, cycle_id=cycle_id).only(
+        'id', 'user_id', 'job_size', 'ei', 'last_id', 'un_voted_all_vote')]
+    user_id_2_stat = {item.user_id: item for item in cycle_icpper_stat_list}
 
-    for item in cycle_icpper_stat_list_query:
-        item.size = item.job_size
-        if item.un_voted_all_vote:
+    user_id_2_result = {}
+    for item in cycle_icpper_stat_list:
+        user_id_2_result[item.user_id] = {
             # 没有投完，直接归零
-            item.size = decimal.Decimal("0")
-
-        item.be_deducted_size_by_review = None
-        item.be_reviewer_has_warning_user_ids = None
-        item.have_two_times_lt_04 = None
-        item.have_two_times_lt_08 = None
-        item.update_at = time.time()
-        item.save()
+            'size': decimal.Decimal("0") if item.un_voted_all_vote else item.job_size,
+            'be_deducted_size_by_review': None,
+            'be_reviewer_has_warning_user_ids': None,
+            'have_two_times_lt_04': None,
+            'have_two_times_lt_08': None,
+        }
 
     # 找到小于0.8的 icpper 数据
     # 找到小于0.8的 icpper 的上一次贡献数据
     cycle_icpper_stat_list_lt_08 = []
-    last_info__id_2_ei = {}
     need_query_last_cycle_icpper_stat_id_list = []
-    for item in cycle_icpper_stat_list_query:
+    for item in cycle_icpper_stat_list:
         if item.ei < EI_08:
             cycle_icpper_stat_list_lt_08.append(item)
             if item.last_id:
                 need_query_last_cycle_icpper_stat_id_list.append(item.last_id)
-    for item in CycleIcpperStat.objects(id__in=need_query_last_cycle_icpper_stat_id_list):
+    last_info__id_2_ei = {}
+    for item in CycleIcpperStat.objects(id__in=need_query_last_cycle_icpper_stat_id_list).only('id', 'ei'):
         last_info__id_2_ei[str(item.id)] = item.ei
 
+    reviewer_index = {}
+    if cycle_icpper_stat_list_lt_08:
+        reviewer_index = _build_cycle_reviewer_index(dao_id, cycle_id)
+
     # 处理 be_reviewer_has_warning_user_ids
     for item in cycle_icpper_stat_list_lt_08:
         if item.ei < EI_04:
             if not item.last_id or last_info__id_2_ei[item.last_id] >= EI_08:
-                _process_warning_review_stat(item)
+                _process_warning_review_stat(
+                    user_id_2_result, item.user_id,
+                    _get_reviewer_merge_size(reviewer_index, item.user_id, exclude_self=False))
 
     # 处理 size
     for item in cycle_icpper_stat_list_lt_08:
@@ -165,20 +161,86 @@ def stat_cycle_icpper_stat_size(dao_id, cycle_id):
         if last_ei >= EI_08:
             continue
 
+        result = user_id_2_result[item.user_id]
         # 不是都小于04，但是都小于0.8
         if last_ei >= EI_04 or ei >= EI_04:
-            item.size = round(item.job_size/2, 2)
-            item.have_two_times_lt_08 = True
-            item.update_at = time.time()
-            item.save()
+            result['size'] = round(item.job_size/2, 2)
+            result['have_two_times_lt_08'] = True
             continue
 
         # 都小于 04
-        item.size = round(item.job_size/2, 2)
-        item.have_two_times_lt_04 = True
-        item.update_at = time.time()
-        item.save()
-        _process_04_reviewer_size(item)
+        result['size'] = round(item.job_size/2, 2)
+        result['have_two_times_lt_04'] = True
+        _process_04_reviewer_size(
+            user_id_2_stat, user_id_2_result,
+            _get_reviewer_merge_size(reviewer_index, item.user_id, exclude_self=True))
+
+    update_at = int(time.time())
+    requests = []
+    for item in cycle_icpper_stat_list:
+        requests.append(UpdateOne({'_id': item.id}, to_mongo_update(
+            CycleIcpperStat, update_at=update_at, **user_id_2_result[item.user_id])))
+    if requests:
+        CycleIcpperStat._get_collection().bulk_write(requests, ordered=False)
+
+
+def _stat_cycle_votes(dao_id, cycle_id, all_user_id_set):
+    """
+    一次聚合统计 cycle 的投票
+    返回没有投完票的 user_id 集合，和每个 user 获得投票的 job size 之和
+    pair 投票按 vote_job_id，all 投票 vote_result_stat_type_all >= 50 时按 left_job_id，同一个 job 每获得一票算一次
+    vote 对应的 job 不存在时抛出 ValueError
+    """
+    ret = next(CycleVote._get_collection().aggregate([
+        {"$match": {"dao_id": dao_id, **get_cycle_vote_match(cycle_id)}},
+        {"$facet": {
+            "un_voted_pair": [
+                {"$match": {
+                    "vote_type": CycleVoteType.PAIR.value,
+                    "$or": [{"vote_job_id": {"$in": [None, ""]}}, {"is_repeat": True}]
+                }},
+                {"$group": {"_id": "$voter_id"}}
+            ],
+            "all_voters": [
+                {"$match": {"vote_type": CycleVoteType.ALL.value}},
+                {"$project": {"voter_ids": "$vote_result_type_all.voter_id"}}
+            ],
+            "vote_size": [
+                {"$match": {"$or": [
+                    {"vote_type": CycleVoteType.PAIR.value, "vote_job_id": {"$nin": [None, ""]}},
+                    {"vote_type": CycleVoteType.ALL.value, "vote_result_stat_type_all": {"$gte": 50}}
+                ]}},
+                {"$project": {"job_id": {"$toObjectId": {"$cond": [
+                    {"$eq": ["$vote_type", CycleVoteType.PAIR.value]}, "$vote_job_id", "$left_job_id"
+                ]}}}},
+                {"$lookup": {
+                    "from": Job._get_collection_name(),
+                    "localField": "job_id",
+                    "foreignField": "_id",
+                    "as": "job"
+                }},
+                {"$unwind": {"path": "$job", "preserveNullAndEmptyArrays": True}},
+                # job 不存在时 _id 为 None，记下 job_id
+                {"$group": {
+                    "_id": "$job.user_id",
+                    "size": {"$sum": "$job.size"},
+                    "missing_job_ids": {"$addToSet": {"$cond": [{"$ifNull": ["$job._id", False]}, "$$REMOVE", "$job_id"]}}
+                }}
+            ]
+        }}
+    ]))
+
+    # 找到谁没有投完票
+    un_voted_all_vote_user_id_set = set(item['_id'] for item in ret['un_voted_pair'])
+    for item in ret['all_voters']:
+        un_voted_all_vote_user_id_set |= all_user_id_set - set(item.get('voter_ids') or [])
+
+    missing_job_ids = [str(job_id) for item in ret['vote_size'] for job_id in item['missing_job_ids']]
+    if missing_job_ids:
+        raise ValueError("cycle {} vote job not found: {}".format(cycle_id, ','.join(sorted(missing_job_ids))))
+
+    userid_2_vote_size = {item['_id']: any_to_decimal(item['size']) for item in ret['vote_size']}
+    return un_voted_all_vote_user_id_set, userid_2_vote_size
 
 
 def run_vote_result_stat_task(task_id):
@@ -221,78 +283,42 @@ def run_vote_result_stat_task(task_id):
             all_user_id_set.add(job.user_id)
 
         # 同步一下所有 cycle icpper stat
-        for user_id in all_user_id_set:
-            sync_one_cycle_icppper_stat(
-                dao_id=dao_id,
-                cycle_id=str(cycle.id),
-                user_id=user_id
-            )
-
-        # 查询所有投票
-        cycle_vote_list = list(CycleVote.objects(dao_id=dao_id, cycle_id=str(cycle.id)))
+        sync_cycle_icpper_stats(
+            dao_id=dao_id,
+            cycle_id=str(cycle.id),
+            user_ids=all_user_id_set
+        )
+
         # 标记没有投票的投票为 is_repeat = True
-        for cycle_vote in cycle_vote_list:
-            if cycle_vote.vote_type == CycleVoteType.PAIR.value:
-                if not cycle_vote.vote_job_id:
-                    cycle_vote.is_repeat = True
-                    cycle_vote.save()
-        # 找到谁没有投完票
-        un_voted_all_vote_user_id_set = set()
-        for cycle_vote in cycle_vote_list:
-            if cycle_vote.vote_type == CycleVoteType.PAIR.value:
-                if not cycle_vote.vote_job_id or cycle_vote.is_repeat:
-                    un_voted_all_vote_user_id_set.add(cycle_vote.voter_id)
-                    continue
-            if cycle_vote.vote_type == CycleVoteType.ALL.value:
-                tmp_user_id_set = set()
-                for item in cycle_vote.vote_result_type_all:
-                    tmp_user_id_set.add(item.voter_id)
-                tmp_set = all_user_id_set - tmp_user_id_set
-                for user_id in list(tmp_set):
-                    un_voted_all_vote_user_id_set.add(user_id)
-
-        # 找到所有获的投票的 job
-        vote_job_id_list = []
-        for cycle_vote in cycle_vote_list:
-            if cycle_vote.vote_type == CycleVoteType.PAIR.value:
-                if cycle_vote.vote_job_id:
-                    vote_job_id_list.append(cycle_vote.vote_job_id)
-                    continue
-            if cycle_vote.vote_type == CycleVoteType.ALL.value:
-                if cycle_vote.vote_result_stat_type_all >= 50:
-                    vote_job_id_list.append(cycle_vote.left_job_id)
-                    continue
-
-        # 找到 jobid_2_job
-        jobid_2_job = {}
-        vote_job_list = list(Job.objects(id__in=vote_job_id_list))
-        for job in vote_job_list:
-            jobid_2_job[str(job.id)] = job
-
-        # 统计 vote size
-        userid_2_vote_size = {}
-        for job_id in vote_job_id_list:
-            job = jobid_2_job[job_id]
-            userid_2_vote_size.setdefault(job.user_id, decimal.Decimal('0'))
-            userid_2_vote_size[job.user_id] += job.size
+        CycleVote.objects(
+            dao_id=dao_id, **get_cycle_vote_filter(str(cycle.id)),
+            vote_type=CycleVoteType.PAIR.value, vote_job_id__in=[None, '']
+        ).update(is_repeat=True)
+
+        un_voted_all_vote_user_id_set, userid_2_vote_size = _stat_cycle_votes(
+            dao_id, str(cycle.id), all_user_id_set)
 
         # 统计 ei
-        cycle_icpper_stat_list = list(CycleIcpperStat.objects(dao_id=dao_id, cycle_id=str(cycle.id)))
+        requests = []
+        cycle_icpper_stat_list = CycleIcpperStat.objects(
+            dao_id=dao_id, cycle_id=str(cycle.id)).only('id', 'user_id', 'job_size')
         for cycle_icpper_stat in cycle_icpper_stat_list:
-            userid_2_vote_size.setdefault(cycle_icpper_stat.user_id, decimal.Decimal('0'))
-            vote_size = userid_2_vote_size[cycle_icpper_stat.user_id]
+            vote_size = userid_2_vote_size.get(cycle_icpper_stat.user_id, decimal.Decimal('0'))
             job_size = cycle_icpper_stat.job_size
-            un_voted_all_vote = cycle_icpper_stat.user_id in un_voted_all_vote_user_id_set
 
             # vote ei
             vote_ei = round(vote_size/job_size, 2)
 
-            cycle_icpper_stat.vote_ei = vote_ei
-            cycle_icpper_stat.owner_ei = decimal.Decimal('0')
-            cycle_icpper_stat.ei = vote_ei
-            cycle_icpper_stat.un_voted_all_vote = un_voted_all_vote
-            cycle_icpper_stat.update_at = time.time()
-            cycle_icpper_stat.save()
+            requests.append(UpdateOne({'_id': cycle_icpper_stat.id}, to_mongo_update(
+                CycleIcpperStat,
+                vote_ei=vote_ei,
+                owner_ei=decimal.Decimal('0'),
+                ei=vote_ei,
+                un_voted_all_vote=cycle_icpper_stat.user_id in un_voted_all_vote_user_id_set,
+                update_at=int(time.time())
+            )))
+        if requests:
+            CycleIcpperStat._get_collection().bulk_write(requests, ordered=False)
 
         # 统计 size
         stat_cycle_icpper_stat_size(
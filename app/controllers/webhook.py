@@ -0,0 +1,257 @@
+"""
+github webhook 的处理
+
+sync 模式在请求里处理；queue 模式请求里只保存事件，由 drain worker 批量处理
+lambda 上由 serverless.yml 的 webhook_worker 每分钟调用 handler，其他环境需要定时运行
+python -m app.controllers.webhook drain
+
+ICPDAO_GITHUB_JOB_SYNC_WINDOW > 0 时，同一个 repo owner 在窗口内需要同步的 job 合并后只同步一次
+到期的记录同样由 webhook_worker 定时同步，其他环境需要定时运行
+python -m app.controllers.webhook flush
+"""
+import datetime
+import hashlib
+import hmac
+import os
+import socket
+import sys
+import time
+import traceback
+
+import iso8601
+from mongoengine import NotUniqueError
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import settings
+from app.common.models.icpdao.job import JobPR, JobPRStatusEnum
+from app.common.utils.github_app import GithubAppClient
+from app.controllers.github_app_token_cache import get_app_token
+from app.controllers.task import sync_job_issue_status_comment
+from app.models.pending_job_sync import PendingJobSync
+from app.models.webhook_event import WebhookEvent, WebhookEventStatus
+
+
+def verify_signature(body, signature):
+    """
+    配置了 ICPDAO_GITHUB_WEBHOOK_SECRET 时校验 X-Hub-Signature-256
+    """
+    if not settings.ICPDAO_GITHUB_WEBHOOK_SECRET:
+        return True
+    if not signature:
+        return False
+    expected = 'sha256=' + hmac.new(
+        settings.ICPDAO_GITHUB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def is_pr_event(data):
+    return bool(data.get('pull_request') and data.get('pull_request').get('url'))
+
+
+def update_pr_by_event(data):
+    """
+    更新 merged 的 JobPR，返回需要检查的 job_id 集合
+    """
+    need_check_jobs = set()
+    repo_owner_id = data['repository']['owner']['id']
+    repo_id = data['repository']['id']
+    pr_title = data['pull_request']['title']
+    if data.get('action') == 'closed' and data['pull_request']['merged'] is True:
+        merged_time = iso8601.parse_date(
+            data['pull_request']['merged_at'])
+        merged_at = int(
+            merged_time.replace(tzinfo=datetime.timezone.utc).timestamp())
+        JobPR.objects(
+            github_repo_owner_id=repo_owner_id,
+            github_repo_id=repo_id,
+            github_pr_number=data['pull_request']['number']
+        ).update(
+            status=JobPRStatusEnum.MERGED.value,
+            title=pr_title,
+            merged_user_github_user_id=data['pull_request']['merged_by']['id'],
+            merged_at=merged_at
+        )
+        job_ids = JobPR.objects(
+            github_repo_owner_id=repo_owner_id,
+            github_repo_id=repo_id,
+            github_pr_number=data['pull_request']['number']
+        ).distinct('job_id')
+        need_check_jobs = need_check_jobs | set(job_ids)
+    return need_check_jobs
+
+
+def get_app_client(repo_owner, repo_owner_id):
+    app_token = get_app_token(repo_owner, repo_owner_id)
+    if app_token is None:
+        raise ValueError('NOT APP TOKEN')
+    return GithubAppClient(app_token, repo_owner)
+
+
+def enqueue_webhook_event(delivery_id, event, data):
+    """
+    返回 False 表示这个 delivery 已经收到过
+    """
+    try:
+        WebhookEvent(delivery_id=delivery_id, event=event, payload=data).save()
+    except NotUniqueError:
+        return False
+    return True
+
+
+def add_pending_job_sync(repo_owner, repo_owner_id, job_ids, window=None):
+    """
+    把 job_ids 合并到 repo owner 等待同步的记录里，第一次加入时开始计算窗口
+    """
+    window = settings.ICPDAO_GITHUB_JOB_SYNC_WINDOW if window is None else window
+    now_at = int(time.time())
+    query = {'github_owner_id': repo_owner_id}
+    update = {
+        '$addToSet': {'job_ids': {'$each': list(job_ids)}},
+        '$inc': {'version': 1},
+        '$setOnInsert': {'github_owner_name': repo_owner, 'due_at': now_at + window, 'create_at': now_at}
+    }
+    try:
+        PendingJobSync._get_collection().update_one(query, update, upsert=True)
+    except DuplicateKeyError:
+        # 并发 upsert，另一个请求已经插入了
+        PendingJobSync._get_collection().update_one(query, update)
+
+
+def claim_pending_job_sync(worker, now_at, exclude_owner_ids):
+    doc = PendingJobSync._get_collection().find_one_and_update(
+        {
+            'due_at': {'$lte': now_at},
+            'github_owner_id': {'$nin': exclude_owner_ids},
+            '$or': [
+                {'claim_at': None},
+                # 同步中的 worker 挂掉了
+                {'claim_at': {'$lt': now_at - settings.ICPDAO_TASK_LEASE_TTL}},
+            ]
+        },
+        {'$set': {'claim_at': now_at, 'worker': worker}},
+        sort=[('due_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        return None
+    return PendingJobSync._from_son(doc)
+
+
+def flush_pending_job_syncs(now_at=None, worker=None):
+    """
+    同步所有到期的记录，返回同步的 repo owner 数量
+    lambda 上由 webhook_worker 定时调用（drain 结束时会调用）
+    记录先占住再同步，成功后才删除；同步期间有新的 job 加入时只释放，下次全部重新同步
+    同步失败时释放并推迟 due_at
+    """
+    now_at = now_at or int(time.time())
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    count = 0
+    skip_owner_ids = []
+    while True:
+        item = claim_pending_job_sync(worker, now_at, skip_owner_ids)
+        if not item:
+            break
+        query = {'_id': item.id, 'worker': worker}
+        release = {'$unset': {'claim_at': '', 'worker': ''}}
+        try:
+            app_client = get_app_client(item.github_owner_name, item.github_owner_id)
+            sync_job_issue_status_comment(app_client, set(item.job_ids))
+        except Exception as ex:
+            msg = traceback.format_exc()
+            print('exception log_exception' + str(ex))
+            print(msg)
+            skip_owner_ids.append(item.github_owner_id)
+            release['$set'] = {'due_at': int(time.time()) + max(settings.ICPDAO_GITHUB_JOB_SYNC_WINDOW, 60)}
+            PendingJobSync._get_collection().update_one(query, release)
+            continue
+        count += 1
+        ret = PendingJobSync._get_collection().delete_one(dict(query, version=item.version))
+        if ret.deleted_count == 0:
+            PendingJobSync._get_collection().update_one(query, release)
+            # 新加入的 job 下次再同步
+            skip_owner_ids.append(item.github_owner_id)
+    return count
+
+
+def process_pr_event(data):
+    need_check_jobs = update_pr_by_event(data)
+    if len(need_check_jobs) > 0:
+        # drain 里同一批的事件按 repo owner 合并，结束时一起同步
+        add_pending_job_sync(
+            data['repository']['owner']['login'], data['repository']['owner']['id'], need_check_jobs)
+
+
+def claim_webhook_event(worker):
+    now_at = int(time.time())
+    doc = WebhookEvent._get_collection().find_one_and_update(
+        {'$or': [
+            {'status': WebhookEventStatus.INIT},
+            # 处理中的 worker 挂掉了
+            {'status': WebhookEventStatus.RUNNING,
+             'start_at': {'$lt': now_at - settings.ICPDAO_TASK_LEASE_TTL}},
+        ]},
+        {
+            '$set': {'status': WebhookEventStatus.RUNNING, 'worker': worker,
+                     'start_at': now_at, 'update_at': now_at},
+            '$inc': {'attempts': 1}
+        },
+        sort=[('create_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        return None
+    return WebhookEvent._from_son(doc)
+
+
+def drain_webhook_events(batch_size=None, worker=None):
+    """
+    处理最多 batch_size 个事件，返回处理的数量
+    超过 ICPDAO_TASK_MAX_ATTEMPTS 次失败的事件标记为 fail，不再重试
+    done 和 fail 的事件保留 ICPDAO_GITHUB_WEBHOOK_EVENT_TTL 秒
+    """
+    batch_size = batch_size or settings.ICPDAO_GITHUB_WEBHOOK_BATCH_SIZE
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    count = 0
+    while count < batch_size:
+        item = claim_webhook_event(worker)
+        if not item:
+            break
+        count += 1
+        try:
+            if is_pr_event(item.payload):
+                process_pr_event(item.payload)
+            item.status = WebhookEventStatus.DONE
+            item.error = None
+        except Exception as ex:
+            msg = traceback.format_exc()
+            print('exception log_exception' + str(ex))
+            print(msg)
+            item.error = msg
+            item.status = WebhookEventStatus.FAIL
+            if item.attempts < settings.ICPDAO_TASK_MAX_ATTEMPTS:
+                item.status = WebhookEventStatus.INIT
+        if item.status != WebhookEventStatus.INIT:
+            item.expire_at = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=settings.ICPDAO_GITHUB_WEBHOOK_EVENT_TTL)
+        item.update_at = int(time.time())
+        item.save()
+    flush_pending_job_syncs()
+    return count
+
+
+def handler(event, context):
+    """
+    serverless.yml 里 webhook_worker 定时调用的入口，处理排队的事件并同步到期的 job
+    """
+    return {'count': drain_webhook_events()}
+
+
+if __name__ == '__main__':
+    # python -m app.controllers.webhook drain [batch_size] | flush
+    command = sys.argv[1] if len(sys.argv) > 1 else 'drain'
+    if command == 'drain':
+        print(drain_webhook_events(int(sys.argv[2]) if len(sys.argv) > 2 else None))
+    elif command == 'flush':
+        print(flush_pending_job_syncs())
@@ -0,0 +1,63 @@
+import time
+
+from mongoengine import Document, StringField, IntField, ListField, DictField
+
+
+class CycleVotePairPlanStatus:
+    PLANNED = 'planned'
+    COMMITTED = 'committed'
+
+
+class CycleVotePairPlan(Document):
+    """
+    pair 任务的结果，每个 cycle 一条
+    每次 pair 生成新的一代 vote，先存到 cycle_vote_pair_plan_vote，再分批写入 cycle_vote，
+    cycle_vote 里每条 vote 带上 generation，written 记录已经写入的条数，任务中断后可以从这里继续
+    读 cycle_vote 时只读 generation 等于 active_generation 的 vote（见 pair.get_cycle_vote_filter），
+    全部写完后更新 active_generation 切换到新的一代，之后再删除旧的 vote
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'cycle_vote_pair_plan',
+        'strict': False
+    }
+
+    cycle_id = StringField(required=True, unique=True)
+    dao_id = StringField(required=True)
+    task_id = StringField(required=True)
+    # 每次重新 pair 加 1
+    generation = IntField(required=True, default=1)
+    # 输入 job 的指纹，job 有变化时不能继续使用旧的结果
+    fingerprint = StringField(required=True)
+    status = StringField(required=True, default=CycleVotePairPlanStatus.PLANNED)
+
+    # 这一代 vote 的数量
+    vote_count = IntField(required=True, default=0)
+    voter_ids = ListField(StringField(), default=[])
+    job_ids = ListField(StringField(), default=[])
+    written = IntField(required=True, default=0)
+
+    # 当前生效的一代，为空时只有 plan 之前没有 generation 的 vote 生效
+    active_generation = IntField()
+
+    create_at = IntField(required=True, default=time.time)
+    update_at = IntField(required=True, default=time.time)
+
+
+class CycleVotePairPlanVote(Document):
+    """
+    CycleVotePairPlan 每一代的 vote，index 是写入 cycle_vote 的顺序，写完后删除
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'cycle_vote_pair_plan_vote',
+        'strict': False,
+        'indexes': [
+            ('cycle_id', 'generation', 'index'),
+        ]
+    }
+
+    cycle_id = StringField(required=True)
+    generation = IntField(required=True)
+    index = IntField(required=True)
+    vote = DictField(required=True)
@@ -0,0 +1,28 @@
+import decimal
+import time
+
+from mongoengine import Document, StringField, IntField, EmbeddedDocumentListField
+
+from app.common.models.extension.decimal128_field import Decimal128Field
+from app.common.models.icpdao.base import TokenIncome
+
+
+class DAOStat(Document):
+    """
+    dao 的 following/job/size/incomes 统计，由修改这些数据的逻辑增量维护
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'dao_stat',
+        'strict': False
+    }
+
+    dao_id = StringField(required=True, unique=True)
+    following = IntField(default=0)
+    job = IntField(default=0)
+    size = Decimal128Field(default=decimal.Decimal('0'))
+    # all token all income
+    token = Decimal128Field(default=decimal.Decimal('0'))
+    incomes = EmbeddedDocumentListField(TokenIncome, default=[])
+
+    update_at = IntField(required=True, default=time.time)
@@ -0,0 +1,30 @@
+import decimal
+import time
+
+from mongoengine import Document, StringField, IntField, EmbeddedDocumentListField
+
+from app.common.models.extension.decimal128_field import Decimal128Field
+from app.common.models.icpdao.base import TokenIncome
+
+
+class HomeStatsSnapshot(Document):
+    """
+    首页 HomeStats 的统计快照，每个 token_chain_id 一条，过期后重新计算
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'home_stats_snapshot',
+        'strict': False
+    }
+
+    token_chain_id = StringField(required=True, unique=True)
+    dao = IntField(default=0)
+    icpper = IntField(default=0)
+    size = Decimal128Field(default=decimal.Decimal('0'))
+    income_sum = Decimal128Field(default=decimal.Decimal('0'))
+    incomes = EmbeddedDocumentListField(TokenIncome, default=[])
+
+    # 统计完成时间
+    stat_at = IntField(required=True, default=time.time)
+    # 最近一次触发重新统计的时间，用来保证一个 ttl 内只触发一次
+    refresh_at = IntField(required=True, default=time.time)
@@ -0,0 +1,31 @@
+import time
+
+from mongoengine import Document, StringField, IntField, ListField
+
+
+class PendingJobSync(Document):
+    """
+    等待合并处理的 webhook job 同步，每个 repo owner 一条
+    窗口内收到的 job_id 合并到一起，due_at 之后一次调用 sync_job_issue_status_comment
+    flush 时先用 claim_at 占住记录，同步成功后才删除，worker 挂掉时超过 ICPDAO_TASK_LEASE_TTL 可以重新占用
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'pending_job_sync',
+        'strict': False,
+        'indexes': [
+            {'fields': ['github_owner_id'], 'unique': True},
+            'due_at'
+        ]
+    }
+
+    github_owner_id = IntField(required=True)
+    github_owner_name = StringField(required=True)
+    job_ids = ListField(StringField(), default=[])
+    due_at = IntField(required=True)
+    # 每次加入 job 加 1，同步期间有新的 job 加入时不删除记录
+    version = IntField(required=True, default=0)
+    claim_at = IntField()
+    worker = StringField()
+
+    create_at = IntField(required=True, default=time.time)
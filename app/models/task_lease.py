@@ -0,0 +1,29 @@
+import time
+
+from mongoengine import Document, StringField, IntField
+
+
+class TaskLease(Document):
+    """
+    cycle 任务的租约，运行任务的进程持有租约并定时续期（heartbeat）
+    进程挂掉后租约过期，sweeper 会把任务重置后重新运行；attempts 记录运行次数
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'task_lease',
+        'strict': False,
+        'indexes': [
+            {'fields': ['name', 'task_id'], 'unique': True}
+        ]
+    }
+
+    # TASK_FUNCS 里的名字
+    name = StringField(required=True)
+    task_id = StringField(required=True)
+    # 没有进程持有时为空
+    owner = StringField()
+    expire_at = IntField()
+    heartbeat_at = IntField()
+    attempts = IntField(required=True, default=0)
+
+    create_at = IntField(required=True, default=time.time)
@@ -0,0 +1,37 @@
+import time
+
+from mongoengine import Document, StringField, IntField
+
+
+class TaskQueueItemStatus:
+    INIT = 'init'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAIL = 'fail'
+
+
+class TaskQueueItem(Document):
+    """
+    queue 方式运行的 cycle 任务，worker 从这里领取
+    任务本身的状态还是记录在 CycleVotePairTask 这些 *Task 里，这里只记录排队和执行情况
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'task_queue_item',
+        'strict': False,
+        'indexes': [
+            {'fields': ['name', 'task_id'], 'unique': True},
+            ('status', 'create_at')
+        ]
+    }
+
+    # TASK_FUNCS 里的名字
+    name = StringField(required=True)
+    task_id = StringField(required=True)
+    status = StringField(required=True, default=TaskQueueItemStatus.INIT)
+    worker = StringField()
+    error = StringField()
+
+    start_at = IntField()
+    create_at = IntField(required=True, default=time.time)
+    update_at = IntField(required=True, default=time.time)
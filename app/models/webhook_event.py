@@ -0,0 +1,43 @@
+import time
+
+from mongoengine import Document, StringField, IntField, DictField, DateTimeField
+
+
+class WebhookEventStatus:
+    INIT = 'init'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAIL = 'fail'
+
+
+class WebhookEvent(Document):
+    """
+    queue 模式下收到的 github webhook，原样保存后由 drain worker 处理
+    delivery_id 是 X-GitHub-Delivery，github 重发同一个事件时不会重复处理
+    处理完的事件设置 expire_at，到时间后由 TTL 索引删除
+    """
+    meta = {
+        'db_alias': 'icpdao',
+        'collection': 'webhook_event',
+        'strict': False,
+        'indexes': [
+            {'fields': ['delivery_id'], 'unique': True},
+            ('status', 'create_at'),
+            {'fields': ['expire_at'], 'expireAfterSeconds': 0}
+        ]
+    }
+
+    delivery_id = StringField(required=True)
+    # X-GitHub-Event
+    event = StringField()
+    payload = DictField(required=True)
+    status = StringField(required=True, default=WebhookEventStatus.INIT)
+    attempts = IntField(required=True, default=0)
+    worker = StringField()
+    error = StringField()
+
+    start_at = IntField()
+    # TTL 索引需要 datetime，处理中的事件为空
+    expire_at = DateTimeField()
+    create_at = IntField(required=True, default=time.time)
+    update_at = IntField(required=True, default=time.time)
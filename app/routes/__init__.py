@@ -2,13 +2,14 @@ from graphene import ObjectType, String, Field, Int, List
 
 import settings
 from app.common.models.extension.decimal128_field import any_to_decimal
-from app.common.models.icpdao.github_app_token import GithubAppToken
-from app.common.models.icpdao.job import Job
-from app.common.models.icpdao.dao import DAO as DAOModel
 from app.common.utils.errors import COMMON_NOT_AUTH_ERROR, COMMON_NOT_FOUND_DAO_ERROR, OPEN_GITHUB_PARAMETER_ERROR, \
     OPEN_GITHUB_RUN_ERROR
 from app.common.utils.github_app import GithubAppClient
 from app.common.utils.route_helper import get_current_user_by_graphql
+from app.controllers.dao_stat import stat_dao_jobs
+from app.controllers.github_app_token_cache import get_app_token
+from app.controllers.home_stats import get_home_stats
+from app.controllers.model_cache import get_dao_by_github_owner_name
 from app.routes.config import UpdateDAOJobConfig, DAOJobConfig, DAOTokenConfig
 from app.routes.cycles import CycleQuery, CreateCycleVotePairTaskByOwner, \
     ChangeVoteResultPublic, CreateCycleVoteResultStatTaskByOwner, CreateCycleVoteResultPublishTaskByOwner, \
@@ -110,18 +111,21 @@ class Query(ObjectType):
 
     @staticmethod
     def resolve_stats(root, info):
-        return HomeStats().get_query()
+        return HomeStats().get_query(info)
 
     @staticmethod
     def resolve_daos(root, info, **kwargs):
-        query_dao_list, all_dao_ids = get_query_dao_list(info, **kwargs)
-        all_dao_ids_str = [str(i) for i in all_dao_ids]
-        icpper = Job.objects(dao_id__in=all_dao_ids_str).distinct('user_id')
-        size = any_to_decimal(Job.objects(dao_id__in=all_dao_ids_str).sum('size'))
-        # all dao income use all dao all token address all income, PS: to be a lot bigger than it actually is
-        incomes = Job.objects(dao_id__in=all_dao_ids_str).group_incomes(token_chain_id=kwargs.get('token_chain_id', settings.ICPDAO_MINT_TOKEN_ETH_CHAIN_ID))
-        stat = DAOsStat(icpper=len(icpper), size=size, incomes=incomes)
-        return DAOs(_args=DAOQueryArgs(query=query_dao_list), stat=stat, total=len(all_dao_ids))
+        query_dao_list, dao_ids, total = get_query_dao_list(info, **kwargs)
+        token_chain_id = kwargs.get('token_chain_id', settings.ICPDAO_MINT_TOKEN_ETH_CHAIN_ID)
+        if dao_ids is None:
+            # 没有过滤时和首页一样只统计还存在的 dao，直接用首页的快照
+            snapshot = get_home_stats(token_chain_id, info.context.get('background'))
+            stat = DAOsStat(icpper=snapshot.icpper, size=any_to_decimal(snapshot.size), incomes=snapshot.incomes)
+        else:
+            # all dao income use all dao all token address all income, PS: to be a lot bigger than it actually is
+            job_stat = stat_dao_jobs(dao_ids, token_chain_id)
+            stat = DAOsStat(icpper=job_stat['icpper'], size=job_stat['size'], incomes=job_stat['incomes'])
+        return DAOs(_args=DAOQueryArgs(query=query_dao_list), stat=stat, total=total)
 
     @staticmethod
     def resolve_jobs(root, info, **kwargs):
@@ -167,16 +171,11 @@ class Query(ObjectType):
         current_user = get_current_user_by_graphql(info)
         assert current_user, COMMON_NOT_AUTH_ERROR
 
-        dao = DAOModel.objects(github_owner_name=dao_name).first()
+        dao = get_dao_by_github_owner_name(dao_name)
         if not dao:
             raise ValueError(COMMON_NOT_FOUND_DAO_ERROR)
 
-        app_token = GithubAppToken.get_token(
-            app_id=settings.ICPDAO_GITHUB_APP_ID,
-            app_private_key=settings.ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY,
-            github_owner_name=dao.github_owner_name,
-            github_owner_id=dao.github_owner_id,
-        )
+        app_token = get_app_token(dao.github_owner_name, dao.github_owner_id)
         if app_token is None:
             raise ValueError('NOT APP TOKEN')
         app_client = GithubAppClient(app_token, dao.github_owner_name)
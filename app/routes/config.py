@@ -15,6 +15,7 @@ from app.common.utils.access import check_is_dao_owner
 from app.common.utils.errors import CONFIG_UPDATE_INVALID_ERROR, COMMON_NOT_FOUND_DAO_ERROR, CYCLE_NOT_FOUND_ERROR, \
     CYCLE_PREVIEW_PARAMS_INVALID_ERROR
 from app.common.utils.route_helper import get_current_user_by_graphql
+from app.controllers.model_cache import get_dao_job_config, invalidate_dao_job_config
 
 
 class UpdateDAOJobConfig(Mutation):
@@ -52,6 +53,7 @@ class UpdateDAOJobConfig(Mutation):
             f'{record.voting_begin_day}.{record.voting_begin_hour}') <= decimal.Decimal(
               f'{record.voting_end_day}.{record.voting_end_hour}'):
             record.save()
+            invalidate_dao_job_config(dao_id)
             return UpdateDAOJobConfig(ok=True)
         raise ValueError(CONFIG_UPDATE_INVALID_ERROR)
 
@@ -131,8 +133,7 @@ class DAOJobConfig(BaseObjectType):
     get_next_cycle = Field(DAOJobCycle)
 
     def resolve_datum(self, info):
-        record = DAOJobConfigModel.objects(dao_id=self._args.dao_id).first()
-        return record
+        return get_dao_job_config(self._args.dao_id)
 
     def resolve_this_cycle(self, info):
         now_time = int(time.time())
@@ -210,7 +211,7 @@ class DAOJobConfig(BaseObjectType):
         )
 
     def resolve_get_next_cycle(self, info):
-        config = DAOJobConfigModel.objects(dao_id=self._args.dao_id).first()
+        config = get_dao_job_config(self._args.dao_id)
         return _get_next_cycle(
             self._args.dao_id, config.time_zone,
             config.deadline_day, config.deadline_time,
@@ -257,7 +258,7 @@ def _get_next_cycle(
 
 
 def get_predict_cycle(dao_id, begin_at):
-    config = DAOJobConfigModel.objects(dao_id=dao_id).first()
+    config = get_dao_job_config(dao_id)
     end_at = get_next_time(
         config.time_zone, int(time.time()),
         config.deadline_day, config.deadline_time, False)
@@ -14,7 +14,6 @@ from app.common.models.icpdao.cycle import Cycle, CycleIcpperStat, CycleVote, Cy
 from app.common.models.icpdao.dao import DAO
 from app.common.models.icpdao.job import Job, JobStatusEnum
 from app.common.models.icpdao.token import TokenMintRecord, MintRecordStatusEnum
-from app.common.models.icpdao.user import User
 from app.common.schema import BaseObjectType, BaseObjectArgs
 from app.common.schema.icpdao import CycleSchema, CycleIcpperStatSchema, UserSchema, JobSchema, CycleVoteSchema
 from app.common.schema.incomes import TokenIncomeSchema
@@ -23,12 +22,11 @@ from app.common.utils.errors import CYCLE_VOTE_CONFIRM_INVALID_ERROR, CYCLE_VOTE
     CYCLE_ICPPER_STAT_NOT_FOUND_ERROR, CYCLE_TOKEN_RELEASED_CHECK_ERROR, CYCLE_NOT_FOUND_ERROR, \
     COMMON_NOT_FOUND_DAO_ERROR, COMMON_NOT_PERMISSION_ERROR, CYCLE_PAIR_TIME_ERROR, CYCLE_VOTE_RESULT_STAT_TIME_ERROR, \
     CYCLE_VOTE_RESULT_PUBLISH_TIME_ERROR, CYCLE_VOTE_RESULT_PUBLISH_INVALID_ERROR, COMMON_PARAMS_INVALID
-from app.common.utils.route_helper import get_custom_attr_by_graphql, set_custom_attr_by_graphql, \
-    get_current_user_by_graphql
-from app.controllers.pair import run_pair_task
-from app.controllers.vote_result_publish import run_vote_result_publish_task
-from app.controllers.vote_result_stat import run_vote_result_stat_task
-from app.routes.data_loaders import UserLoader, JobLoader, CycleLoader
+from app.common.utils.route_helper import set_custom_attr_by_graphql, get_current_user_by_graphql
+from app.controllers.model_cache import get_dao, get_dao_by_github_owner_name, get_user_by_github_login
+from app.controllers.pair import get_cycle_vote_filter
+from app.controllers.task_runner import run_task, reclaim_expired_task
+from app.routes.data_loaders import UserLoader, JobLoader, CycleLoader, CycleIcpperStatLoader, get_loader
 from app.routes.schema import CycleIcpperStatSortedTypeEnum, CycleIcpperStatSortedEnum, JobsQuerySortedEnum, \
     JobsQuerySortedTypeEnum, JobsQueryPairTypeEnum, CycleVotePairTaskStatusEnum, \
     CreateCycleVotePairTaskByOwnerStatusEnum, CycleFilterEnum, CreateCycleVoteResultStatTaskByOwnerStatusEnum, \
@@ -46,21 +44,21 @@ class IcpperStatQuery(ObjectType):
 
     def resolve_last_ei(self, info):
         if self.datum.last_id:
-            last_item = CycleIcpperStat.objects(id=self.datum.last_id).first()
-            return last_item.ei
+            cycle_icpper_stat_loader = get_loader(info, CycleIcpperStatLoader)
+            return cycle_icpper_stat_loader.load(self.datum.last_id).then(lambda last_item: last_item.ei)
         return None
 
     def resolve_icpper(self, info):
-        user_loader = get_custom_attr_by_graphql(info, 'user_loader')
+        user_loader = get_loader(info, UserLoader)
         return user_loader.load(self.datum.user_id)
 
     def resolve_cycle(self, info):
-        cycle_loader = get_custom_attr_by_graphql(info, 'cycle_loader')
+        cycle_loader = get_loader(info, CycleLoader)
         return cycle_loader.load(self.datum.cycle_id)
 
     def resolve_be_reviewer_has_warning_users(self, info):
         if self.datum.be_reviewer_has_warning_user_ids:
-            user_loader = get_custom_attr_by_graphql(info, 'user_loader')
+            user_loader = get_loader(info, UserLoader)
             return user_loader.load_many(self.datum.be_reviewer_has_warning_user_ids)
         return []
 
@@ -123,11 +121,9 @@ class IcpperStatsQuery(ObjectType):
             query = query.order_by(sort_string)
 
         cycle = Cycle.objects(id=self.cycle_id).first()
-        dao_owner_id = DAO.objects(id=cycle.dao_id).first().owner_id
+        dao_owner_id = get_dao(cycle.dao_id).owner_id
 
         set_custom_attr_by_graphql(info, 'dao_owner_id', dao_owner_id)
-        set_custom_attr_by_graphql(info, 'user_loader', UserLoader())
-        set_custom_attr_by_graphql(info, 'cycle_loader', CycleLoader())
 
         return [IcpperStatQuery(datum=item) for item in query.limit(self.first).skip(self.offset)]
 
@@ -137,7 +133,7 @@ class JobQuery(ObjectType):
     user = Field(lambda: UserSchema)
 
     def resolve_user(self, info):
-        user_loader = get_custom_attr_by_graphql(info, 'user_loader')
+        user_loader = get_loader(info, UserLoader)
         return user_loader.load(self.datum.user_id)
 
 
@@ -159,7 +155,6 @@ class JobsQuery(BaseObjectType):
 
     def resolve_nodes(self, info):
         query = self._args.get('query')
-        set_custom_attr_by_graphql(info, 'user_loader', UserLoader())
         return [JobQuery(datum=item) for item in query.limit(self._args.get('first')).skip(self._args.get('offset'))]
 
     def resolve_stat(self, info, token_chain_id):
@@ -210,8 +205,8 @@ class UserIcpperStatsQuery(ObjectType):
         if _info:
             return _info
         else:
-            dao = DAO.objects(github_owner_name=self.dao_name).first()
-            user = User.objects(github_login=self.user_name).first()
+            dao = get_dao_by_github_owner_name(self.dao_name)
+            user = get_user_by_github_login(self.user_name)
             un_show_cycle_list = Cycle.objects(dao_id=str(dao.id), vote_result_published_at__exists=False)
             un_showw_cycle_id_list = []
             for cycle in un_show_cycle_list:
@@ -244,8 +239,6 @@ class UserIcpperStatsQuery(ObjectType):
         ).order_by("-create_at")
 
         set_custom_attr_by_graphql(info, 'dao_owner_id', dao.owner_id)
-        set_custom_attr_by_graphql(info, 'user_loader', UserLoader())
-        set_custom_attr_by_graphql(info, 'cycle_loader', CycleLoader())
 
         return [IcpperStatQuery(datum=item) for item in query.limit(self.first).skip(self.offset)]
 
@@ -263,12 +256,12 @@ class JobItemQuery(ObjectType):
         setattr(self, '_job_id', job_id)
 
     def resolve_datum(self, info):
-        job_loader = get_custom_attr_by_graphql(info, 'job_loader')
+        job_loader = get_loader(info, JobLoader)
         return job_loader.load(self.job_id)
 
     def resolve_user(self, info):
-        job_loader = get_custom_attr_by_graphql(info, 'job_loader')
-        user_loader = get_custom_attr_by_graphql(info, 'user_loader')
+        job_loader = get_loader(info, JobLoader)
+        user_loader = get_loader(info, UserLoader)
         return job_loader.load(self.job_id).then(lambda item: user_loader.load(item.user_id))
 
 
@@ -292,7 +285,7 @@ class CycleVoteQuery(ObjectType):
         return None
 
     def resolve_voter(self, info):
-        user_loader = get_custom_attr_by_graphql(info, 'user_loader')
+        user_loader = get_loader(info, UserLoader)
         if CycleVoteSchema.have_view_voter_id_role(info, self.datum) and self.datum.voter_id:
             return user_loader.load(self.datum.voter_id)
         return None
@@ -367,7 +360,7 @@ class CycleVotesQuery(ObjectType):
         setattr(self, '_filter', filter)
 
     def _base_queryset(self, info):
-        query = CycleVote.objects.filter(cycle_id=self.cycle_id)
+        query = CycleVote.objects.filter(**get_cycle_vote_filter(self.cycle_id))
         current_user = get_current_user_by_graphql(info)
         if self.is_myself:
             query = query.filter(Q(voter_id=str(current_user.id)) | Q(vote_type=CycleVoteType.ALL.value))
@@ -402,11 +395,9 @@ class CycleVotesQuery(ObjectType):
         query = self._base_queryset(info)
 
         cycle = Cycle.objects(id=self.cycle_id).first()
-        dao_owner_id = DAO.objects(id=cycle.dao_id).first().owner_id
+        dao_owner_id = get_dao(cycle.dao_id).owner_id
         set_custom_attr_by_graphql(info, 'dao_owner_id', dao_owner_id)
 
-        set_custom_attr_by_graphql(info, 'user_loader', UserLoader())
-        set_custom_attr_by_graphql(info, 'job_loader', JobLoader())
 
         return [CycleVoteQuery(datum=item) for item in query.limit(self.first).skip(self.offset)]
 
@@ -417,7 +408,7 @@ class CycleVotesQuery(ObjectType):
     def resolve_user_un_vote_total(self, info):
         current_user = get_current_user_by_graphql(info)
         return CycleVote.objects(
-            Q(cycle_id=self.cycle_id) &
+            Q(**get_cycle_vote_filter(self.cycle_id)) &
             (
                 Q(voter_id=str(current_user.id), vote_type=CycleVoteType.PAIR.value, vote_job_id__exists=False) |
                 Q(vote_type=CycleVoteType.ALL.value, vote_result_type_all__voter_id__ne=str(current_user.id))
@@ -427,7 +418,7 @@ class CycleVotesQuery(ObjectType):
     def resolve_user_voted_total(self, info):
         current_user = get_current_user_by_graphql(info)
         return CycleVote.objects(
-            Q(cycle_id=self.cycle_id) &
+            Q(**get_cycle_vote_filter(self.cycle_id)) &
             (
                 Q(voter_id=str(current_user.id), vote_type=CycleVoteType.PAIR.value, vote_job_id__exists=True) |
                 Q(vote_type=CycleVoteType.ALL.value, vote_result_type_all__voter_id=str(current_user.id))
@@ -439,7 +430,7 @@ class CycleVotesQuery(ObjectType):
         if self.filter in [CycleVoteFilterEnum.need_repeat_all, CycleVoteFilterEnum.need_repeat_un_vote]:
             current_user = get_current_user_by_graphql(info)
             assert current_user, CYCLE_VOTE_CONFIRM_INVALID_ERROR
-            dao = DAO.objects(id=cycle.dao_id).first()
+            dao = get_dao(cycle.dao_id)
             assert str(current_user.id) == dao.owner_id, COMMON_NOT_PERMISSION_ERROR
             cvc = CycleVoteConfirm.objects(
                 dao_id=cycle.dao_id,
@@ -777,7 +768,11 @@ class CreateCycleVotePairTaskByOwner(Mutation):
         old_task = CycleVotePairTask.objects(cycle_id=str(cycle.id)).order_by('-id').first()
         # have old task sttatus is init pairing
         if old_task and old_task.status in [CycleVotePairTaskStatus.INIT.value, CycleVotePairTaskStatus.PAIRING.value]:
-            return CreateCycleVotePairTaskByOwner(status=old_task.status)
+            # 运行它的进程挂掉时重置后重新运行，超过次数的变成 FAIL，可以重新创建
+            status = reclaim_expired_task(
+                'pair', old_task, info.context['background'], rerun=os.environ.get('IS_UNITEST') != 'yes')
+            if status in [CycleVotePairTaskStatus.INIT.value, CycleVotePairTaskStatus.PAIRING.value]:
+                return CreateCycleVotePairTaskByOwner(status=status)
 
         task = CycleVotePairTask(
             dao_id=cycle.dao_id,
@@ -786,8 +781,7 @@ class CreateCycleVotePairTaskByOwner(Mutation):
 
         # TODO PAIR
         if os.environ.get('IS_UNITEST') != 'yes':
-            background_tasks = info.context['background']
-            background_tasks.add_task(run_pair_task, str(task.id))
+            run_task('pair', str(task.id), info.context['background'])
         return CreateCycleVotePairTaskByOwner(status=task.status)
 
 
@@ -818,17 +812,19 @@ class CreateCycleVoteResultStatTaskByOwner(Mutation):
         old_task = CycleVoteResultStatTask.objects(cycle_id=str(cycle.id)).order_by('-id').first()
         # have old task sttatus is init stating
         if old_task and old_task.status in [CycleVoteResultStatTaskStatus.INIT.value, CycleVoteResultStatTaskStatus.STATING.value]:
-            return CreateCycleVoteResultStatTaskByOwner(status=old_task.status)
+            # 运行它的进程挂掉时重置后重新运行，超过次数的变成 FAIL，可以重新创建
+            status = reclaim_expired_task(
+                'vote_result_stat', old_task, info.context['background'], rerun=os.environ.get('IS_UNITEST') != 'yes')
+            if status in [CycleVoteResultStatTaskStatus.INIT.value, CycleVoteResultStatTaskStatus.STATING.value]:
+                return CreateCycleVoteResultStatTaskByOwner(status=status)
 
         task = CycleVoteResultStatTask(
             dao_id=cycle.dao_id,
             cycle_id=str(cycle.id)
         ).save()
 
-        # TODO 优化 task 运行方式
         if os.environ.get('IS_UNITEST') != 'yes':
-            background_tasks = info.context['background']
-            background_tasks.add_task(run_vote_result_stat_task, str(task.id))
+            run_task('vote_result_stat', str(task.id), info.context['background'])
         return CreateCycleVoteResultStatTaskByOwner(status=task.status)
 
 
@@ -861,17 +857,19 @@ class CreateCycleVoteResultPublishTaskByOwner(Mutation):
         old_task = CycleVoteResultPublishTask.objects(cycle_id=str(cycle.id)).order_by('-id').first()
         # have old task sttatus is init running
         if old_task and old_task.status in [CycleVoteResultPublishTaskStatus.INIT.value, CycleVoteResultPublishTaskStatus.RUNNING.value]:
-            return CreateCycleVoteResultPublishTaskByOwner(status=old_task.status)
+            # 运行它的进程挂掉时重置后重新运行，超过次数的变成 FAIL，可以重新创建
+            status = reclaim_expired_task(
+                'vote_result_publish', old_task, info.context['background'], rerun=os.environ.get('IS_UNITEST') != 'yes')
+            if status in [CycleVoteResultPublishTaskStatus.INIT.value, CycleVoteResultPublishTaskStatus.RUNNING.value]:
+                return CreateCycleVoteResultPublishTaskByOwner(status=status)
 
         task = CycleVoteResultPublishTask(
             dao_id=cycle.dao_id,
             cycle_id=str(cycle.id)
         ).save()
 
-        # TODO 优化 task 运行方式
         if os.environ.get('IS_UNITEST') != 'yes':
-            background_tasks = info.context['background']
-            background_tasks.add_task(run_vote_result_publish_task, str(task.id))
+            run_task('vote_result_publish', str(task.id), info.context['background'])
         return CreateCycleVoteResultPublishTaskByOwner(status=task.status)
 
 
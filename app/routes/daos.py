@@ -11,13 +11,18 @@ from collections import defaultdict
 
 from app.common.models.extension.decimal128_field import any_to_decimal
 from app.common.models.icpdao.cycle import Cycle, CycleVotePairTask, CycleVotePairTaskStatus
-from app.common.models.icpdao.user import UserStatus, User
+from app.common.models.icpdao.user import UserStatus
 from app.common.models.logic.user_helper import pre_icpper_to_icpper, check_user_access_token
 from app.common.schema import BaseObjectType, BaseObjectArgs
 from app.common.schema.incomes import TokenIncomeSchema
 from app.common.utils.errors import CYCLE_DAO_LIST_USER_NOT_FOUND_ERROR, DAO_LIST_QUERY_NOT_USER_ERROR, \
     COMMON_NOT_FOUND_DAO_ERROR, COMMON_NOT_PERMISSION_ERROR, COMMON_NOT_AUTH_ERROR, COMMON_PARAMS_INVALID
-from app.routes.data_loaders import UserLoader
+from app.controllers.dao_stat import ensure_dao_stats, job_stat_facets, parse_job_stat_facets
+from app.controllers.model_cache import get_dao, get_dao_by_name, get_user_by_github_login, invalidate_dao, \
+    invalidate_dao_job_config, invalidate_user
+from app.controllers.home_stats import get_home_stats
+from app.models.dao_stat import DAOStat as DAOStatModel
+from app.routes.data_loaders import UserLoader, DAOFollowLoader, DAOTokenLoader, DAOStatLoader, get_loader
 from app.routes.token_mint_records import TokenMintRecordsQuery, TokenMintSplitInfoQuery
 from settings import ICPDAO_GITHUB_APP_ID, ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY, ICPDAO_GITHUB_APP_NAME, ICPDAO_MINT_TOKEN_ETH_CHAIN_ID
 
@@ -28,7 +33,7 @@ from app.common.models.icpdao.job import Job as JobModel, JobStatusEnum, Job
 from app.common.schema.icpdao import DAOSchema, UserSchema, DAOTokenSchema
 from app.common.models.icpdao.user_github_token import UserGithubToken
 from app.common.utils.access import check_is_icpper, check_is_dao_owner
-from app.common.utils.route_helper import get_current_user_by_graphql, set_custom_attr_by_graphql
+from app.common.utils.route_helper import get_current_user_by_graphql
 from app.common.utils.github_rest_api import org_member_role_is_admin, check_icp_app_installed_status_of_org, get_icp_app_jwt, get_github_org_id
 from app.routes.schema import DAOsFilterEnum, DAOsSortedEnum, \
     DAOsSortedTypeEnum, CycleFilterEnum, CyclesQueryArgs, IcppersQuerySortedEnum, IcppersQuerySortedTypeEnum, \
@@ -75,7 +80,7 @@ def get_query_dao_list(info, **kwargs):
     query_user = current_user
     query_user_name = kwargs.get('user_name')
     if query_user_name:
-        user = User.objects(github_login=query_user_name).first()
+        user = get_user_by_github_login(query_user_name)
         assert user, CYCLE_DAO_LIST_USER_NOT_FOUND_ERROR
         query_user = user
 
@@ -116,32 +121,81 @@ def get_query_dao_list(info, **kwargs):
     else:
         query_dao_list = DAOModel.objects()
 
-    dao_ids = query_dao_list.distinct('_id')
+    # 不带条件时不需要 dao id 列表，统计用首页的快照（只统计还存在的 dao）
+    if query:
+        dao_ids = [str(i) for i in query_dao_list.distinct('_id')]
+        total = len(dao_ids)
+    else:
+        dao_ids = None
+        total = query_dao_list.count()
+
+    if _sorted is None:
+        _sorted = DAOsSortedEnum.number.value
+    if _sorted_type is None:
+        _sorted_type = DAOsSortedTypeEnum.asc.value
+
+    ensure_dao_stats(dao_ids)
+
+    page_stat_list = list(query_dao_list.aggregate(_dao_list_stat_pipeline(
+        _sorted, _sorted_type, _offset, _first)))
+    page_dao_dict = {
+        str(item.id): item for item in DAOModel.objects(id__in=[item['_id'] for item in page_stat_list])}
 
     dao_list = []
-    for item in query_dao_list.all():
-        following = DAOFollowModel.objects(dao_id=str(item.id)).count()
-        job_query = JobModel.objects(dao_id=str(item.id), status__nin=[JobStatusEnum.AWAITING_MERGER.value])
-        job = job_query.count()
-        size = any_to_decimal(job_query.sum('size'))
-        token = any_to_decimal(job_query.sum('incomes.income'))
+    for item in page_stat_list:
+        stat = _dao_stat_schema(item, token_chain_id)
         dao_list.append(dict(
-            following=following, job=job, size=size, token=token, number=item.number, datum=item,
-            stat=DAOStat(
-                following=following, job=job, size=size, incomes=job_query.group_incomes(token_chain_id=token_chain_id))
+            following=stat.following, job=stat.job, size=stat.size, token=any_to_decimal(item['token']),
+            number=item['number'], datum=page_dao_dict[item['_id']], stat=stat, stat_doc=item
         ))
 
-    if _sorted is not None or _sorted_type is not None:
-        if _sorted is None:
-            _sorted = DAOsSortedEnum.number.value
-        if _sorted_type is None:
-            _sorted_type = DAOsSortedTypeEnum.asc.value
+    return dao_list, dao_ids, total
 
-        dao_list.sort(
-            key=lambda x: x[_sorted],
-            reverse=False if _sorted_type == DAOsSortedTypeEnum.asc.value else True)
 
-    return dao_list[_offset:_offset+_first], dao_ids
+def _dao_list_stat_pipeline(_sorted, _sorted_type, offset, first):
+    """
+    join every candidate dao with its dao_stat, sorted and paged by mongo
+    """
+    format_sorted_type = 1 if _sorted_type == DAOsSortedTypeEnum.asc.value else -1
+    pipeline = [
+        {"$project": {"_id": {"$toString": "$_id"}, "number": 1}},
+        {"$lookup": {
+            "from": DAOStatModel._get_collection_name(),
+            "localField": "_id",
+            "foreignField": "dao_id",
+            "as": "stat"
+        }},
+        {"$unwind": {"path": "$stat", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "number": 1,
+            "following": {"$ifNull": ["$stat.following", 0]},
+            "job": {"$ifNull": ["$stat.job", 0]},
+            "size": {"$ifNull": ["$stat.size", 0]},
+            "token": {"$ifNull": ["$stat.token", 0]},
+            "incomes": {"$ifNull": ["$stat.incomes", []]}
+        }},
+        {"$sort": {_sorted: format_sorted_type, "_id": 1}},
+        {"$skip": offset}
+    ]
+    # mongo 的 $limit 必须大于 0，first 为 0 时返回空列表
+    pipeline.append({"$limit": first} if first > 0 else {"$match": {"_id": None}})
+    return pipeline
+
+
+def _dao_stat_schema(stat, token_chain_id):
+    """
+    dao_stat raw document -> DAOStat
+    """
+    return DAOStat(
+        following=stat.get('following', 0), job=stat.get('job', 0),
+        size=any_to_decimal(stat.get('size', 0)),
+        incomes=[TokenIncomeSchema(
+            token_chain_id=r['token_chain_id'],
+            token_address=r['token_address'],
+            token_symbol=r.get('token_symbol'),
+            income=any_to_decimal(r['income'])
+        ) for r in stat.get('incomes', []) if r['token_chain_id'] == token_chain_id]
+    )
 
 
 class HomeStats(ObjectType):
@@ -157,36 +211,36 @@ class HomeStats(ObjectType):
         token_chain_id=String(default_value=ICPDAO_MINT_TOKEN_ETH_CHAIN_ID)
     )
 
-    def get_query(self):
-        all_dao_ids = DAOModel.objects().distinct('_id')
-        all_dao_ids_str = [str(i) for i in all_dao_ids]
-        setattr(self, 'all_dao_ids_str', all_dao_ids_str)
+    def get_query(self, info):
+        setattr(self, 'background', info.context.get('background'))
+        setattr(self, 'snapshots', {})
         return self
 
+    def get_snapshot(self, token_chain_id=ICPDAO_MINT_TOKEN_ETH_CHAIN_ID):
+        snapshots = getattr(self, 'snapshots')
+        if token_chain_id not in snapshots:
+            snapshots[token_chain_id] = get_home_stats(token_chain_id, getattr(self, 'background'))
+        return snapshots[token_chain_id]
+
     @staticmethod
     def resolve_income_sum(parent, info, token_chain_id=ICPDAO_MINT_TOKEN_ETH_CHAIN_ID):
-        all_dao_ids_str = getattr(parent, 'all_dao_ids_str')
-        return any_to_decimal(Job.objects(dao_id__in=all_dao_ids_str).sum_incomes(token_chain_id))
+        return any_to_decimal(parent.get_snapshot(token_chain_id).income_sum)
 
     @staticmethod
     def resolve_dao(parent, info):
-        all_dao_ids_str = getattr(parent, 'all_dao_ids_str')
-        return len(all_dao_ids_str)
+        return parent.get_snapshot().dao
 
     @staticmethod
     def resolve_icpper(parent, info):
-        all_dao_ids_str = getattr(parent, 'all_dao_ids_str')
-        return len(Job.objects(dao_id__in=all_dao_ids_str).distinct('user_id'))
+        return parent.get_snapshot().icpper
 
     @staticmethod
     def resolve_size(parent, info):
-        all_dao_ids_str = getattr(parent, 'all_dao_ids_str')
-        return any_to_decimal(Job.objects(dao_id__in=all_dao_ids_str).sum('size'))
+        return any_to_decimal(parent.get_snapshot().size)
 
     @staticmethod
     def resolve_incomes(parent, info, token_chain_id):
-        all_dao_ids_str = getattr(parent, 'all_dao_ids_str')
-        return Job.objects(dao_id__in=all_dao_ids_str).group_incomes(token_chain_id=token_chain_id)
+        return parent.get_snapshot(token_chain_id).incomes
 
 
 class DAOStat(ObjectType):
@@ -218,14 +272,13 @@ class DAOItem(ObjectType):
 
     @staticmethod
     def resolve_stat(parent, info, token_chain_id):
-        following = DAOFollowModel.objects(dao_id=str(parent.datum.id)).count()
-        job_query = JobModel.objects(dao_id=str(parent.datum.id), status__nin=[JobStatusEnum.AWAITING_MERGER.value])
-        job = job_query.count()
-        size = any_to_decimal(job_query.sum('size'))
-        return DAOStat(
-            following=following, job=job, size=size,
-            incomes=job_query.group_incomes(token_chain_id=token_chain_id)
-        )
+        stat_doc = getattr(parent, 'stat_doc', None)
+        if stat_doc is not None:
+            # dao 列表的聚合里已经 $lookup 了 dao_stat
+            return _dao_stat_schema(stat_doc, token_chain_id)
+        dao_stat_loader = get_loader(info, DAOStatLoader)
+        return dao_stat_loader.load(str(parent.datum.id)).then(
+            lambda stat: _dao_stat_schema(stat.to_mongo(), token_chain_id))
 
     @staticmethod
     def resolve_is_following(parent, info):
@@ -233,8 +286,9 @@ class DAOItem(ObjectType):
         if not current_user:
             return False
 
-        obj = DAOFollowModel.objects(dao_id=str(parent.datum.id), user_id=str(current_user.id)).first()
-        return not not obj
+        dao_follow_loader = get_loader(info, DAOFollowLoader)
+        return dao_follow_loader.load((str(parent.datum.id), str(current_user.id))).then(
+            lambda obj: not not obj)
 
     @staticmethod
     def resolve_is_owner(parent, info):
@@ -245,8 +299,8 @@ class DAOItem(ObjectType):
 
     @staticmethod
     def resolve_token_info(parent, info, token_chain_id):
-        dt = DAOToken.objects(dao_id=str(parent.datum.id), token_chain_id=token_chain_id).first()
-        return dt
+        dao_token_loader = get_loader(info, DAOTokenLoader)
+        return dao_token_loader.load((str(parent.datum.id), token_chain_id))
 
 
 class IcppersStatQuery(ObjectType):
@@ -315,13 +369,12 @@ class DAO(ObjectType):
     def get_query(self, info, id=None, name=None):
         if not id and not name:
             raise ValueError('NO FILTER')
-        _filter = {}
         if id:
-            _filter['id'] = id
-        if name:
-            _filter['name'] = name
-
-        query = DAOModel.objects(**_filter).first()
+            query = get_dao(id)
+            if query and name and query.name != name:
+                query = None
+        else:
+            query = get_dao_by_name(name)
         setattr(self, 'query', query)
         return self
 
@@ -365,20 +418,9 @@ class DAO(ObjectType):
         format_sorted_type = 1 if sorted_type == IcppersQuerySortedTypeEnum.asc.value else -1
         format_sorted = IcppersQuerySortedEnum.get(sorted).value
 
-        origin_query = JobModel.objects(
-            dao_id=str(dao.id),
-            status__nin=[JobStatusEnum.AWAITING_MERGER.value]
-        )
-
-        all_icppers_count = len(origin_query.distinct('user_id'))
-        all_job_count = origin_query.count()
-        all_job_size = any_to_decimal(origin_query.sum('size'))
-        all_incomes = origin_query.group_incomes(token_chain_id=token_chain_id)
-
-        job_group_user = JobModel.objects(
-            dao_id=str(dao.id),
-            status__nin=[JobStatusEnum.AWAITING_MERGER.value]
-        ).aggregate([
+        job_match = {'dao_id': str(dao.id), 'status': {'$nin': [JobStatusEnum.AWAITING_MERGER.value]}}
+        facets = job_stat_facets(token_chain_id)
+        facets['nodes'] = [
             {"$sort": {"create_at": 1}},
             {"$group": {
                 "_id": "$user_id",
@@ -389,44 +431,38 @@ class DAO(ObjectType):
             }},
             {"$sort": {format_sorted: format_sorted_type}},
             {"$skip": offset},
-            {"$limit": first}
-        ])
-        job_group_user = list(job_group_user)
-        icppers = [jgu['_id'] for jgu in job_group_user]
-
-        user_incomes_query = JobModel.objects(
-            dao_id=str(dao.id),
-            status__nin=[JobStatusEnum.AWAITING_MERGER.value],
-            user_id__in=icppers,
-        ).aggregate([
-            {"$unwind": "$incomes"},
-            {"$match": {"incomes.token_chain_id": token_chain_id}},
-            {"$group": {
-                "_id": {
-                    "user_id": "$user_id",
-                    "token_chain_id": "$incomes.token_chain_id",
-                    "token_address": "$incomes.token_address",
-                    "token_symbol": "$incomes.token_symbol"
-                },
-                "income_sum": {"$sum": "$incomes.income"},
-            }},
-            {"$group": {
-                "_id": "$_id.user_id",
-                "incomes": {"$push": {
-                    "token_chain_id": "$_id.token_chain_id",
-                    "token_address": "$_id.token_address",
-                    "token_symbol": "$_id.token_symbol",
-                    "income": "$income_sum"
-                }}
+            {"$limit": first},
+            # 只给当前页的 icpper 统计 incomes
+            {"$lookup": {
+                "from": JobModel._get_collection_name(),
+                "let": {"user_id": "$_id"},
+                "pipeline": [
+                    {"$match": job_match},
+                    {"$match": {"$expr": {"$eq": ["$user_id", "$$user_id"]}}},
+                    {"$unwind": "$incomes"},
+                    {"$match": {"incomes.token_chain_id": token_chain_id}},
+                    {"$group": {
+                        "_id": {
+                            "token_chain_id": "$incomes.token_chain_id",
+                            "token_address": "$incomes.token_address",
+                            "token_symbol": "$incomes.token_symbol"
+                        },
+                        "income": {"$sum": "$incomes.income"}
+                    }}
+                ],
+                "as": "incomes"
             }}
-        ])
-        user_incomes = {}
-        for d in user_incomes_query:
-            user_incomes[d['_id']] = d['incomes']
+        ]
+        ret = next(JobModel._get_collection().aggregate([
+            {"$match": job_match},
+            {"$facet": facets}
+        ]))
+        job_stat = parse_job_stat_facets(ret)
+        all_icppers_count = job_stat['icpper']
 
         nodes = []
-        user_loader = UserLoader()
-        for d in job_group_user:
+        user_loader = get_loader(info, UserLoader)
+        for d in ret['nodes']:
             nodes.append(ICPPERQuery(
                 user=user_loader.load(d['_id']),
                 job_count=d['job_count'],
@@ -434,19 +470,19 @@ class DAO(ObjectType):
                 join_time=d['join_time'],
                 income_sum=any_to_decimal(d['income_sum']),
                 incomes=[TokenIncomeSchema(
-                    token_chain_id=r["token_chain_id"],
-                    token_address=r["token_address"],
-                    token_symbol=r["token_symbol"],
-                    income=r["income"]
-                ) for r in user_incomes.get(d['_id'], [])]
+                    token_chain_id=r['_id']["token_chain_id"],
+                    token_address=r['_id']["token_address"],
+                    token_symbol=r['_id']["token_symbol"],
+                    income=any_to_decimal(r["income"])
+                ) for r in d['incomes']]
             ))
 
         return IcppersQuery(
             nodes=nodes,
             stat=IcppersStatQuery(
-                icpper_count=all_icppers_count, job_count=all_job_count,
-                size=all_job_size,
-                incomes=all_incomes
+                icpper_count=all_icppers_count, job_count=job_stat['job'],
+                size=job_stat['size'],
+                incomes=job_stat['incomes']
             ),
             total=all_icppers_count
         )
@@ -492,7 +528,12 @@ class DAOs(BaseObjectType):
     total = Int()
 
     def resolve_dao(self, info):
-        return [DAOItem(datum=item['datum'], stat=item['stat']) for item in self._args.get('query')]
+        dao_item_list = []
+        for item in self._args.get('query'):
+            dao_item = DAOItem(datum=item['datum'], stat=item['stat'])
+            setattr(dao_item, 'stat_doc', item['stat_doc'])
+            dao_item_list.append(dao_item)
+        return dao_item_list
 
 
 class CreateDAO(Mutation):
@@ -538,7 +579,10 @@ class CreateDAO(Mutation):
             dao_id=str(record.id), time_zone=kwargs['time_zone'],
             time_zone_region=kwargs['time_zone_region']
         ).save()
+        invalidate_dao(record)
+        invalidate_dao_job_config(str(record.id))
         pre_icpper_to_icpper(str(current_user.id))
+        invalidate_user(current_user)
         return CreateDAO(dao=record)
 
 
@@ -571,6 +615,7 @@ class UpdateDAOBaseInfo(Mutation):
                 setattr(dao, field, value)
             dao.update_at = int(time.time())
             dao.save()
+            invalidate_dao(dao)
         if token_info:
             dt = DAOToken.objects(
                 dao_id=str(dao.id),
@@ -639,7 +684,7 @@ class UpdateDaoLastCycleStep(Mutation):
     dao = Field(DAO)
 
     def mutate(self, info, dao_id, next_step):
-        dao = DAOModel.objects(id=dao_id).first()
+        dao = get_dao(dao_id)
         if not dao:
             raise ValueError(COMMON_NOT_FOUND_DAO_ERROR)
 
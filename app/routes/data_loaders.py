@@ -1,12 +1,33 @@
+from collections import defaultdict
+
+from mongoengine import Q
 from promise import Promise
 from promise.dataloader import DataLoader
 
-from app.common.models.icpdao.cycle import Cycle
+from app.common.models.icpdao.cycle import Cycle, CycleIcpperStat
+from app.common.models.icpdao.dao import DAOFollow, DAOToken
 from app.common.models.icpdao.job import Job
 from app.common.models.icpdao.user import User
+from app.controllers.dao_stat import rebuild_dao_stats
+from app.models.dao_stat import DAOStat
+
+
+class BaseLoader(DataLoader):
+    """
+    由 LoaderRegistry 创建时会带上 stat，记录 load 命中请求内缓存的次数
+    """
+    stat = None
 
+    def load(self, key=None):
+        if self.stat is not None:
+            if self.cache and self.get_cache_key(key) in self._promise_cache:
+                self.stat['hit'] += 1
+            else:
+                self.stat['miss'] += 1
+        return super().load(key)
 
-class BaseModelLoader(DataLoader):
+
+class BaseModelLoader(BaseLoader):
     def get_model(self):
         raise Exception("need imp")
 
@@ -29,3 +50,114 @@ class JobLoader(BaseModelLoader):
 class CycleLoader(BaseModelLoader):
     def get_model(self):
         return Cycle
+
+
+class BaseKeyLoader(BaseLoader):
+    """
+    按任意字段批量加载，key_fields 只有一个字段时 key 是字段值，多个字段时 key 是对应的 tuple
+    一批 key 合并成一次查询：单字段用 $in，多字段按前面的字段分组后用 $or + $in
+    many 为 True 时每个 key 返回列表，否则返回第一条或 None
+    """
+    key_fields = ()
+    many = False
+
+    def get_model(self):
+        raise Exception("need imp")
+
+    def get_queryset(self):
+        return self.get_model().objects
+
+    def _item_key(self, item):
+        values = tuple(str(item.id) if field == 'id' else getattr(item, field) for field in self.key_fields)
+        return values if len(values) > 1 else values[0]
+
+    def _build_query(self, keys):
+        *prefix_fields, last_field = self.key_fields
+        if not prefix_fields:
+            return Q(**{'{}__in'.format(last_field): keys})
+
+        prefix_2_values = defaultdict(list)
+        for key in keys:
+            prefix_2_values[key[:-1]].append(key[-1])
+        query = None
+        for prefix, values in prefix_2_values.items():
+            q = Q(**dict(zip(prefix_fields, prefix)), **{'{}__in'.format(last_field): values})
+            query = q if query is None else query | q
+        return query
+
+    def batch_load_fn(self, keys):
+        unique_keys = list(dict.fromkeys(keys))
+        key_2_items = defaultdict(list)
+        for item in self.get_queryset().filter(self._build_query(unique_keys)):
+            key_2_items[self._item_key(item)].append(item)
+
+        if self.many:
+            return Promise.resolve([key_2_items.get(key, []) for key in keys])
+        return Promise.resolve([key_2_items[key][0] if key in key_2_items else None for key in keys])
+
+
+class DAOFollowLoader(BaseKeyLoader):
+    key_fields = ('dao_id', 'user_id')
+
+    def get_model(self):
+        return DAOFollow
+
+
+class DAOTokenLoader(BaseKeyLoader):
+    key_fields = ('dao_id', 'token_chain_id')
+
+    def get_model(self):
+        return DAOToken
+
+
+class CycleIcpperStatLoader(BaseModelLoader):
+    def get_model(self):
+        return CycleIcpperStat
+
+
+class DAOStatLoader(BaseKeyLoader):
+    """
+    key: dao_id，没有 dao_stat 的 dao 先重建
+    """
+    key_fields = ('dao_id',)
+
+    def get_model(self):
+        return DAOStat
+
+    def batch_load_fn(self, keys):
+        missing_dao_ids = set(keys) - set(DAOStat.objects(dao_id__in=keys).distinct('dao_id'))
+        if missing_dao_ids:
+            rebuild_dao_stats(list(missing_dao_ids))
+        return super().batch_load_fn(keys)
+
+
+class LoaderRegistry:
+    """
+    一次 GraphQL 请求共用的 loader，每个 loader 类只创建一个，并记录 hit/miss 次数
+    """
+    def __init__(self):
+        self._loaders = {}
+        self._stats = {}
+
+    def get(self, loader_class):
+        loader = self._loaders.get(loader_class)
+        if loader is None:
+            loader = loader_class()
+            loader.stat = self._stats.setdefault(loader_class.__name__, {'hit': 0, 'miss': 0})
+            self._loaders[loader_class] = loader
+        return loader
+
+    def get_stats(self):
+        return {name: dict(stat) for name, stat in self._stats.items()}
+
+
+def get_loader_registry(info):
+    registry = info.context.get('loaders')
+    if registry is None:
+        registry = LoaderRegistry()
+        info.context['loaders'] = registry
+    return registry
+
+
+def get_loader(info, loader_class):
+    return get_loader_registry(info).get(loader_class)
@@ -6,6 +6,7 @@ from app.common.schema.icpdao import DAOFollowSchema as DFs
 from app.common.utils.access import check_is_dao_owner, check_is_not_dao_owner
 from app.common.utils.errors import COMMON_NOT_AUTH_ERROR
 from app.common.utils.route_helper import get_current_user_by_graphql
+from app.controllers.dao_stat import inc_dao_stat
 from app.routes.schema import DAOFollowTypeEnum
 
 
@@ -53,8 +54,10 @@ class UpdateDAOFollow(Mutation):
             record = DAOFollow(
                 dao_id=dao_id, user_id=str(current_user.id))
             record.save()
+            inc_dao_stat(dao_id, following=1)
             return UpdateDAOFollow(ok=True)
         if type == DAOFollowTypeEnum.DELETE and record:
             record.delete()
+            inc_dao_stat(dao_id, following=-1)
             return UpdateDAOFollow(ok=True)
         raise ValueError('NOT RIGHT UPDATE FOLLOW')
@@ -0,0 +1,20 @@
+from app.common.utils.base_graphql import BaseGraphQLApp
+from app.routes.data_loaders import LoaderRegistry
+
+import settings
+
+
+class GraphQLApp(BaseGraphQLApp):
+    """
+    每个请求在 context 里放一个 LoaderRegistry，所有 resolver 共用同一批 loader
+    """
+
+    async def execute(self, *args, **kwargs):
+        context = kwargs.get('context')
+        registry = LoaderRegistry()
+        if context is not None:
+            context['loaders'] = registry
+        result = await super().execute(*args, **kwargs)
+        if settings.ICPDAO_GRAPHQL_LOADER_STATS:
+            print('graphql loader stats: {}'.format(registry.get_stats()))
+        return result
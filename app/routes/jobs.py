@@ -8,10 +8,7 @@ from graphene import ObjectType, List, Int, Float, String, Field, Mutation, Bool
 import settings
 from app.common.models.extension.decimal128_field import any_to_decimal
 from app.common.models.icpdao.cycle import CycleIcpperStat, Cycle
-from app.common.models.icpdao.github_app_token import GithubAppToken
 from app.common.models.icpdao.job import Job as JobModel, JobPR as JobPRModel, JobStatusEnum, JobPRComment, JobPR
-from app.common.models.icpdao.dao import DAO as DAOModel
-from app.common.models.icpdao.user import User
 
 from app.common.schema.icpdao import JobSchema, JobPRSchema
 from app.common.schema.incomes import TokenIncomeSchema
@@ -23,6 +20,8 @@ from app.common.utils.github_app.client import GithubAppClient
 from app.common.utils.route_helper import get_current_user_by_graphql
 from app.common.utils import check_size
 from app.common.models.extension.graphene_decimal128 import Decimal128Float
+from app.controllers.github_app_token_cache import get_app_token
+from app.controllers.model_cache import get_dao, get_dao_by_name, get_user_by_github_login
 from app.controllers.task import delete_issue_comment, sync_job_pr, sync_job_issue_status_comment
 from app.routes.schema import SortedTypeEnum, UpdateJobVoteTypeByOwnerArgumentPairTypeEnum
 
@@ -55,7 +54,7 @@ class Jobs(ObjectType):
         if current_user:
             query_user_id = str(current_user.id)
         if user_name is not None:
-            user = User.objects(github_login=user_name).first()
+            user = get_user_by_github_login(user_name)
             if not user:
                 raise ValueError(JOB_QUERY_NOT_USER_ERROR)
             query_user_id = str(user.id)
@@ -65,7 +64,7 @@ class Jobs(ObjectType):
 
         _filter = {'user_id': query_user_id}
         if dao_name:
-            dao = DAOModel.objects(name=dao_name).first()
+            dao = get_dao_by_name(dao_name)
             if dao:
                 _filter['dao_id'] = str(dao.id)
 
@@ -156,15 +155,10 @@ class UpdateJob(Mutation):
         if not job:
             raise FileNotFoundError(JOB_QUERY_NOT_FOUND_ERROR)
         assert job.status in [JobStatusEnum.AWAITING_MERGER.value, JobStatusEnum.MERGED.value], JOB_UPDATE_STATUS_INVALID_ERROR
-        dao = DAOModel.objects(id=job.dao_id).first()
+        dao = get_dao(job.dao_id)
         if not dao:
             raise ValueError(COMMON_NOT_FOUND_DAO_ERROR)
-        app_token = GithubAppToken.get_token(
-            app_id=settings.ICPDAO_GITHUB_APP_ID,
-            app_private_key=settings.ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY,
-            github_owner_name=dao.github_owner_name,
-            github_owner_id=dao.github_owner_id,
-        )
+        app_token = get_app_token(dao.github_owner_name, dao.github_owner_id)
         if app_token is None:
             raise ValueError('NOT APP TOKEN')
         app_client = GithubAppClient(app_token, job.github_repo_owner)
@@ -195,7 +189,7 @@ class DeleteJob(Mutation):
         job = JobModel.objects(id=id).first()
         if not job:
             raise FileNotFoundError(JOB_QUERY_NOT_FOUND_ERROR)
-        dao = DAOModel.objects(id=job.dao_id).first()
+        dao = get_dao(job.dao_id)
         if not dao:
             raise ValueError(COMMON_NOT_AUTH_ERROR)
         if job.user_id != str(current_user.id):
@@ -255,7 +249,7 @@ class UpdateJobVoteTypeByOwner(Mutation):
         if not cycle:
             raise ValueError(CYCLE_NOT_FOUND_ERROR)
 
-        dao = DAOModel.objects(id=job.dao_id).first()
+        dao = get_dao(job.dao_id)
         if not dao:
             raise ValueError(COMMON_NOT_FOUND_DAO_ERROR)
 
@@ -290,7 +284,7 @@ class UpdateIcpperStatOwnerEi(Mutation):
         if not cycle:
             raise ValueError(CYCLE_NOT_FOUND_ERROR)
 
-        dao = DAOModel.objects(id=icpper_stat.dao_id).first()
+        dao = get_dao(icpper_stat.dao_id)
         if not dao:
             raise ValueError(COMMON_NOT_FOUND_DAO_ERROR)
 
@@ -329,15 +323,10 @@ class RefreshJob(Mutation):
         if not job:
             raise FileNotFoundError(JOB_QUERY_NOT_FOUND_ERROR)
 
-        dao = DAOModel.objects(id=job.dao_id).first()
+        dao = get_dao(job.dao_id)
         if not dao:
             raise ValueError(COMMON_NOT_FOUND_DAO_ERROR)
-        app_token = GithubAppToken.get_token(
-            app_id=settings.ICPDAO_GITHUB_APP_ID,
-            app_private_key=settings.ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY,
-            github_owner_name=dao.github_owner_name,
-            github_owner_id=dao.github_owner_id,
-        )
+        app_token = get_app_token(dao.github_owner_name, dao.github_owner_id)
         if app_token is None:
             raise ValueError('NOT APP TOKEN')
         app_client = GithubAppClient(app_token, job.github_repo_owner)
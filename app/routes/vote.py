@@ -4,12 +4,13 @@ from graphene import Mutation, String, Boolean
 
 from app.common.models.icpdao.cycle import CycleVote, CycleVoteType, Cycle, \
     VoteResultTypeAllResultType, CycleVoteConfirm, CycleVoteConfirmStatus
-from app.common.models.icpdao.dao import DAO
 from app.common.models.icpdao.job import Job
 from app.common.models.icpdao.user import UserStatus
 from app.common.utils.errors import COMMON_NOT_AUTH_ERROR, CYCLE_NOT_FOUND_ERROR, CYCLE_VOTE_TIME_ERROR, \
     COMMON_NOT_PERMISSION_ERROR
 from app.common.utils.route_helper import get_current_user_by_graphql
+from app.controllers.model_cache import get_dao
+from app.controllers.pair import get_cycle_vote_filter
 
 
 class UpdatePairVote(Mutation):
@@ -69,7 +70,7 @@ class UpdatePairVoteWithRepeat(Mutation):
             raise ValueError('NOT FOUND VOTE')
         if cycle_vote.vote_type != CycleVoteType.PAIR.value:
             raise ValueError('NOT PAIR VOTE')
-        dao = DAO.objects(id=cycle_vote.dao_id).first()
+        dao = get_dao(cycle_vote.dao_id)
         if dao.owner_id != str(current_user.id):
             raise ValueError('NOT PERMISSION VOTE')
         cycle = Cycle.objects(id=cycle_vote.cycle_id).first()
@@ -164,7 +165,7 @@ class UpdateVoteConfirm(Mutation):
         # TODO: `all` type vote check ?
 
         cycle_pair_unvote = CycleVote.objects(
-            cycle_id=cycle_id, voter_id=str(current_user.id),
+            **get_cycle_vote_filter(cycle_id), voter_id=str(current_user.id),
             vote_job_id__exists=False, vote_type=CycleVoteType.PAIR.value
         ).all()
 
@@ -192,14 +193,14 @@ class UpdateVoteConfirmWithRepeat(Mutation):
         assert current_user, "errors.common.not_login"
 
         cycle = Cycle.objects(id=cycle_id).first()
-        dao = DAO.objects(id=cycle.dao_id).first()
+        dao = get_dao(cycle.dao_id)
         assert str(current_user.id) == dao.owner_id, COMMON_NOT_PERMISSION_ERROR
 
         cvc = CycleVoteConfirm.objects(is_repeat=True, cycle_id=cycle_id, voter_id=str(current_user.id)).first()
         assert cvc is None, "errors.vote_confirm.found"
 
         cycle_pair_unvote_count = CycleVote.objects(
-            cycle_id=cycle_id,
+            **get_cycle_vote_filter(cycle_id),
             vote_job_id__exists=False,
             vote_type=CycleVoteType.PAIR.value
         ).count()
@@ -1,5 +1,4 @@
-import iso8601
-import datetime
+import json
 
 from starlette.background import BackgroundTasks
 from starlette.types import Receive, Scope, Send
@@ -8,10 +7,9 @@ from starlette.responses import JSONResponse, PlainTextResponse, Response
 from starlette import status
 
 import settings
-from app.common.models.icpdao.github_app_token import GithubAppToken
-from app.common.models.icpdao.job import JobPR, JobPRStatusEnum
-from app.common.utils.github_app import GithubAppClient
 from app.controllers.task import sync_job_issue_status_comment
+from app.controllers.webhook import verify_signature, is_pr_event, update_pr_by_event, get_app_client, \
+    enqueue_webhook_event, add_pending_job_sync, flush_pending_job_syncs
 
 
 class GithubWebhooksApp:
@@ -27,11 +25,19 @@ class GithubWebhooksApp:
                 "No GraphQL query found in the request",
                 status_code=status.HTTP_400_BAD_REQUEST,
             )
-        req_data = await request.json()
+        body = await request.body()
+        if not verify_signature(body, request.headers.get('X-Hub-Signature-256')):
+            return JSONResponse(
+                {"success": False}, status_code=status.HTTP_401_UNAUTHORIZED
+            )
+        req_data = json.loads(body)
         background = BackgroundTasks()
-        if req_data.get('pull_request') and req_data.get(
-                'pull_request').get('url'):
-            await self.handler_pr(req_data, background)
+        if is_pr_event(req_data):
+            delivery_id = request.headers.get('X-GitHub-Delivery')
+            if settings.ICPDAO_GITHUB_WEBHOOK_MODE == 'queue' and delivery_id:
+                enqueue_webhook_event(delivery_id, request.headers.get('X-GitHub-Event'), req_data)
+            else:
+                await self.handler_pr(req_data, background)
             return JSONResponse(
                 {"success": True}, status_code=status.HTTP_200_OK,
                 background=background
@@ -42,42 +48,15 @@ class GithubWebhooksApp:
         )
 
     async def handler_pr(self, data, background):
-        need_check_jobs = set()
-        repo_owner = data['repository']['owner']['login']
-        repo_owner_id = data['repository']['owner']['id']
-        repo_id = data['repository']['id']
-        pr_title = data['pull_request']['title']
-        if data.get('action') == 'closed' and data['pull_request']['merged'] is True:
-            merged_time = iso8601.parse_date(
-                data['pull_request']['merged_at'])
-            merged_at = int(
-                merged_time.replace(tzinfo=datetime.timezone.utc).timestamp())
-            JobPR.objects(
-                github_repo_owner_id=repo_owner_id,
-                github_repo_id=repo_id,
-                github_pr_number=data['pull_request']['number']
-            ).update(
-                status=JobPRStatusEnum.MERGED.value,
-                title=pr_title,
-                merged_user_github_user_id=data['pull_request']['merged_by']['id'],
-                merged_at=merged_at
-            )
-            job_ids = JobPR.objects(
-                github_repo_owner_id=repo_owner_id,
-                github_repo_id=repo_id,
-                github_pr_number=data['pull_request']['number']
-            ).distinct('job_id')
-            need_check_jobs = need_check_jobs | set(job_ids)
-
-        if len(need_check_jobs) > 0:
-            app_token = GithubAppToken.get_token(
-                app_id=settings.ICPDAO_GITHUB_APP_ID,
-                app_private_key=settings.ICPDAO_GITHUB_APP_RSA_PRIVATE_KEY,
-                github_owner_name=repo_owner,
-                github_owner_id=repo_owner_id,
-            )
-            if app_token is None:
-                raise ValueError('NOT APP TOKEN')
-            app_client = GithubAppClient(app_token, repo_owner)
+        need_check_jobs = update_pr_by_event(data)
+
+        if len(need_check_jobs) > 0 and settings.ICPDAO_GITHUB_JOB_SYNC_WINDOW > 0:
+            # 合并到 repo owner 的等待记录里，顺便同步已经到期的，其余的由 webhook_worker 定时同步
+            add_pending_job_sync(
+                data['repository']['owner']['login'], data['repository']['owner']['id'], need_check_jobs)
+            background.add_task(flush_pending_job_syncs)
+        elif len(need_check_jobs) > 0:
+            app_client = get_app_client(
+                data['repository']['owner']['login'], data['repository']['owner']['id'])
             background.add_task(
                 sync_job_issue_status_comment, app_client, need_check_jobs)
@@ -29,3 +29,45 @@ ICPDAO_ETH_DAO_FACTORY_OWNER_ADDRESS = os.environ['ICPDAO_ETH_DAO_FACTORY_OWNER_
 ICPDAO_SENTRY_DSN = os.environ['ICPDAO_SENTRY_DSN']
 
 ICPDAO_ALCHEMYAPI_KEY = os.environ['ICPDAO_ALCHEMYAPI_KEY']
+
+# 首页统计快照的过期时间（秒）
+ICPDAO_HOME_STATS_TTL = int(os.environ.get('ICPDAO_HOME_STATS_TTL', 300))
+
+# 每个 GraphQL 请求结束后打印 data loader 的 hit/miss 统计
+ICPDAO_GRAPHQL_LOADER_STATS = os.environ.get('ICPDAO_GRAPHQL_LOADER_STATS') == 'yes'
+
+# 进程内 User/DAO/DAOJobConfig 缓存，warm lambda 容器的多个请求共用
+ICPDAO_MODEL_CACHE_TTL = int(os.environ.get('ICPDAO_MODEL_CACHE_TTL', 60))
+ICPDAO_MODEL_CACHE_SIZE = int(os.environ.get('ICPDAO_MODEL_CACHE_SIZE', 2048))
+
+# pair/stat/publish 任务的运行方式：background / inline / process / queue，process 不能在 lambda 上使用
+ICPDAO_TASK_RUNNER = os.environ.get('ICPDAO_TASK_RUNNER', 'background')
+
+# cycle 任务租约的过期时间（秒）和最多运行次数，超过次数的任务会被标记为失败
+ICPDAO_TASK_LEASE_TTL = int(os.environ.get('ICPDAO_TASK_LEASE_TTL', 60))
+ICPDAO_TASK_MAX_ATTEMPTS = int(os.environ.get('ICPDAO_TASK_MAX_ATTEMPTS', 3))
+
+# cycle 任务调度的并行进程数，0 表示使用 cpu 核数
+ICPDAO_CYCLE_SCHEDULER_WORKERS = int(os.environ.get('ICPDAO_CYCLE_SCHEDULER_WORKERS', 0))
+
+# github webhook 的处理方式：sync 在请求里处理，queue 只保存事件后马上返回，由 drain worker 处理
+ICPDAO_GITHUB_WEBHOOK_MODE = os.environ.get('ICPDAO_GITHUB_WEBHOOK_MODE', 'sync')
+# 配置后校验 X-Hub-Signature-256
+ICPDAO_GITHUB_WEBHOOK_SECRET = os.environ.get('ICPDAO_GITHUB_WEBHOOK_SECRET')
+# drain worker 每次最多处理的事件数
+ICPDAO_GITHUB_WEBHOOK_BATCH_SIZE = int(os.environ.get('ICPDAO_GITHUB_WEBHOOK_BATCH_SIZE', 100))
+# 处理完（done、fail）的 webhook 事件保留的时间（秒），之后由 mongo 的 TTL 索引删除
+ICPDAO_GITHUB_WEBHOOK_EVENT_TTL = int(os.environ.get('ICPDAO_GITHUB_WEBHOOK_EVENT_TTL', 7 * 24 * 3600))
+
+# 同一个 repo owner 的 webhook job 同步合并的窗口（秒），0 表示每个 webhook 单独同步
+ICPDAO_GITHUB_JOB_SYNC_WINDOW = int(os.environ.get('ICPDAO_GITHUB_JOB_SYNC_WINDOW', 0))
+
+# github app installation token 离过期不到这个时间（秒）时提前换新
+ICPDAO_GITHUB_APP_TOKEN_REFRESH_AHEAD = int(os.environ.get('ICPDAO_GITHUB_APP_TOKEN_REFRESH_AHEAD', 300))
+
+# 请求 github 时使用共享的 keep-alive 连接池，每个 host 的最大连接数
+ICPDAO_GITHUB_HTTP_KEEPALIVE = os.environ.get('ICPDAO_GITHUB_HTTP_KEEPALIVE', 'yes') == 'yes'
+ICPDAO_GITHUB_HTTP_POOL_SIZE = int(os.environ.get('ICPDAO_GITHUB_HTTP_POOL_SIZE', 10))
+
+# 关联多个 pr 时并发请求 github 的最大线程数
+ICPDAO_GITHUB_FANOUT_WORKERS = int(os.environ.get('ICPDAO_GITHUB_FANOUT_WORKERS', 8))
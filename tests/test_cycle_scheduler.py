@@ -0,0 +1,90 @@
+import time
+
+from bson import ObjectId
+
+import settings
+from app.common.models.icpdao.cycle import Cycle, CycleVotePairTask, CycleVoteResultStatTask, \
+    CycleVoteResultPublishTask, CycleVotePairTaskStatus
+from app.controllers.cycle_scheduler import find_due_cycle_tasks
+from tests.base import Base
+
+
+class TestCycleScheduler(Base):
+
+    @staticmethod
+    def _create_cycle(dao_id, pair_begin_at, **kwargs):
+        return Cycle(
+            dao_id=dao_id,
+            begin_at=pair_begin_at - 30 * 24 * 60 * 60,
+            end_at=pair_begin_at - 1,
+            pair_begin_at=pair_begin_at,
+            pair_end_at=pair_begin_at + 18 * 60 * 60,
+            vote_begin_at=pair_begin_at + 18 * 60 * 60,
+            vote_end_at=pair_begin_at + 36 * 60 * 60,
+            **kwargs
+        ).save()
+
+    def test_find_due_cycle_tasks(self):
+        self.clear_db()
+        now_at = int(time.time())
+        dao1 = str(ObjectId())
+        dao2 = str(ObjectId())
+        # 正在 pair
+        pair_cycle = self._create_cycle(dao1, now_at - 60)
+        # 投票结束，等待统计
+        stat_cycle = self._create_cycle(dao1, now_at - 40 * 60 * 60, paired_at=now_at - 39 * 60 * 60)
+        # 已经统计过
+        self._create_cycle(dao2, now_at - 40 * 60 * 60, paired_at=now_at, vote_result_stat_at=now_at)
+        # 投票还没有结束
+        self._create_cycle(dao2, now_at - 20 * 60 * 60, paired_at=now_at)
+        publish_task = CycleVoteResultPublishTask(dao_id=dao2, cycle_id=str(ObjectId())).save()
+
+        dao_id_2_tasks = find_due_cycle_tasks(now_at)
+        pair_task = CycleVotePairTask.objects(cycle_id=str(pair_cycle.id)).first()
+        stat_task = CycleVoteResultStatTask.objects(cycle_id=str(stat_cycle.id)).first()
+        assert dao_id_2_tasks[dao1] == [('pair', str(pair_task.id)), ('vote_result_stat', str(stat_task.id))]
+        assert dao_id_2_tasks[dao2] == [('vote_result_publish', str(publish_task.id))]
+
+        # 任务还没有运行时不会重复创建
+        assert find_due_cycle_tasks(now_at) == dao_id_2_tasks
+        assert CycleVotePairTask.objects.count() == 1
+        assert CycleVoteResultStatTask.objects.count() == 1
+
+    def test_failed_task_retry(self):
+        self.clear_db()
+        now_at = int(time.time())
+        dao_id = str(ObjectId())
+        cycle = self._create_cycle(dao_id, now_at - 60)
+        # 刚失败的任务等一段时间再重试
+        CycleVotePairTask(
+            dao_id=dao_id, cycle_id=str(cycle.id), status=CycleVotePairTaskStatus.FAIL.value, update_at=now_at
+        ).save()
+        assert dao_id not in find_due_cycle_tasks(now_at)
+        assert CycleVotePairTask.objects(cycle_id=str(cycle.id)).count() == 1
+
+        # 失败后运行两次，只新建一个任务
+        retry_at = now_at + settings.ICPDAO_TASK_LEASE_TTL + 1
+        dao_id_2_tasks = find_due_cycle_tasks(retry_at)
+        assert find_due_cycle_tasks(retry_at) == dao_id_2_tasks
+        assert CycleVotePairTask.objects(cycle_id=str(cycle.id)).count() == 2
+        new_task = CycleVotePairTask.objects(cycle_id=str(cycle.id)).order_by('-id').first()
+        assert dao_id_2_tasks[dao_id] == [('pair', str(new_task.id))]
+
+        # 失败次数达到上限后不再新建
+        CycleVotePairTask.objects(cycle_id=str(cycle.id)).update(
+            status=CycleVotePairTaskStatus.FAIL.value, update_at=now_at)
+        for _ in range(settings.ICPDAO_TASK_MAX_ATTEMPTS - 2):
+            CycleVotePairTask(
+                dao_id=dao_id, cycle_id=str(cycle.id), status=CycleVotePairTaskStatus.FAIL.value, update_at=now_at
+            ).save()
+        assert dao_id not in find_due_cycle_tasks(retry_at)
+        assert dao_id not in find_due_cycle_tasks(retry_at)
+        assert CycleVotePairTask.objects(cycle_id=str(cycle.id)).count() == max(settings.ICPDAO_TASK_MAX_ATTEMPTS, 2)
+
+        # 最新的任务已经成功时不再新建
+        CycleVotePairTask.objects(cycle_id=str(cycle.id)).delete()
+        CycleVotePairTask(
+            dao_id=dao_id, cycle_id=str(cycle.id), status=CycleVotePairTaskStatus.SUCCESS.value, update_at=now_at
+        ).save()
+        assert dao_id not in find_due_cycle_tasks(retry_at)
+        assert CycleVotePairTask.objects(cycle_id=str(cycle.id)).count() == 1
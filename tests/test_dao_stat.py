@@ -0,0 +1,235 @@
+import decimal
+
+from app.common.models.icpdao.base import TokenIncome
+from app.common.models.icpdao.dao import DAO, DAOFollow
+from app.common.models.icpdao.job import Job, JobStatusEnum
+from app.controllers.dao_stat import rebuild_dao_stats, inc_dao_stat, refresh_dao_stat_incomes, \
+    ensure_dao_stats, refresh_dao_stat_following
+from app.controllers.home_stats import get_home_stats, refresh_home_stats
+from app.models.dao_stat import DAOStat
+from app.models.home_stats import HomeStatsSnapshot
+from tests.base import Base
+
+
+class TestDAOStat(Base):
+
+    update_follow = """
+mutation {
+  updateDaoFollow(daoId: "%s", type: %s) {
+    ok
+  }
+}
+"""
+
+    get_daos = """
+query{
+  daos(filter: all, sorted: %s, sortedType: desc, tokenChainId: "3") {
+    dao{
+      datum{
+        id
+      }
+      stat{
+        following
+        job
+        size
+        incomes {
+          tokenChainId
+          tokenAddress
+          income
+        }
+      }
+    }
+    total
+  }
+}
+"""
+
+    get_daos_stat = """
+query{
+  daos(filter: all, tokenChainId: "3") {
+    stat{
+      icpper
+      size
+    }
+    total
+  }
+}
+"""
+
+    @staticmethod
+    def _create_job(dao, user, size, status, incomes=None):
+        return Job(
+            dao_id=str(dao.id), user_id=str(user.id), title='xx',
+            size=decimal.Decimal(size), incomes=incomes or [],
+            github_repo_owner='xx', github_repo_name='xx',
+            github_repo_owner_id=1, github_repo_id=1,
+            github_issue_number=1, bot_comment_database_id=1,
+            status=status
+        ).save()
+
+    def test_rebuild_and_inc(self):
+        self.clear_db()
+        owner = self.create_icpper_user('owner', 'owner')
+        icpper = self.create_icpper_user('icpper', 'icpper')
+        dao1 = DAO(name='d1', owner_id=str(owner.id), github_owner_id=1, github_owner_name='d1').save()
+        dao2 = DAO(name='d2', owner_id=str(owner.id), github_owner_id=2, github_owner_name='d2').save()
+
+        self._create_job(dao1, icpper, '1.5', JobStatusEnum.MERGED.value)
+        self._create_job(dao1, icpper, '2', JobStatusEnum.AWAITING_MERGER.value)
+        self._create_job(dao1, icpper, '3', JobStatusEnum.TOKEN_RELEASED.value, incomes=[
+            TokenIncome(token_chain_id='3', token_address='0x1', token_symbol='T', income=decimal.Decimal('10'))
+        ])
+
+        rebuild_dao_stats()
+        stat1 = DAOStat.objects(dao_id=str(dao1.id)).first()
+        stat2 = DAOStat.objects(dao_id=str(dao2.id)).first()
+        assert stat1.job == 2
+        assert stat1.size == decimal.Decimal('4.5')
+        assert stat1.token == decimal.Decimal('10')
+        assert len(stat1.incomes) == 1
+        assert stat2.job == 0
+        assert stat2.following == 0
+
+        ret = self.graph_query(icpper.id, self.update_follow % (str(dao1.id), 'ADD'))
+        assert ret.json()['data']['updateDaoFollow']['ok'] is True
+        assert DAOStat.objects(dao_id=str(dao1.id)).first().following == 1
+
+        inc_dao_stat(str(dao1.id), job=-1, size=decimal.Decimal('-1.5'))
+        stat1 = DAOStat.objects(dao_id=str(dao1.id)).first()
+        assert stat1.job == 1
+        assert stat1.size == decimal.Decimal('3')
+
+        Job.objects(dao_id=str(dao1.id), status=JobStatusEnum.TOKEN_RELEASED.value).update(
+            incomes=[TokenIncome(token_chain_id='3', token_address='0x1', token_symbol='T', income=decimal.Decimal('7'))])
+        refresh_dao_stat_incomes(str(dao1.id))
+        assert DAOStat.objects(dao_id=str(dao1.id)).first().token == decimal.Decimal('7')
+
+        ret = self.graph_query(icpper.id, self.update_follow % (str(dao1.id), 'DELETE'))
+        assert ret.json()['data']['updateDaoFollow']['ok'] is True
+        assert DAOStat.objects(dao_id=str(dao1.id)).first().following == 0
+
+    def test_ensure_and_refresh_following(self):
+        self.clear_db()
+        owner = self.create_icpper_user('owner', 'owner')
+        dao1 = DAO(name='d1', owner_id=str(owner.id), github_owner_id=1, github_owner_name='d1').save()
+        rebuild_dao_stats()
+        # 已经删除的 dao 留下的 dao_stat 不能让新的 dao 被跳过
+        DAOStat(dao_id='deleted_dao').save()
+        dao2 = DAO(name='d2', owner_id=str(owner.id), github_owner_id=2, github_owner_name='d2').save()
+        assert DAOStat.objects().count() == DAO.objects().count()
+        ensure_dao_stats()
+        assert DAOStat.objects(dao_id=str(dao2.id)).count() == 1
+
+        # 不经过 UpdateDAOFollow 的关注
+        DAOFollow(dao_id=str(dao1.id), user_id=str(owner.id)).save()
+        assert DAOStat.objects(dao_id=str(dao1.id)).first().following == 0
+        refresh_dao_stat_following(str(dao1.id))
+        assert DAOStat.objects(dao_id=str(dao1.id)).first().following == 1
+
+    def test_dao_list_total_stat(self):
+        self.clear_db()
+        owner = self.create_icpper_user('owner', 'owner')
+        icpper = self.create_icpper_user('icpper', 'icpper')
+        dao1 = DAO(name='d1', owner_id=str(owner.id), github_owner_id=1, github_owner_name='d1').save()
+        self._create_job(dao1, icpper, '2', JobStatusEnum.MERGED.value)
+        # 已经删除的 dao 的 job 和首页一样不统计
+        deleted_dao = DAO(name='d2', owner_id=str(owner.id), github_owner_id=2, github_owner_name='d2').save()
+        self._create_job(deleted_dao, icpper, '5', JobStatusEnum.MERGED.value)
+        deleted_dao.delete()
+
+        res = self.graph_query(owner.id, self.get_daos_stat).json()
+        assert res['data']['daos']['stat']['size'] == '2'
+        assert res['data']['daos']['stat']['icpper'] == 1
+        assert get_home_stats('3').size == decimal.Decimal('2')
+
+    def test_dao_list_use_dao_stat(self):
+        self.clear_db()
+        owner = self.create_icpper_user('owner', 'owner')
+        icpper = self.create_icpper_user('icpper', 'icpper')
+        dao1 = DAO(name='d1', owner_id=str(owner.id), github_owner_id=1, github_owner_name='d1').save()
+        dao2 = DAO(name='d2', owner_id=str(owner.id), github_owner_id=2, github_owner_name='d2').save()
+        self._create_job(dao2, icpper, '5', JobStatusEnum.MERGED.value, incomes=[
+            TokenIncome(token_chain_id='3', token_address='0x1', token_symbol='T', income=decimal.Decimal('1'))
+        ])
+
+        # dao_stat is built on first read
+        assert DAOStat.objects().count() == 0
+        res = self.graph_query(owner.id, self.get_daos % 'size').json()
+        assert DAOStat.objects().count() == 2
+        assert res['data']['daos']['total'] == 2
+        daos = res['data']['daos']['dao']
+        assert daos[0]['datum']['id'] == str(dao2.id)
+        assert daos[0]['stat']['job'] == 1
+        assert daos[0]['stat']['size'] == '5'
+        assert daos[0]['stat']['incomes'][0]['income'] == '1'
+        assert daos[1]['datum']['id'] == str(dao1.id)
+        assert daos[1]['stat']['job'] == 0
+
+    def test_home_stats_snapshot(self):
+        self.clear_db()
+        owner = self.create_icpper_user('owner', 'owner')
+        icpper = self.create_icpper_user('icpper', 'icpper')
+        dao1 = DAO(name='d1', owner_id=str(owner.id), github_owner_id=1, github_owner_name='d1').save()
+        DAO(name='d2', owner_id=str(owner.id), github_owner_id=2, github_owner_name='d2').save()
+        self._create_job(dao1, icpper, '1.5', JobStatusEnum.AWAITING_MERGER.value)
+        self._create_job(dao1, owner, '2', JobStatusEnum.TOKEN_RELEASED.value, incomes=[
+            TokenIncome(token_chain_id='3', token_address='0x1', token_symbol='T', income=decimal.Decimal('10')),
+            TokenIncome(token_chain_id='1', token_address='0x2', token_symbol='S', income=decimal.Decimal('4'))
+        ])
+
+        res = self.graph_query(owner.id, """
+query{
+  stats {
+    dao
+    icpper
+    size
+    incomeSum(tokenChainId: "3")
+    incomes(tokenChainId: "3") {
+      tokenAddress
+      income
+    }
+  }
+}
+""").json()
+        stats = res['data']['stats']
+        assert stats['dao'] == 2
+        assert stats['icpper'] == 2
+        assert stats['size'] == '3.5'
+        assert stats['incomeSum'] == '10'
+        assert len(stats['incomes']) == 1
+        assert stats['incomes'][0]['tokenAddress'] == '0x1'
+        assert HomeStatsSnapshot.objects(token_chain_id='3').count() == 1
+
+    def test_home_stats_snapshot_ttl(self):
+        self.clear_db()
+        HomeStatsSnapshot.drop_collection()
+        owner = self.create_icpper_user('owner', 'owner')
+        dao1 = DAO(name='d1', owner_id=str(owner.id), github_owner_id=1, github_owner_name='d1').save()
+        self._create_job(dao1, owner, '1', JobStatusEnum.MERGED.value)
+        # 已经删除的 dao 的 job 不统计
+        deleted_dao = DAO(name='d2', owner_id=str(owner.id), github_owner_id=2, github_owner_name='d2').save()
+        self._create_job(deleted_dao, owner, '100', JobStatusEnum.MERGED.value)
+        deleted_dao.delete()
+
+        snapshot = get_home_stats('3', ttl=100)
+        assert snapshot.dao == 1
+        assert snapshot.size == decimal.Decimal('1')
+
+        # 没有过期时直接使用快照
+        self._create_job(dao1, owner, '2', JobStatusEnum.MERGED.value)
+        assert get_home_stats('3', ttl=100).size == decimal.Decimal('1')
+
+        # 过期后先返回旧数据，只有一个请求触发重新统计
+        HomeStatsSnapshot.objects(token_chain_id='3').update_one(stat_at=0, refresh_at=0)
+        tasks = []
+
+        class Background:
+            def add_task(self, func, *args):
+                tasks.append((func, args))
+
+        assert get_home_stats('3', Background(), ttl=100).size == decimal.Decimal('1')
+        assert get_home_stats('3', Background(), ttl=100).size == decimal.Decimal('1')
+        assert tasks == [(refresh_home_stats, ('3',))]
+
+        tasks[0][0](*tasks[0][1])
+        assert get_home_stats('3', ttl=100).size == decimal.Decimal('3')
@@ -0,0 +1,69 @@
+from bson import ObjectId
+
+from app.common.models.icpdao.cycle import CycleVoteConfirm, CycleVoteConfirmStatus
+from app.common.models.icpdao.dao import DAOFollow
+from app.routes.data_loaders import BaseKeyLoader, DAOFollowLoader, LoaderRegistry
+from tests.base import Base
+
+
+class CycleVoteConfirmLoader(BaseKeyLoader):
+    key_fields = ('cycle_id', 'voter_id')
+    many = True
+
+    def get_model(self):
+        return CycleVoteConfirm
+
+
+class TestDataLoaders(Base):
+
+    def test_compound_key_query(self):
+        dao_id1 = str(ObjectId())
+        dao_id2 = str(ObjectId())
+        keys = [(dao_id1, 'u1'), (dao_id1, 'u2'), (dao_id2, 'u1')]
+        query = DAOFollow.objects.filter(DAOFollowLoader()._build_query(keys))._query
+        # 按 dao_id 分组，每组一个 $in
+        assert sorted(query['$or'], key=lambda q: q['dao_id']) == sorted([
+            {'dao_id': dao_id1, 'user_id': {'$in': ['u1', 'u2']}},
+            {'dao_id': dao_id2, 'user_id': {'$in': ['u1']}},
+        ], key=lambda q: q['dao_id'])
+
+        query = DAOFollow.objects.filter(DAOFollowLoader()._build_query([(dao_id1, 'u1')]))._query
+        assert query == {'dao_id': dao_id1, 'user_id': {'$in': ['u1']}}
+
+    def test_compound_key_load(self):
+        self.clear_db()
+        dao_id1 = str(ObjectId())
+        dao_id2 = str(ObjectId())
+        f1 = DAOFollow(dao_id=dao_id1, user_id='u1').save()
+        f2 = DAOFollow(dao_id=dao_id1, user_id='u2').save()
+        f3 = DAOFollow(dao_id=dao_id2, user_id='u1').save()
+        DAOFollow(dao_id=dao_id2, user_id='u3').save()
+
+        keys = [(dao_id1, 'u1'), (dao_id2, 'u1'), (dao_id1, 'u1'), (dao_id1, 'u2'), (dao_id2, 'u2')]
+        items = DAOFollowLoader().batch_load_fn(keys).get()
+        # 重复的 key 返回同一条，没有的返回 None，顺序和 keys 一致
+        assert [i.id if i else None for i in items] == [f1.id, f3.id, f1.id, f2.id, None]
+
+        registry = LoaderRegistry()
+        loader = registry.get(DAOFollowLoader)
+        loader.load((dao_id1, 'u1'))
+        loader.load((dao_id1, 'u1'))
+        assert registry.get_stats()['DAOFollowLoader'] == {'hit': 1, 'miss': 1}
+
+    def test_many_load(self):
+        self.clear_db()
+        dao_id = str(ObjectId())
+        cycle_id = str(ObjectId())
+        c1 = CycleVoteConfirm(
+            dao_id=dao_id, cycle_id=cycle_id, voter_id='u1', status=CycleVoteConfirmStatus.WAITING.value).save()
+        c2 = CycleVoteConfirm(
+            dao_id=dao_id, cycle_id=cycle_id, voter_id='u1', is_repeat=True,
+            status=CycleVoteConfirmStatus.CONFIRM.value).save()
+        c3 = CycleVoteConfirm(
+            dao_id=dao_id, cycle_id=cycle_id, voter_id='u2', status=CycleVoteConfirmStatus.WAITING.value).save()
+
+        keys = [(cycle_id, 'u1'), (cycle_id, 'u2'), (cycle_id, 'u3'), (cycle_id, 'u1')]
+        items = CycleVoteConfirmLoader().batch_load_fn(keys).get()
+        assert [sorted(i.id for i in item_list) for item_list in items] == [
+            sorted([c1.id, c2.id]), [c3.id], [], sorted([c1.id, c2.id])
+        ]
@@ -0,0 +1,113 @@
+import time
+from unittest import mock
+
+import pytest
+
+import settings
+from app.common.models.icpdao.github_app_token import GithubAppToken
+from app.controllers import github_app_token_cache
+from app.controllers.github_app_token_cache import get_app_token, invalidate_app_token, LEASE_NAME, \
+    _get_lease_stale_token
+from app.controllers.task_lease import acquire_lease, release_lease
+from app.models.task_lease import TaskLease
+from tests.base import Base
+
+
+class TestGithubAppTokenCache(Base):
+
+    @classmethod
+    def setup_class(cls):
+        super().setup_class()
+        github_app_token_cache.enabled = True
+
+    @classmethod
+    def teardown_class(cls):
+        github_app_token_cache.enabled = False
+        super().teardown_class()
+
+    def _create_token(self, github_owner_id, token, expires_at):
+        self.clear_db()
+        TaskLease.drop_collection()
+        invalidate_app_token(github_owner_id)
+        return GithubAppToken(github_owner_id=github_owner_id, token=token, expires_at=expires_at).save()
+
+    def test_cache_hit(self):
+        self._create_token(2, 'token1', int(time.time()) + 3600)
+        with mock.patch('app.controllers.github_app_token_cache._mint_token') as mint:
+            # mongo 命中
+            assert get_app_token('mockdao', 2) == 'token1'
+            GithubAppToken.objects(github_owner_id=2).update_one(set__token='token2')
+            # 进程内命中
+            assert get_app_token('mockdao', 2) == 'token1'
+            invalidate_app_token(2)
+            assert get_app_token('mockdao', 2) == 'token2'
+            mint.assert_not_called()
+
+    @staticmethod
+    def _mint_new_token(expires_at):
+        def mint(github_owner_name, github_owner_id):
+            # 换新期间其他进程能从租约上取到旧 token
+            assert GithubAppToken.objects(github_owner_id=github_owner_id).first().expires_at == 0
+            assert _get_lease_stale_token(github_owner_id) == 'old_token'
+            GithubAppToken.objects(github_owner_id=github_owner_id).update_one(
+                set__token='new_token', set__expires_at=expires_at)
+            return 'new_token'
+        return mint
+
+    def test_refresh_ahead(self):
+        now_at = int(time.time())
+        self._create_token(2, 'old_token', now_at + settings.ICPDAO_GITHUB_APP_TOKEN_REFRESH_AHEAD - 10)
+        with mock.patch('app.controllers.github_app_token_cache._mint_token',
+                        side_effect=self._mint_new_token(now_at + 3600)) as mint:
+            assert get_app_token('mockdao', 2) == 'new_token'
+            mint.assert_called_once()
+            # 新 token 进了进程内缓存
+            assert get_app_token('mockdao', 2) == 'new_token'
+            mint.assert_called_once()
+        record = GithubAppToken.objects(github_owner_id=2).first()
+        assert record.token == 'new_token'
+        assert record.expires_at == now_at + 3600
+        # 租约已经释放，旧 token 已经清掉
+        lease = TaskLease._get_collection().find_one({'name': LEASE_NAME, 'task_id': '2'})
+        assert lease['owner'] is None
+        assert 'stale_token' not in lease
+
+    def test_refresh_fail(self):
+        now_at = int(time.time())
+        expires_at = now_at + settings.ICPDAO_GITHUB_APP_TOKEN_REFRESH_AHEAD - 10
+        self._create_token(2, 'old_token', expires_at)
+        with mock.patch('app.controllers.github_app_token_cache._mint_token', side_effect=ValueError('github error')):
+            # 旧 token 还没过期，继续使用
+            assert get_app_token('mockdao', 2) == 'old_token'
+        record = GithubAppToken.objects(github_owner_id=2).first()
+        assert record.token == 'old_token'
+        assert record.expires_at == expires_at
+
+        # 旧 token 已经过期时抛出
+        GithubAppToken.objects(github_owner_id=2).update_one(set__expires_at=now_at - 1)
+        with mock.patch('app.controllers.github_app_token_cache._mint_token', side_effect=ValueError('github error')):
+            with pytest.raises(ValueError):
+                get_app_token('mockdao', 2)
+
+    def test_lose_lease(self):
+        now_at = int(time.time())
+        self._create_token(2, 'old_token', now_at + settings.ICPDAO_GITHUB_APP_TOKEN_REFRESH_AHEAD - 10)
+        # 其他进程正在换新
+        assert acquire_lease(LEASE_NAME, '2', 'other', 30)
+        with mock.patch('app.controllers.github_app_token_cache._mint_token') as mint:
+            assert get_app_token('mockdao', 2) == 'old_token'
+            # mongo 里的 token 已经被换新的进程置为过期，从租约上取旧 token
+            GithubAppToken.objects(github_owner_id=2).update_one(set__expires_at=0)
+            TaskLease._get_collection().update_one(
+                {'name': LEASE_NAME, 'task_id': '2'},
+                {'$set': {'stale_token': 'old_token', 'stale_expires_at': now_at + 60}})
+            assert get_app_token('mockdao', 2) == 'old_token'
+            mint.assert_not_called()
+
+        # 旧 token 不进进程内缓存，租约释放后换新
+        GithubAppToken.objects(github_owner_id=2).update_one(set__expires_at=now_at + 60)
+        release_lease(LEASE_NAME, '2', 'other')
+        with mock.patch('app.controllers.github_app_token_cache._mint_token',
+                        side_effect=self._mint_new_token(now_at + 3600)):
+            assert get_app_token('mockdao', 2) == 'new_token'
+        assert GithubAppToken.objects(github_owner_id=2).first().token == 'new_token'
@@ -0,0 +1,53 @@
+from collections import Counter
+
+from app.common.models.icpdao.cycle import Cycle
+from app.common.models.icpdao.job import Job
+from app.controllers.index_advisor import ensure_indexes, check_hot_queries, scan_query_shapes, suggest_indexes, \
+    propose_index, explain_query_shapes, QueryShape
+from tests.base import Base
+
+
+class TestIndexAdvisor(Base):
+
+    def test_scan_query_shapes(self):
+        shapes = scan_query_shapes()
+        # Job.objects(github_repo_id=..., github_issue_number=...)
+        issue_shape = QueryShape('Job', ('github_repo_id', 'github_issue_number'), (), ())
+        assert shapes[issue_shape] > 0
+        # Job.objects(cycle_id=..., status__nin=[...])
+        cycle_jobs_shape = QueryShape('Job', ('cycle_id',), (), ('status',))
+        assert shapes[cycle_jobs_shape] > 0
+        # Cycle.objects(dao_id=...).order_by("-begin_at")
+        last_cycle_shape = QueryShape('Cycle', ('dao_id',), (('begin_at', -1),), ())
+        assert shapes[last_cycle_shape] > 0
+
+        suggested = {shape for shape, _, _ in suggest_indexes(shapes)}
+        assert issue_shape not in suggested
+        assert cycle_jobs_shape not in suggested
+        assert last_cycle_shape not in suggested
+
+    def test_propose_index(self):
+        shape = QueryShape('Job', ('dao_id', 'user_id'), (('create_at', -1),), ('status', 'user_id'))
+        assert propose_index(shape) == (('dao_id', 1), ('user_id', 1), ('create_at', -1), ('status', 1))
+
+        # 排序字段不在已有索引里，需要新的复合索引
+        shape = QueryShape('Job', ('dao_id',), (('title', -1),), ())
+        assert suggest_indexes(Counter({shape: 1})) == [(shape, (('dao_id', 1), ('title', -1)), 1)]
+
+    def test_hot_queries_use_index(self):
+        self.clear_db()
+        ensure_indexes()
+        assert check_hot_queries() == []
+
+    def test_explain_query_shapes(self):
+        self.clear_db()
+        Job.drop_collection()
+        Cycle.drop_collection()
+        ensure_indexes()
+        indexed = QueryShape('Cycle', ('dao_id',), (('begin_at', -1),), ('end_at',))
+        unindexed = QueryShape('Job', ('title',), (), ())
+        in_memory_sort = QueryShape('Job', ('dao_id',), (('title', 1),), ())
+        result = dict(explain_query_shapes([indexed, unindexed, in_memory_sort]))
+        assert indexed not in result
+        assert 'COLLSCAN' in result[unindexed]
+        assert 'SORT' in result[in_memory_sort]
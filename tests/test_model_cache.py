@@ -0,0 +1,100 @@
+import time
+from unittest import mock
+
+from app.common.models.icpdao.dao import DAO, DAOJobConfig
+from app.common.models.icpdao.user import UserStatus
+from app.controllers.model_cache import model_cache, get_dao, get_dao_by_name, get_dao_job_config, \
+    get_user_by_github_login
+from tests.base import Base
+
+
+class TestModelCache(Base):
+    create_dao = """
+mutation {
+  createDao(name: "%s", desc: "test_dao", logo: "test_dao", timeZone: 480, timeZoneRegion: "Asia/Shanghai") {
+    dao {
+      id
+    }
+  }
+}
+"""
+
+    update_dao_info = """
+mutation {
+  updateDaoBaseInfo(id: "%s", desc: "%s") {
+    dao {
+      id
+    }
+  }
+}
+"""
+
+    update_job_config = """
+mutation {
+  updateDaoJobConfig(daoId: "%s", deadlineDay: 15, pairBeginDay: 15, pairEndDay: 17, votingBeginDay: 17, votingEndDay: 20) {
+    ok
+  }
+}
+"""
+
+    @classmethod
+    def setup_class(cls):
+        super().setup_class()
+        model_cache.enabled = True
+        model_cache.clear()
+
+    @classmethod
+    def teardown_class(cls):
+        model_cache.enabled = False
+        model_cache.clear()
+        super().teardown_class()
+
+    def test_ttl_and_copy(self):
+        model_cache.clear()
+        icpper = self.create_icpper_user('cache_icpper', 'cache_icpper')
+        dao = DAO(name='cache_ttl', owner_id=str(icpper.id), github_owner_id=1, github_owner_name='cache_ttl',
+                  desc='old').save()
+
+        cached = get_dao(str(dao.id))
+        assert cached.desc == 'old'
+        # 返回的是副本，修改不影响缓存
+        cached.desc = 'changed'
+        assert get_dao(str(dao.id)).desc == 'old'
+        assert get_dao_by_name('cache_ttl').desc == 'old'
+
+        DAO.objects(id=dao.id).update_one(set__desc='new')
+        assert get_dao(str(dao.id)).desc == 'old'
+
+        now = time.time()
+        with mock.patch('app.controllers.model_cache.time.time', return_value=now + model_cache.ttl + 1):
+            assert get_dao(str(dao.id)).desc == 'new'
+
+        # 查不到的不缓存
+        assert get_dao_by_name('cache_ttl_none') is None
+        DAO(name='cache_ttl_none', owner_id=str(icpper.id), github_owner_id=2,
+            github_owner_name='cache_ttl_none').save()
+        assert get_dao_by_name('cache_ttl_none').name == 'cache_ttl_none'
+
+    def test_invalidate_by_mutations(self):
+        model_cache.clear()
+        pre_icpper = self.create_pre_icpper_user('cache_pre_icpper', 'cache_pre_icpper')
+        assert get_user_by_github_login('cache_pre_icpper').status == UserStatus.PRE_ICPPER.value
+
+        ret = self.graph_query(pre_icpper.id, self.create_dao % 'cache_dao')
+        assert ret.status_code == 200
+        dao_id = ret.json()['data']['createDao']['dao']['id']
+        assert get_user_by_github_login('cache_pre_icpper').status == UserStatus.ICPPER.value
+
+        assert get_dao(dao_id).desc == 'test_dao'
+        assert get_dao_by_name('cache_dao').desc == 'test_dao'
+        ret = self.graph_query(pre_icpper.id, self.update_dao_info % (dao_id, 'cache_desc'))
+        assert ret.status_code == 200
+        assert get_dao(dao_id).desc == 'cache_desc'
+        assert get_dao_by_name('cache_dao').desc == 'cache_desc'
+
+        assert get_dao_job_config(dao_id).pair_end_day != 17
+        ret = self.graph_query(pre_icpper.id, self.update_job_config % dao_id)
+        assert ret.status_code == 200
+        assert ret.json()['data']['updateDaoJobConfig']['ok'] is True
+        assert get_dao_job_config(dao_id).pair_end_day == 17
+        assert DAOJobConfig.objects(dao_id=dao_id).first().pair_end_day == 17
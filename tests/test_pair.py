@@ -1,13 +1,15 @@
 import time
 from decimal import Decimal
 import random
+from unittest import mock
 
 from app.common.models.icpdao.cycle import Cycle, CycleVotePairTask, CycleVote, CycleVoteType, CycleVoteConfirm, \
-    CycleVoteConfirmStatus
+    CycleVoteConfirmStatus, CycleVotePairTaskStatus
 from app.common.models.icpdao.dao import DAO
 from app.common.models.icpdao.job import Job, JobStatusEnum, JobPairTypeEnum, JobPR, JobPRStatusEnum
 from app.common.models.icpdao.user import User
-from app.controllers.pair import run_pair_task
+from app.controllers.pair import run_pair_task, get_cycle_vote_filter, get_cycle_vote_match
+from app.models.cycle_vote_pair_plan import CycleVotePairPlan, CycleVotePairPlanStatus, CycleVotePairPlanVote
 from tests.base import Base
 
 
@@ -375,3 +377,75 @@ class TestPair(Base):
         assert len(cyc) == 3
         for c in cyc:
             assert c.status == CycleVoteConfirmStatus.WAITING.value
+
+        cycle_id = str(test_cycle_2.id)
+        plan = CycleVotePairPlan.objects(cycle_id=cycle_id).first()
+        assert plan.status == CycleVotePairPlanStatus.COMMITTED
+        assert plan.written == 7
+        assert plan.active_generation == 1
+        assert CycleVote._get_collection().count_documents({'cycle_id': cycle_id, 'generation': 1}) == 7
+        gen_1_vote_ids = set(str(v.id) for v in CycleVote.objects())
+        assert gen_1_vote_ids == set(str(v.id) for v in CycleVote.objects(**get_cycle_vote_filter(cycle_id)))
+        assert CycleVotePairPlanVote.objects().count() == 0
+
+        # 模拟第二代写到一半超时，读到的还是第一代的 vote
+        origin_update = CycleVotePairPlan.update
+
+        def _timeout_update(plan, **kwargs):
+            if kwargs.get('written') == 6:
+                raise ValueError('timeout')
+            return origin_update(plan, **kwargs)
+
+        task_2 = CycleVotePairTask(dao_id=test_cycle_2.dao_id, cycle_id=cycle_id).save()
+        with mock.patch('app.controllers.pair.PAIR_WRITE_BATCH_SIZE', 3), \
+                mock.patch.object(CycleVotePairPlan, 'update', _timeout_update):
+            run_pair_task(str(task_2.id))
+        assert CycleVotePairTask.objects(id=task_2.id).first().status == CycleVotePairTaskStatus.FAIL.value
+        plan = CycleVotePairPlan.objects(cycle_id=cycle_id).first()
+        assert plan.generation == 2
+        assert plan.status == CycleVotePairPlanStatus.PLANNED
+        assert plan.written == 3
+        assert CycleVote.objects().count() == 7 + 6
+        assert set(str(v.id) for v in CycleVote.objects(**get_cycle_vote_filter(cycle_id))) == gen_1_vote_ids
+        gen_2_vote_ids = set(str(v.vote['_id']) for v in CycleVotePairPlanVote.objects(generation=2))
+        assert len(gen_2_vote_ids) == 7
+        assert not (gen_1_vote_ids & gen_2_vote_ids)
+
+        # 新的任务从中断的地方继续，使用同一批 vote，完成后切换到第二代
+        task_3 = CycleVotePairTask(dao_id=test_cycle_2.dao_id, cycle_id=cycle_id).save()
+        run_pair_task(str(task_3.id))
+        assert CycleVotePairTask.objects(id=task_3.id).first().status == CycleVotePairTaskStatus.SUCCESS.value
+        plan = CycleVotePairPlan.objects(cycle_id=cycle_id).first()
+        assert plan.generation == 2
+        assert plan.active_generation == 2
+        assert plan.status == CycleVotePairPlanStatus.COMMITTED
+        assert set(str(v.id) for v in CycleVote.objects()) == gen_2_vote_ids
+        assert set(str(v.id) for v in CycleVote.objects(**get_cycle_vote_filter(cycle_id))) == gen_2_vote_ids
+        assert CycleVotePairPlanVote.objects().count() == 0
+
+        # 已经完成的 plan 再次 pair 会生成新的一代，旧的 vote 被替换
+        task_4 = CycleVotePairTask(dao_id=test_cycle_2.dao_id, cycle_id=cycle_id).save()
+        run_pair_task(str(task_4.id))
+        assert CycleVote.objects().count() == 7
+        assert not (set(str(v.id) for v in CycleVote.objects()) & gen_2_vote_ids)
+        assert CycleVotePairPlan.objects(cycle_id=cycle_id).first().active_generation == 3
+
+    def test_cycle_vote_match(self):
+        self.clear_db()
+        cycle_id = 'cycle_vote_match'
+        # 没有 plan 的 cycle 不限制 generation
+        assert get_cycle_vote_match(cycle_id) == {'cycle_id': cycle_id}
+
+        vote_collection = CycleVote._get_collection()
+        vote_collection.insert_many([
+            {'cycle_id': cycle_id, 'dao_id': 'd1'},
+            {'cycle_id': cycle_id, 'dao_id': 'd1', 'generation': 1},
+        ])
+        plan = CycleVotePairPlan(cycle_id=cycle_id, dao_id='d1', task_id='t1', fingerprint='f1').save()
+        # 还没有切换过，只读 plan 之前的 vote
+        assert vote_collection.count_documents(get_cycle_vote_match(cycle_id)) == 1
+        assert vote_collection.find_one(get_cycle_vote_match(cycle_id)).get('generation') is None
+
+        plan.update(active_generation=1)
+        assert vote_collection.find_one(get_cycle_vote_match(cycle_id))['generation'] == 1
+        assert vote_collection.count_documents(get_cycle_vote_match(cycle_id)) == 1
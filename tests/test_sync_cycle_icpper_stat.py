@@ -0,0 +1,111 @@
+import time
+from decimal import Decimal
+
+from bson import ObjectId
+
+from app.common.models.icpdao.cycle import CycleIcpperStat
+from app.common.models.icpdao.dao import DAO
+from app.common.models.icpdao.job import Job, JobStatusEnum
+from app.controllers.sync_cycle_icppper_stat import sync_cycle_icpper_stats, sync_one_cycle_icppper_stat
+from tests.base import Base
+
+
+class TestSyncCycleIcpperStat(Base):
+
+    @staticmethod
+    def _create_job(dao, cycle_id, user, size, number, status=JobStatusEnum.MERGED.value):
+        return Job(
+            dao_id=str(dao.id), user_id=str(user.id), title='xx',
+            size=Decimal(size), github_repo_owner='xx', github_repo_name='xx',
+            github_repo_owner_id=1, github_repo_id=1,
+            github_issue_number=number, bot_comment_database_id=number,
+            status=status, cycle_id=cycle_id
+        ).save()
+
+    @staticmethod
+    def _create_stat(dao_id, cycle_id, user, create_at, job_count=1):
+        return CycleIcpperStat(
+            dao_id=dao_id, cycle_id=cycle_id, user_id=str(user.id),
+            job_count=job_count, job_size=Decimal('1'), size=Decimal('1'),
+            vote_ei=Decimal('1'), owner_ei=Decimal('0'), ei=Decimal('1'),
+            create_at=create_at, update_at=create_at
+        ).save()
+
+    @staticmethod
+    def _get_stat(cycle_id, user):
+        return CycleIcpperStat.objects(cycle_id=cycle_id, user_id=str(user.id)).first()
+
+    def test_sync_cycle_icpper_stats(self):
+        self.clear_db()
+        icpper1 = self.create_icpper_user('icpper1', 'icpper1')
+        icpper2 = self.create_icpper_user('icpper2', 'icpper2')
+        icpper3 = self.create_icpper_user('icpper3', 'icpper3')
+        dao = DAO(name='d1', owner_id=str(icpper1.id), github_owner_id=1, github_owner_name='d1').save()
+        cycle_id = str(ObjectId())
+
+        self._create_job(dao, cycle_id, icpper1, '2', 1)
+        self._create_job(dao, cycle_id, icpper1, '3', 2, JobStatusEnum.AWAITING_VOTING.value)
+        self._create_job(dao, cycle_id, icpper1, '7', 3, JobStatusEnum.AWAITING_MERGER.value)
+        self._create_job(dao, cycle_id, icpper2, '4', 4, JobStatusEnum.WAITING_FOR_TOKEN.value)
+        self._create_job(dao, str(ObjectId()), icpper2, '9', 5)
+        # icpper3 的 job 都已经不在这个 cycle
+        old_stat3 = self._create_stat(str(dao.id), cycle_id, icpper3, int(time.time()), job_count=5)
+
+        sync_cycle_icpper_stats(str(dao.id), cycle_id)
+        assert CycleIcpperStat.objects(cycle_id=cycle_id).count() == 3
+
+        stat1 = self._get_stat(cycle_id, icpper1)
+        assert stat1.job_count == 2
+        assert stat1.job_size == Decimal('5')
+        assert stat1.size == Decimal('5')
+        assert stat1.vote_ei == Decimal('0')
+        assert stat1.ei == Decimal('0')
+        assert stat1.create_at == int(stat1.id.generation_time.timestamp())
+        assert stat1.last_id is None
+
+        stat2 = self._get_stat(cycle_id, icpper2)
+        assert stat2.job_count == 1
+        assert stat2.job_size == Decimal('4')
+
+        stat3 = self._get_stat(cycle_id, icpper3)
+        assert stat3.id == old_stat3.id
+        assert stat3.job_count == 0
+        assert stat3.job_size == Decimal('0')
+        # 已有的记录不重新初始化
+        assert stat3.vote_ei == Decimal('1')
+
+        # 只同步指定的 user
+        self._create_job(dao, cycle_id, icpper1, '1', 6)
+        self._create_job(dao, cycle_id, icpper2, '1', 7)
+        sync_one_cycle_icppper_stat(str(dao.id), cycle_id, str(icpper2.id))
+        assert self._get_stat(cycle_id, icpper1).job_count == 2
+        assert self._get_stat(cycle_id, icpper2).job_count == 2
+        assert self._get_stat(cycle_id, icpper2).job_size == Decimal('5')
+
+    def test_last_id(self):
+        self.clear_db()
+        icpper1 = self.create_icpper_user('icpper1', 'icpper1')
+        icpper2 = self.create_icpper_user('icpper2', 'icpper2')
+        icpper3 = self.create_icpper_user('icpper3', 'icpper3')
+        dao = DAO(name='d1', owner_id=str(icpper1.id), github_owner_id=1, github_owner_name='d1').save()
+        dao_id = str(dao.id)
+        cycle_a = str(ObjectId())
+        cycle_b = str(ObjectId())
+        cycle_c = str(ObjectId())
+        now_at = int(time.time())
+
+        self._create_stat(dao_id, cycle_a, icpper1, now_at - 300)
+        stat1_b = self._create_stat(dao_id, cycle_b, icpper1, now_at - 200)
+        stat2_a = self._create_stat(dao_id, cycle_a, icpper2, now_at - 250)
+        # 其他 dao 和时间更晚的记录不能作为 last_id
+        self._create_stat(str(ObjectId()), str(ObjectId()), icpper2, now_at - 100)
+        self._create_stat(dao_id, str(ObjectId()), icpper1, now_at + 1000)
+
+        self._create_job(dao, cycle_c, icpper1, '1', 1)
+        self._create_job(dao, cycle_c, icpper2, '1', 2)
+        self._create_job(dao, cycle_c, icpper3, '1', 3)
+        sync_cycle_icpper_stats(dao_id, cycle_c, [str(icpper1.id), str(icpper2.id), str(icpper3.id)])
+
+        assert self._get_stat(cycle_c, icpper1).last_id == str(stat1_b.id)
+        assert self._get_stat(cycle_c, icpper2).last_id == str(stat2_a.id)
+        assert self._get_stat(cycle_c, icpper3).last_id is None
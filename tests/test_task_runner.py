@@ -0,0 +1,97 @@
+import os
+import time
+from unittest import mock
+
+import pytest
+from bson import ObjectId
+
+import settings
+from app.common.models.icpdao.cycle import Cycle, CycleVoteResultStatTask, CycleVoteResultStatTaskStatus
+from app.controllers.task_lease import acquire_lease, release_lease, get_live_lease
+from app.controllers.task_runner import run_task, drain_task_queue, sweep_expired_tasks, reclaim_expired_task
+from app.models.task_lease import TaskLease
+from app.models.task_queue import TaskQueueItem, TaskQueueItemStatus
+from tests.base import Base
+
+
+class TestTaskRunner(Base):
+
+    def test_queue_runner(self):
+        self.clear_db()
+        TaskQueueItem.drop_collection()
+        task_id = str(ObjectId())
+
+        run_task('vote_result_stat', task_id, runner='queue')
+        run_task('vote_result_stat', task_id, runner='queue')
+        assert TaskQueueItem.objects(task_id=task_id).count() == 1
+        assert TaskQueueItem.objects(task_id=task_id).first().status == TaskQueueItemStatus.INIT
+
+        assert drain_task_queue() == 1
+        item = TaskQueueItem.objects(task_id=task_id).first()
+        assert item.status == TaskQueueItemStatus.DONE
+        assert item.worker
+        assert drain_task_queue() == 0
+
+    def test_lease_and_sweep(self):
+        self.clear_db()
+        TaskLease.drop_collection()
+        TaskQueueItem.drop_collection()
+        task_id = str(ObjectId())
+
+        assert acquire_lease('vote_result_stat', task_id, 'worker1')
+        assert acquire_lease('vote_result_stat', task_id, 'worker2') is None
+        release_lease('vote_result_stat', task_id, 'worker1')
+        assert get_live_lease('vote_result_stat', task_id) is None
+        lease = acquire_lease('vote_result_stat', task_id, 'worker2')
+        assert lease.attempts == 2
+        release_lease('vote_result_stat', task_id, 'worker2')
+
+        old_at = int(time.time()) - settings.ICPDAO_TASK_LEASE_TTL - 1
+        task = CycleVoteResultStatTask(
+            dao_id=str(ObjectId()), cycle_id=str(ObjectId()),
+            status=CycleVoteResultStatTaskStatus.STATING.value, update_at=old_at
+        ).save()
+        # 还有有效租约的任务不处理
+        acquire_lease('vote_result_stat', str(task.id), 'worker1')
+        assert sweep_expired_tasks(runner='queue') == 0
+        release_lease('vote_result_stat', str(task.id), 'worker1')
+
+        assert sweep_expired_tasks(runner='queue') == 1
+        task.reload()
+        assert task.status == CycleVoteResultStatTaskStatus.INIT.value
+        assert TaskQueueItem.objects(task_id=str(task.id)).first().status == TaskQueueItemStatus.INIT
+
+    def test_runner_checks(self):
+        task_id = str(ObjectId())
+        with pytest.raises(ValueError):
+            run_task('vote_result_stat', task_id, background=None, runner='background')
+        with mock.patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_NAME': 'dao-service'}):
+            with pytest.raises(ValueError):
+                run_task('vote_result_stat', task_id, runner='process')
+
+    def test_unstarted_task(self):
+        self.clear_db()
+        TaskLease.drop_collection()
+        TaskQueueItem.drop_collection()
+        now_at = int(time.time())
+        cycle = Cycle(
+            dao_id=str(ObjectId()), begin_at=now_at - 100, end_at=now_at - 50,
+            pair_begin_at=now_at - 40, pair_end_at=now_at - 30,
+            vote_begin_at=now_at - 30, vote_end_at=now_at + 1000
+        ).save()
+
+        # 投票还没结束，任务直接返回，不会一直是 INIT
+        task = CycleVoteResultStatTask(dao_id=cycle.dao_id, cycle_id=str(cycle.id)).save()
+        run_task('vote_result_stat', str(task.id), runner='inline')
+        task.reload()
+        assert task.status == CycleVoteResultStatTaskStatus.FAIL.value
+
+        # 只重置，不重新运行
+        old_at = now_at - settings.ICPDAO_TASK_LEASE_TTL - 1
+        task = CycleVoteResultStatTask(
+            dao_id=cycle.dao_id, cycle_id=str(cycle.id),
+            status=CycleVoteResultStatTaskStatus.STATING.value, update_at=old_at
+        ).save()
+        assert reclaim_expired_task('vote_result_stat', task, runner='queue', rerun=False) == \
+            CycleVoteResultStatTaskStatus.INIT.value
+        assert TaskQueueItem.objects(task_id=str(task.id)).count() == 0
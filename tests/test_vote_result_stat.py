@@ -0,0 +1,144 @@
+import time
+from decimal import Decimal
+
+import pytest
+from bson import ObjectId
+
+from app.common.models.icpdao.cycle import CycleIcpperStat, CycleVote, CycleVoteType
+from app.common.models.icpdao.dao import DAO
+from app.common.models.icpdao.job import Job, JobStatusEnum, JobPR, JobPRStatusEnum
+from app.controllers.vote_result_stat import stat_cycle_icpper_stat_size, _stat_cycle_votes
+from tests.base import Base
+
+
+class TestVoteResultStat(Base):
+
+    @staticmethod
+    def _create_job(dao, cycle_id, user, size, reviewer, number):
+        job = Job(
+            dao_id=str(dao.id), user_id=str(user.id), title='xx',
+            size=Decimal(size), github_repo_owner='xx', github_repo_name='xx',
+            github_repo_owner_id=1, github_repo_id=1,
+            github_issue_number=number, bot_comment_database_id=number,
+            status=JobStatusEnum.AWAITING_VOTING.value, cycle_id=cycle_id
+        ).save()
+        JobPR(
+            job_id=str(job.id), user_id=str(user.id), title='xx_pr',
+            github_repo_owner='xx', github_repo_name='xx',
+            github_repo_owner_id=1, github_repo_id=1,
+            github_pr_number=number, github_pr_id=number,
+            status=JobPRStatusEnum.MERGED.value,
+            merged_user_github_user_id=reviewer.github_user_id,
+            merged_at=time.time()
+        ).save()
+        return job
+
+    @staticmethod
+    def _create_stat(dao, cycle_id, user, ei, job_size=None, last=None):
+        return CycleIcpperStat(
+            dao_id=str(dao.id), cycle_id=cycle_id, user_id=str(user.id),
+            job_count=1, job_size=Decimal(job_size or '0'), size=Decimal(job_size or '0'),
+            vote_ei=Decimal(ei), owner_ei=Decimal('0'), ei=Decimal(ei),
+            last_id=str(last.id) if last else None
+        ).save()
+
+    def test_stat_cycle_icpper_stat_size(self):
+        self.clear_db()
+        icpper1 = self.create_icpper_user('icpper1', 'icpper1')
+        icpper2 = self.create_icpper_user('icpper2', 'icpper2')
+        icpper3 = self.create_icpper_user('icpper3', 'icpper3')
+        dao = DAO(name='d1', owner_id=str(icpper1.id), github_owner_id=1, github_owner_name='d1').save()
+        last_cycle_id = str(ObjectId())
+        cycle_id = str(ObjectId())
+
+        self._create_job(dao, cycle_id, icpper1, '10', icpper2, 1)
+        self._create_job(dao, cycle_id, icpper2, '4', icpper3, 2)
+        self._create_job(dao, cycle_id, icpper3, '6', icpper3, 3)
+
+        last1 = self._create_stat(dao, last_cycle_id, icpper1, '0.3')
+        last2 = self._create_stat(dao, last_cycle_id, icpper2, '0.9')
+        self._create_stat(dao, cycle_id, icpper1, '0.2', '10', last1)
+        self._create_stat(dao, cycle_id, icpper2, '0.3', '4', last2)
+        self._create_stat(dao, cycle_id, icpper3, '1', '6')
+
+        stat_cycle_icpper_stat_size(str(dao.id), cycle_id)
+
+        # icpper1 连续两次低于 0.4，size 减半，merge 的 icpper2 被扣 size
+        stat1 = CycleIcpperStat.objects(cycle_id=cycle_id, user_id=str(icpper1.id)).first()
+        assert stat1.size == Decimal('5')
+        assert stat1.have_two_times_lt_04 is True
+        assert not stat1.have_two_times_lt_08
+
+        # icpper2 第一次低于 0.4，merge 的 icpper3 被警告
+        stat2 = CycleIcpperStat.objects(cycle_id=cycle_id, user_id=str(icpper2.id)).first()
+        assert stat2.be_deducted_size_by_review == Decimal('5')
+        assert stat2.size == Decimal('0')
+        assert not stat2.have_two_times_lt_04
+
+        stat3 = CycleIcpperStat.objects(cycle_id=cycle_id, user_id=str(icpper3.id)).first()
+        assert stat3.size == Decimal('6')
+        assert stat3.be_reviewer_has_warning_user_ids == [str(icpper2.id)]
+        assert stat3.be_deducted_size_by_review is None
+
+    @staticmethod
+    def _create_vote(dao, cycle_id, vote_type, left_job, right_job, **kwargs):
+        vote = {
+            'dao_id': str(dao.id), 'cycle_id': cycle_id, 'vote_type': vote_type,
+            'left_job_id': str(left_job.id), 'right_job_id': str(right_job.id),
+            'is_result_public': vote_type == CycleVoteType.ALL.value
+        }
+        vote.update(kwargs)
+        CycleVote._get_collection().insert_one(vote)
+
+    def test_stat_cycle_votes(self):
+        self.clear_db()
+        icpper1 = self.create_icpper_user('icpper1', 'icpper1')
+        icpper2 = self.create_icpper_user('icpper2', 'icpper2')
+        icpper3 = self.create_icpper_user('icpper3', 'icpper3')
+        dao = DAO(name='d1', owner_id=str(icpper1.id), github_owner_id=1, github_owner_name='d1').save()
+        cycle_id = str(ObjectId())
+        user_ids = {str(icpper1.id), str(icpper2.id), str(icpper3.id)}
+
+        job1 = self._create_job(dao, cycle_id, icpper1, '10', icpper2, 1)
+        job2 = self._create_job(dao, cycle_id, icpper2, '4', icpper3, 2)
+        job3 = self._create_job(dao, cycle_id, icpper3, '6', icpper1, 3)
+        job4 = self._create_job(dao, cycle_id, icpper1, '3', icpper2, 4)
+        pair = CycleVoteType.PAIR.value
+        all_type = CycleVoteType.ALL.value
+
+        # icpper1 +10, icpper2 +4
+        self._create_vote(dao, cycle_id, pair, job1, job2, voter_id=str(icpper3.id), vote_job_id=str(job1.id))
+        self._create_vote(dao, cycle_id, pair, job4, job2, voter_id=str(icpper3.id), vote_job_id=str(job2.id))
+        # icpper2 没有投票
+        self._create_vote(dao, cycle_id, pair, job1, job3, voter_id=str(icpper2.id))
+        # 需要重新投票的 icpper1 也算没有投完，投出的票仍然计入 icpper3 +6
+        self._create_vote(
+            dao, cycle_id, pair, job3, job2, voter_id=str(icpper1.id), vote_job_id=str(job3.id), is_repeat=True)
+        # all 投票 >= 50 计入 icpper1 +3，< 50 不计入
+        all_voters = [{'voter_id': user_id, 'vote': True} for user_id in user_ids]
+        self._create_vote(dao, cycle_id, all_type, job4, job4,
+                          vote_result_stat_type_all=60, vote_result_type_all=all_voters)
+        self._create_vote(dao, cycle_id, all_type, job3, job3,
+                          vote_result_stat_type_all=40, vote_result_type_all=all_voters)
+        # 其他 cycle 的投票不计入
+        self._create_vote(dao, str(ObjectId()), pair, job1, job2, voter_id=str(icpper2.id), vote_job_id=str(job1.id))
+
+        un_voted, userid_2_vote_size = _stat_cycle_votes(str(dao.id), cycle_id, user_ids)
+        assert un_voted == {str(icpper1.id), str(icpper2.id)}
+        assert userid_2_vote_size == {
+            str(icpper1.id): Decimal('13'),
+            str(icpper2.id): Decimal('4'),
+            str(icpper3.id): Decimal('6'),
+        }
+
+        # all 投票没有全部投完
+        self._create_vote(dao, cycle_id, all_type, job2, job2, vote_result_stat_type_all=0,
+                          vote_result_type_all=[{'voter_id': str(icpper1.id), 'vote': True}])
+        un_voted, _ = _stat_cycle_votes(str(dao.id), cycle_id, user_ids)
+        assert un_voted == user_ids
+
+        # 投票对应的 job 不存在
+        missing_job_id = str(ObjectId())
+        self._create_vote(dao, cycle_id, pair, job1, job2, voter_id=str(icpper3.id), vote_job_id=missing_job_id)
+        with pytest.raises(ValueError, match=missing_job_id):
+            _stat_cycle_votes(str(dao.id), cycle_id, user_ids)
@@ -0,0 +1,150 @@
+import datetime
+import hashlib
+import hmac
+import json
+import time
+from unittest import mock
+
+import settings
+from app import webhooks_route
+from app.controllers.webhook import drain_webhook_events, add_pending_job_sync, flush_pending_job_syncs, \
+    enqueue_webhook_event, handler
+from app.models.pending_job_sync import PendingJobSync
+from app.models.webhook_event import WebhookEvent, WebhookEventStatus
+from tests.base import Base
+
+
+class TestWebhookQueue(Base):
+
+    request_data = {
+        "action": "closed",
+        "number": 10,
+        "pull_request": {
+            "url": "xxx",
+            "id": 555,
+            "number": 10,
+            "state": "closed",
+            "title": "Webhook Update",
+            "merged_at": datetime.datetime.utcnow().isoformat(),
+            "merged": True,
+            "merged_by": {"login": "mockuser1", "id": 1},
+        },
+        "repository": {
+            "id": 222,
+            "name": "mockrepo",
+            "owner": {"login": "mockdao", "id": 2}
+        }
+    }
+
+    def test_queue_mode(self):
+        self.clear_db()
+        WebhookEvent.drop_collection()
+        settings.ICPDAO_GITHUB_WEBHOOK_MODE = 'queue'
+        try:
+            for _ in range(2):
+                res = self.client.post(
+                    webhooks_route, json=self.request_data,
+                    headers={'X-GitHub-Delivery': 'delivery-1', 'X-GitHub-Event': 'pull_request'}
+                )
+                assert res.json()['success'] is True
+        finally:
+            settings.ICPDAO_GITHUB_WEBHOOK_MODE = 'sync'
+
+        assert WebhookEvent.objects(delivery_id='delivery-1').count() == 1
+        assert WebhookEvent.objects(delivery_id='delivery-1').first().status == WebhookEventStatus.INIT
+
+        # 没有关联的 JobPR，不需要请求 github
+        assert drain_webhook_events() == 1
+        event = WebhookEvent.objects(delivery_id='delivery-1').first()
+        assert event.status == WebhookEventStatus.DONE
+        assert event.attempts == 1
+        assert event.expire_at > datetime.datetime.utcnow()
+        assert drain_webhook_events() == 0
+
+    def test_signature(self):
+        body = json.dumps(self.request_data).encode()
+        settings.ICPDAO_GITHUB_WEBHOOK_SECRET = 'secret'
+        try:
+            res = self.client.post(webhooks_route, data=body, headers={'X-Hub-Signature-256': 'sha256=xx'})
+            assert res.status_code == 401
+            signature = 'sha256=' + hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+            res = self.client.post(webhooks_route, data=body, headers={'X-Hub-Signature-256': signature})
+            assert res.json()['success'] is True
+        finally:
+            settings.ICPDAO_GITHUB_WEBHOOK_SECRET = None
+
+    def test_coalesce_job_sync(self):
+        self.clear_db()
+        PendingJobSync.drop_collection()
+        add_pending_job_sync('mockdao', 2, {'job1', 'job2'}, window=100)
+        add_pending_job_sync('mockdao', 2, {'job2', 'job3'}, window=100)
+        add_pending_job_sync('mockdao2', 3, {'job4'}, window=100)
+
+        item = PendingJobSync.objects(github_owner_id=2).first()
+        assert sorted(item.job_ids) == ['job1', 'job2', 'job3']
+        assert PendingJobSync.objects.count() == 2
+
+        # 还没有到期
+        assert flush_pending_job_syncs(int(time.time())) == 0
+        assert PendingJobSync.objects.count() == 2
+
+    def test_flush_job_sync(self):
+        self.clear_db()
+        PendingJobSync.drop_collection()
+        add_pending_job_sync('mockdao', 2, {'job1', 'job2'}, window=0)
+        now_at = int(time.time())
+
+        # 同步失败时保留记录，释放并推迟
+        with mock.patch('app.controllers.webhook.get_app_client'), \
+                mock.patch('app.controllers.webhook.sync_job_issue_status_comment',
+                           side_effect=ValueError('github error')):
+            assert flush_pending_job_syncs(now_at) == 0
+        item = PendingJobSync.objects(github_owner_id=2).first()
+        assert sorted(item.job_ids) == ['job1', 'job2']
+        assert item.claim_at is None
+        assert item.due_at >= now_at + 60
+
+        # 其他 worker 占用中的记录不处理，超过 lease 后可以重新占用
+        now_at = item.due_at
+        PendingJobSync.objects(id=item.id).update_one(set__claim_at=now_at, set__worker='other')
+        with mock.patch('app.controllers.webhook.get_app_client'), \
+                mock.patch('app.controllers.webhook.sync_job_issue_status_comment') as sync:
+            assert flush_pending_job_syncs(now_at) == 0
+            assert flush_pending_job_syncs(now_at + settings.ICPDAO_TASK_LEASE_TTL + 1) == 1
+            sync.assert_called_once()
+        assert PendingJobSync.objects.count() == 0
+
+        # 同步期间加入的 job 不丢失
+        add_pending_job_sync('mockdao', 2, {'job3'}, window=0)
+
+        def add_job(app_client, job_ids):
+            add_pending_job_sync('mockdao', 2, {'job3', 'job4'}, window=0)
+
+        with mock.patch('app.controllers.webhook.get_app_client'), \
+                mock.patch('app.controllers.webhook.sync_job_issue_status_comment', side_effect=add_job):
+            assert flush_pending_job_syncs(int(time.time())) == 1
+        item = PendingJobSync.objects(github_owner_id=2).first()
+        assert sorted(item.job_ids) == ['job3', 'job4']
+        assert item.claim_at is None
+
+    def test_retry_fail_event(self):
+        self.clear_db()
+        WebhookEvent.drop_collection()
+        enqueue_webhook_event('delivery-fail', 'pull_request', self.request_data)
+
+        with mock.patch('app.controllers.webhook.process_pr_event', side_effect=ValueError('github error')):
+            for attempts in range(1, settings.ICPDAO_TASK_MAX_ATTEMPTS):
+                assert handler({}, None) == {'count': 1}
+                event = WebhookEvent.objects(delivery_id='delivery-fail').first()
+                assert event.attempts == attempts
+                assert event.status == WebhookEventStatus.INIT
+                assert 'github error' in event.error
+                assert event.expire_at is None
+
+            assert handler({}, None) == {'count': 1}
+            event = WebhookEvent.objects(delivery_id='delivery-fail').first()
+            assert event.attempts == settings.ICPDAO_TASK_MAX_ATTEMPTS
+            assert event.status == WebhookEventStatus.FAIL
+            assert event.expire_at > datetime.datetime.utcnow()
+            # 失败的事件不再重试
+            assert handler({}, None) == {'count': 0}